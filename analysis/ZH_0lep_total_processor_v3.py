@@ -33,6 +33,7 @@ from utils.variables_def import (
 )
 from utils.jet_tight_id import compute_jet_id
 from utils.xgb_tools import XGBHelper
+from utils.profiling import StageProfiler
 import itertools
 
 def make_vector(obj):
@@ -64,7 +65,7 @@ def make_vector_met(met):
 
 
 class TOTAL_Processor(processor.ProcessorABC):
-    def __init__(self, xsec=0.89, nevts=3000, isMC=True, dataset_name=None, is_MVA=False, run_eval=True):
+    def __init__(self, xsec=0.89, nevts=3000, isMC=True, dataset_name=None, is_MVA=False, run_eval=True, profile=False):
         self.xsec = xsec
         self.nevts = nevts
         self.dataset_name = dataset_name
@@ -73,6 +74,7 @@ class TOTAL_Processor(processor.ProcessorABC):
         self._trees = {regime: defaultdict(list) for regime in ["boosted", "resolved"]} if is_MVA else None
         self.run_eval= run_eval
         self._histograms = {}
+        self.profiler = StageProfiler(enabled=profile)
         self.bdt_eval_boost=XGBHelper(os.path.join("xgb_model", "bdt_model_boosted.json"), ["H_mass", "H_pt", "HT","btag_max","btag_min","btag_prod","dr_bb_ave","dm_bb_bb_min","dphi_H_MET","dphi_untag_MET","pt_tag_max","n_untag"])
         self.bdt_eval_res=XGBHelper(os.path.join("xgb_model", "bdt_model_resolved.json"), ["H_mass", "H_pt", "HT","dphi_H_MET","dm_bb_bb_min","m_bbj","n_untag","btag_min", "pt_untag_max","dr_bb_ave","dphi_untag_MET"])
         self._histograms["cutflow_0l"] = hist.Hist(
@@ -169,6 +171,9 @@ class TOTAL_Processor(processor.ProcessorABC):
         #for bdt train label
         #label_value = 1 if is_signal else 0
 
+        prof = self.profiler
+        prof.begin()
+        prof.mark("weights", n)
         weight_array = np.ones(n) * ( self.xsec / self.nevts)
         weights = Weights(n)
         weights.add("norm", weight_array)
@@ -176,6 +181,7 @@ class TOTAL_Processor(processor.ProcessorABC):
         
         output["cutflow_0l"].fill(cut="raw", weight=np.sum(weights.weight()))
         
+        prof.mark("selection", n)
         #object configuration
         muons = events.Muon[(events.Muon.pt > 10) & (np.abs(events.Muon.eta) < 2.5) & events.Muon.tightId & (events.Muon.pfRelIso03_all < 0.15)]
         electrons = events.Electron[(events.Electron.pt > 15) & (np.abs(events.Electron.eta) < 2.4) & (events.Electron.cutBased >= 4) & (events.Electron.pfRelIso03_all < 0.15)]
@@ -308,6 +314,7 @@ class TOTAL_Processor(processor.ProcessorABC):
 
       
         n_boost = len(weights_boosted)
+        prof.mark("bdt", n_boost, n_out=n_boost)
         bdt_boosted = {
             "H_mass": ak.to_numpy(higgs_boost.mass),
             "H_pt": ak.to_numpy(higgs_boost.pt),
@@ -343,6 +350,7 @@ class TOTAL_Processor(processor.ProcessorABC):
 
         #resolved
         #bef res 
+        prof.mark("selection", n)
         bef_mask_res = mask0 & (n_single_bjets >= 3)
         output["cutflow_0l"].fill(cut="bef_resolved", weight=np.sum(weights.weight()[bef_mask_res]))
         output["dphi_J_MET_bef_resolved"].fill(min_dphi_res[bef_mask_res], weight=weights.weight()[bef_mask_res])
@@ -444,6 +452,7 @@ class TOTAL_Processor(processor.ProcessorABC):
         )
 
         n_res = len(weights_res)
+        prof.mark("bdt", n_res, n_out=n_res)
         bdt_resolved = {
             "mass_H": ak.to_numpy(mass_H),
             "pt_H": ak.to_numpy(pt_H),
@@ -480,6 +489,7 @@ class TOTAL_Processor(processor.ProcessorABC):
             output["trees"] = self._trees
             for regime, trees in self._trees.items():
                 print(f"[DEBUG] Regime '{regime}' has {len(trees)} entries")
+        output["profile"] = prof.result()
         return output 
     def postprocess(self, accumulator):
       
@@ -18,20 +18,25 @@ from boost_histogram import storage
 from collections import defaultdict
 from collections import Counter
 from utils.xgb_tools import XGBHelper
+from utils.profiling import StageProfiler
+from utils.rng import CounterRNG
+from utils.views import view
+from utils.pairing import BBPairing
+from utils.p4cache import P4, P4Cache
+from utils.btag_eff import EffMap, count_hist, count_jets, efficiencies, lookup
+from utils.hist_book import build
+from utils.lookup_table import LookupTable
 import correctionlib
 import gzip
 from utils.deltas_array import (
     delta_r,
     clean_by_dr,
+    overlap_mask,
     delta_phi,
     delta_eta
 )
 from utils.variables_def import (
-    min_dm_bb_bb,
-    dr_bb_bb_avg,
-    m_bbj,
-    dr_bb_avg,
-    higgs_kin
+    dr_bb_avg
 )
 
 def make_vector(obj):
@@ -94,16 +99,9 @@ def _mask_lepton_overlap(jets, leptons, dr=0.4):
     if leptons is None:
         return ak.ones_like(jets.pt, dtype=bool)
     
-    # Build all jet–lepton pairs per event: shape [evt, njet, nlep]
-    pairs = ak.cartesian({"j": jets, "l": leptons}, axis=1, nested=True)
-    
-    # ΔR^2
-    dphi = np.arctan2(np.sin(pairs.j.phi - pairs.l.phi), np.cos(pairs.j.phi - pairs.l.phi))
-    deta = pairs.j.eta - pairs.l.eta
-    dr2 = dphi * dphi + deta * deta
-    
-    # Keep jets that are farther than dr from ALL leptons.
-    return ak.all(dr2 > (dr * dr), axis=2)
+    # min-ΔR kernel on the flat buffers (no [evt, njet, nlep] pair array)
+    mask, _ = overlap_mask(jets, leptons, dr)
+    return mask
 
 
 def _btag_wp_threshold(self, working_point="M"):
@@ -255,48 +253,6 @@ def _eval_corr_vectorized(corr, **arrays):
         
     return corr.evaluate(*vals)
 
-#----------------------------------------------------------------------------------------------------------------------------------------------
-def _rng_normal_like(objs, seed=12345, size=None):
-    """
-    Deterministic N(0,1) per (event, object-index). Works for jagged arrays.
-    Requires fields: objs.event and objs.pt
-    Returns a flat numpy float64 array of the same flattened length as objs.
-    """
-    # Per-object keys
-    evt = ak.broadcast_arrays(objs.event, objs.pt)[0]
-    idx = ak.local_index(objs.pt, axis=1)
-    
-    e = ak.to_numpy(ak.flatten(evt)).astype(np.uint64)
-    j = ak.to_numpy(ak.flatten(idx)).astype(np.uint64)
-    s = np.uint64(seed)
-    
-    def _mix(x):
-        x = (x + np.uint64(0x9E3779B97F4A7C15)) & np.uint64(0xFFFFFFFFFFFFFFFF)
-        z = x
-        z = (z ^ (z >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9) & np.uint64(0xFFFFFFFFFFFFFFFF)
-        z = (z ^ (z >> np.uint64(27))) * np.uint64(0x94D049BB133111EB) & np.uint64(0xFFFFFFFFFFFFFFFF)
-        z = z ^ (z >> np.uint64(31))
-        return z
-        
-    h1 = _mix(e ^ (j + s))
-    h2 = _mix(e ^ (j + s + np.uint64(0xA5A5A5A5A5A5A5A5)))
-    
-    inv_2_53 = np.float64(1.0 / (1 << 53))
-    u1 = ((h1 >> np.uint64(11)).astype(np.float64)) * inv_2_53
-    u2 = ((h2 >> np.uint64(11)).astype(np.float64)) * inv_2_53
-    
-    # Avoid exact 0 or 1 to be safe for log
-    eps = np.finfo(np.float64).tiny
-    onem = np.nextafter(1.0, 0.0)
-    u1 = np.clip(u1, eps, onem)
-    u2 = np.clip(u2, eps, onem)
-    
-    # Box–Muller
-    r = np.sqrt(-2.0 * np.log(u1))
-    theta = np.float64(2.0 * np.pi) * u2
-    z = r * np.cos(theta)
-    return z
-
 #----------------------------------------------------------------------------------------------------------------------------------------------
 def _clip_nextafter(x, lo, hi):
     lo2 = np.nextafter(lo, 1.0)
@@ -309,32 +265,6 @@ def _clip_nextafter(x, lo, hi):
 def _unflatten_like(flat, counts):
     return ak.unflatten(ak.Array(flat), counts)
 
-#----------------------------------------------------------------------------------------------------------------------------------------------
-def _lookup_th2_vals(x, y, xedges, yedges, vals):
-    # Accept ak.Array or numpy, return 1D numpy array
-    x_np = np.asarray(ak.to_numpy(x), dtype=float).ravel()
-    y_np = np.asarray(ak.to_numpy(y), dtype=float).ravel()
-    
-    nx, ny = len(xedges) - 1, len(yedges) - 1
-    
-    x_min = np.nextafter(xedges[0], xedges[1]); x_max = np.nextafter(xedges[-1], xedges[0])
-    y_min = np.nextafter(yedges[0], yedges[1]); y_max = np.nextafter(yedges[-1], yedges[0])
-    
-    x_np = np.clip(x_np, x_min, x_max)
-    y_np = np.clip(y_np, y_min, y_max)
-    
-    ix = np.clip(np.digitize(x_np, xedges, right=False) - 1, 0, nx - 1)
-    iy = np.clip(np.digitize(y_np, yedges, right=False) - 1, 0, ny - 1)
-    
-    if vals.shape == (ny, nx):
-        out = vals[iy, ix]
-    elif vals.shape == (nx, ny):
-        out = vals[ix, iy]
-    else:
-        raise RuntimeError(f"Bad TH2 shape {vals.shape}")
-    
-    return out
-
 # =========================================================
 # Auto-booking histograms with hist.Hist (1D & 2D)
 # =========================================================
@@ -495,7 +425,7 @@ class AutoHistDict(dict):
 
 #----------------------------------------------------------------------------------------------------------------------------------------------
 class TOTAL_Processor(processor.ProcessorABC):
-    def __init__(self, xsec=1.0, nevts=1.0, isMC=True, dataset_name=None, isMVA=True,  run_eval=False):
+    def __init__(self, xsec=1.0, nevts=1.0, isMC=True, dataset_name=None, isMVA=True,  run_eval=False, profile=False, btag_eff_map=None, btag_eff_counts=False):
         self.xsec = xsec
         self.nevts = nevts
         self.isMC = isMC
@@ -506,6 +436,10 @@ class TOTAL_Processor(processor.ProcessorABC):
         
         self._trees = {regime: defaultdict(list) for regime in ["boosted", "resolved"]} if isMVA else None
         self._histograms = AutoHistDict(parent_proc=self)
+        self.profiler = StageProfiler(enabled=profile)
+        self._btag_eff = EffMap(btag_eff_map, selection="TOTAL_Processor") if btag_eff_map else None   # b-tag ε map of the sample (make_btag_eff.py)
+        self.btag_eff_counts = btag_eff_counts   # efficiency-map production (make_btag_eff.py --processor 2lep): count the b-tag jets and stop
+        self.rng = CounterRNG(seed=12345)   # smearing draws keyed by (run, lumi, event, object index)
         
         self.bdt_eval_boosted = XGBHelper(os.path.join("xgb_model", "bdt_model_boosted.json"), 
                                          ["H_mass", "H_pt","H_eta", "Z_pt", "HT", "pt_ratio","puppimet_pt", "btag_min", "dr_bb_bb_ave" , 
@@ -555,31 +489,23 @@ class TOTAL_Processor(processor.ProcessorABC):
             
         #--- Electron ID Tight SFs (2024 combined egamma) ---#
         self.ele_id_root = os.path.join(CORR_DIR, "merged_EGamma_SF2D_Tight.root")
-        self._ele_id_edges_x = self._ele_id_edges_y = self._ele_id_vals = None
+        self._ele_id_sf = None   # utils.lookup_table.LookupTable: (nominal, up, down) SF on the TH2 axes
         
         try:
             with uproot.open(self.ele_id_root) as f:
-                h = f["EGamma_SF2D"]
-                self._ele_id_edges_x = h.axes[0].edges()
-                self._ele_id_edges_y = h.axes[1].edges()
-                self._ele_id_vals = h.values()
+                self._ele_id_sf = LookupTable.from_hist(f["EGamma_SF2D"], variations=True)
         except Exception as e:
             print(f"[ANA:ElectronID] Failed to load TH2: {e}")
             
         #--- HLT Ele30 TightID (2023D proxy) / Need to change later (expected at the beginning of September) ---#
         self.ele_hlt_root = os.path.join(CORR_DIR, "egammaEffi.txt_EGM2D.root")
-        self._ele_hlt_edges_x = self._ele_hlt_edges_y = None
-        self._ele_hlt_effD = self._ele_hlt_effM = None
+        self._ele_hlt_eff = None   # LookupTable: (data, MC) efficiencies, one index for both
         
         try:
             with uproot.open(self.ele_hlt_root) as f:
                 keys = {k.split(";")[0] for k in f.keys()}
                 if "EGamma_EffData2D" in keys and "EGamma_EffMC2D" in keys:
-                    hD = f["EGamma_EffData2D"]; hM = f["EGamma_EffMC2D"]
-                    self._ele_hlt_edges_x = hD.axes[0].edges()
-                    self._ele_hlt_edges_y = hD.axes[1].edges()
-                    self._ele_hlt_effD = hD.values()
-                    self._ele_hlt_effM = hM.values()
+                    self._ele_hlt_eff = LookupTable.from_hist(f["EGamma_EffData2D"], f["EGamma_EffMC2D"])
                 else:
                     print("[ANA:EleHLT] No eff histos found; Ele HLT SFs disabled.")
         except Exception as e:
@@ -742,6 +668,10 @@ class TOTAL_Processor(processor.ProcessorABC):
         ###################################    
 
         
+        n_ev = n   # `n` is reused below for the smearing random numbers
+        prof = self.profiler
+        prof.begin()
+        prof.mark("weights", n_ev)
         weights = Weights(n)
         
         if self.isMC:
@@ -754,13 +684,11 @@ class TOTAL_Processor(processor.ProcessorABC):
             
         output = self._histograms.spawn_accumulator()
       
+        prof.mark("egm", n_ev)
         # =============================== #
         # STEP 2 : EGM energy corrections #
         # =============================== #
         ele_all = events.Electron
-        
-        if "event" not in ak.fields(ele_all):
-            ele_all = ak.with_field(ele_all, ak.broadcast_arrays(events.event, ele_all.pt)[0], "event")
             
         scEta    = ele_all.superclusterEta
         absScEta = np.abs(scEta)
@@ -797,7 +725,7 @@ class TOTAL_Processor(processor.ProcessorABC):
             )
             smear_width = _unflatten_like(smear_width_flat, counts)
         
-            n = _unflatten_like(_rng_normal_like(ele_all), counts)  # deterministic per electron
+            n = self.rng.normal(events, ele_all, "egm_smear")  # deterministic per electron
             _val = ele_all.pt * (1.0 + smear_width * n)
             ele_corr_pt = ak.values_astype(ak.where(_val > 0.0, _val, 0.0), "float32")
             ElectronCorr = ak.with_field(ele_all, ele_corr_pt, "pt")
@@ -807,6 +735,7 @@ class TOTAL_Processor(processor.ProcessorABC):
 
 
 
+        prof.mark("jec_jer", n_ev)
         # ================================== #
         # STEP 3 : JEC + JER for AK4 PFPuppi #
         # ================================== #
@@ -905,7 +834,7 @@ class TOTAL_Processor(processor.ProcessorABC):
             pt_corr = ak.where(has_gen, pt_matched, pt_corr)
             
             # Unmatched: stochastic (deterministic per-jet)
-            n = _unflatten_like(_rng_normal_like(jets_in), counts)
+            n = self.rng.normal(events, jets_in, "jer_smear")
             sigma = res * np.sqrt(np.maximum(sf_nom**2 - 1.0, 0.0))
             smear_factor = 1.0 + sigma * n
             pt_corr = ak.where(~has_gen, pt * smear_factor, pt_corr)
@@ -926,6 +855,7 @@ class TOTAL_Processor(processor.ProcessorABC):
             jerFactor = ak.values_astype(ak.ones_like(pt_jec), "float32")
         jets = ak.with_field(jets, jerFactor, "jerFactor")
 
+        prof.mark("type1_met", n_ev)
         # ================== #
         # STEP 4: Type-1 MET #
         # ================== #
@@ -1017,10 +947,8 @@ class TOTAL_Processor(processor.ProcessorABC):
                 else:
                     res = ak.zeros_like(pt)
 
-                # deterministic RNG per (event, jet)
-                if "event" not in ak.fields(jets_in):
-                    jets_in = ak.with_field(jets_in, ak.broadcast_arrays(events.event, jets_in.pt)[0], "event")
-                n = _unflatten_like(_rng_normal_like(jets_in), counts)
+                # deterministic RNG per (run, lumi, event, jet); same draws as the nominal smear
+                n = self.rng.normal(events, jets_in, "jer_smear")
 
                 def _smear(pt_in, pt_gen_in, has_gen_in, sf_in, res_in, n_in):
                     # matched: hybrid; unmatched: stochastic
@@ -1184,6 +1112,7 @@ class TOTAL_Processor(processor.ProcessorABC):
         # S T A R T   T H E   A N A L Y S I S               #
         ######################################################
         
+        prof.mark("selection", n_ev)
         # STEP0: Raw events
         output["eventflow_boosted"].fill(cut="raw", weight=np.sum(weights.weight()))
         output["eventflow_resolved"].fill(cut="raw", weight=np.sum(weights.weight()))
@@ -1234,6 +1163,9 @@ class TOTAL_Processor(processor.ProcessorABC):
         # ===================== #
         # https://btv-wiki.docs.cern.ch/PerformanceCalibration/fixedWPSFRecommendations/#scale-factor-recommendations-for-event-reweighting
         
+        prof.mark("btag", n_ev)
+        if self.btag_eff_counts and not (self.isMC and self._btag_sf_node is not None):
+            raise RuntimeError("[BTAG] efficiency counts need MC and the b-tag SF JSON (WP threshold)")
         if self.isMC and (self._btag_sf_node is not None):
             # --- choose the jet collection and tagger/WP you want to correct --- #
             jets_for_btag = single_jets                 
@@ -1246,45 +1178,18 @@ class TOTAL_Processor(processor.ProcessorABC):
             flav   = ak.to_numpy(ak.flatten(getattr(jets_for_btag, "hadronFlavour", ak.zeros_like(jets_for_btag.pt))))
             passed = ak.to_numpy(ak.flatten(getattr(jets_for_btag, score_field) >= thr))
         
+            if self.btag_eff_counts:
+                # efficiency-map production: jet counts of the whole chunk, no event selection
+                output["btag_eff_counts"] = build(count_hist())
+                output["btag_eff_counts"].view()[...] += count_jets(pt, abseta, flav, passed)
+                output["profile"] = prof.result(n_out=0)
+                return output
             
-            pt_edges  = np.array([20.0, 30.0, 50.0, 70.0, 100.0, 140.0, 200.0, 300.0, 600.0], dtype=float)
-            eta_edges = np.array([0.0, 2.5], dtype=float)
-        
-            nx, ny = len(pt_edges) - 1, len(eta_edges) - 1
-        
-            def _eff_table_for_flav(target_flav):
-                # digitize into bins
-                ix = np.clip(np.digitize(pt, pt_edges, right=False) - 1, 0, nx - 1)
-                iy = np.clip(np.digitize(abseta, eta_edges, right=False) - 1, 0, ny - 1)
-                mask = (flav == target_flav)
-                # accumulators
-                den = np.zeros((ny, nx), dtype=np.int64)
-                num = np.zeros((ny, nx), dtype=np.int64)
-                if mask.any():
-                    np.add.at(den, (iy[mask], ix[mask]), 1)
-                    np.add.at(num, (iy[mask], ix[mask]), passed[mask].astype(np.int64))
-                # raw ε
-                with np.errstate(divide="ignore", invalid="ignore"):
-                    eff = num / np.maximum(den, 1)  # avoids div by 0
-                # handle empty bins
-                if mask.any():
-                    global_rate = float(np.mean(passed[mask]))
-                else:
-                    global_rate = 0.0
-                eff[den == 0] = global_rate
-                # clip to sane range
-                eff = np.clip(eff, 1e-6, 1 - 1e-6)
-                return eff
-        
-            eff_b   = _eff_table_for_flav(5)
-            eff_c   = _eff_table_for_flav(4)
-            eff_udg = _eff_table_for_flav(0)   
-        
-            # --- lookup ε for each jet --- #
-            eff_flat = np.ones_like(pt, dtype=float)
-            eff_flat[flav == 5] = _lookup_th2_vals(pt[flav == 5],   abseta[flav == 5],   pt_edges, eta_edges, eff_b)
-            eff_flat[flav == 4] = _lookup_th2_vals(pt[flav == 4],   abseta[flav == 4],   pt_edges, eta_edges, eff_c)
-            eff_flat[flav == 0] = _lookup_th2_vals(pt[flav == 0],   abseta[flav == 0],   pt_edges, eta_edges, eff_udg)
+            # --- lookup ε for each jet: the sample's map (make_btag_eff.py), else this chunk's jets --- #
+            if self._btag_eff is not None:
+                eff_flat = self._btag_eff.evaluate(flav, abseta, pt)
+            else:
+                eff_flat = lookup(efficiencies(count_jets(pt, abseta, flav, passed)), flav, abseta, pt)
         
             counts  = ak.num(jets_for_btag.pt, axis=1)
             effs_mc = _unflatten_like(eff_flat, counts)
@@ -1298,6 +1203,7 @@ class TOTAL_Processor(processor.ProcessorABC):
                 systematic="central"
             )
             
+        prof.mark("selection", n_ev)
         output["n_lep_step0"].fill(n=n_leptons, weight=weights.weight())
         
         #------------------------------------------------------------------------------------------------------------------------------------------#
@@ -1313,6 +1219,7 @@ class TOTAL_Processor(processor.ProcessorABC):
         # need ≥2 leptons 
         has_2lep = ak.num(leptons) >= 2
         if not np.any(ak.to_numpy(has_2lep)):
+            output["profile"] = prof.result(n_out=0)
             return output
 
         # work only on events with ≥2 leptons 
@@ -1384,8 +1291,10 @@ class TOTAL_Processor(processor.ProcessorABC):
         # =========================
         # Z window on the same pair
         # =========================
-        leps_trig = leptons[mask_step_trig]                   
-        mll = (make_vector(leps_trig[:, 0]) + make_vector(leps_trig[:, 1])).mass
+        # px/py/pz/E of the two leptons (and b-jets) computed once, gathered by every block below
+        p4 = P4Cache()
+        leps_trig = view(leptons, mask_step_trig)
+        mll = (p4.of(leps_trig[:, 0]) + p4.of(leps_trig[:, 1])).mass
         output["mass_Z_bef"].fill(m_ll=mll, weight=w_all[mask_step_trig])
         in_zwin = ak.to_numpy((mll > 80.0) & (mll < 100.0))
 
@@ -1476,14 +1385,12 @@ class TOTAL_Processor(processor.ProcessorABC):
         output["eventflow_boosted"].fill(cut="step2", weight=np.sum(w2a))
         output["n_bjets_double_bef"].fill(n=n_double_bjets[mask_step2a], weight=w2a)
 
-        # slice boosted collections at step2a
-        double_jets_2a       = double_jets[mask_step2a]
-        double_bjets_2a      = double_bjets[mask_step2a]
-        double_untag_jets_2a = double_untag_jets[mask_step2a]
+        # view of the boosted jets at step2a (only the b-tag score is gathered)
+        double_jets_2a       = view(double_jets, mask_step2a)
 
         # b-tag score distributions of leading/subleading double-AK4 jets
-        has_ge1_db = ak.num(double_jets_2a) >= 1
-        has_ge2_db = ak.num(double_jets_2a) >= 2
+        has_ge1_db = double_jets_2a.num() >= 1
+        has_ge2_db = double_jets_2a.num() >= 2
 
         if ak.any(has_ge1_db):
             lead_db_score = ak.to_numpy(ak.fill_none(double_jets_2a[has_ge1_db][:, 0].btagUParTAK4probbb, 0.0))
@@ -1513,20 +1420,20 @@ class TOTAL_Processor(processor.ProcessorABC):
 
         # slice step3 (pre-tight-btag) collections
         weights_boosted      = weights.weight()[full_mask_double]
-        double_bjets_boosted = double_bjets[full_mask_double]
-        double_jets_boosted  = double_jets[full_mask_double]
-        double_untag_boosted = double_untag_jets[full_mask_double]
+        double_bjets_boosted = view(double_bjets,      full_mask_double)
+        double_jets_boosted  = view(double_jets,       full_mask_double)
+        double_untag_boosted = view(double_untag_jets, full_mask_double)
 
         # cutflow step3 (pre-tight-btag) + basic counters
         output["eventflow_boosted"].fill(cut="step3", weight=np.sum(weights_boosted))
         output["n_bjets_bef_boosted"].fill(n=n_double_bjets[full_mask_double], weight=weights_boosted)
 
-        n_jets_boo     = ak.num(double_jets_boosted)
-        n_untagged_boo = ak.num(double_untag_boosted)
+        n_jets_boo     = double_jets_boosted.num()
+        n_untagged_boo = double_untag_boosted.num()
         output["n_jets_bef_boosted"].fill(   n=n_jets_boo,     weight=weights_boosted)
         output["n_untag_bef_boosted"].fill(  n=n_untagged_boo, weight=weights_boosted)
 
-        met_boosted = PuppiMETCorr[full_mask_double]
+        met_boosted = view(PuppiMETCorr, full_mask_double)
         ht_boosted  = ak.sum(double_jets_boosted.pt, axis=1)
 
         # channel masks aligned to step3 slice
@@ -1569,8 +1476,8 @@ class TOTAL_Processor(processor.ProcessorABC):
         output["pt_b2_boosted"].fill(pt_b2=sublead_bb.pt, weight=weights_boosted_sel)
 
         # build 4-vectors
-        lead_bb_vec    = make_vector(lead_bb)
-        sublead_bb_vec = make_vector(sublead_bb)
+        lead_bb_vec    = p4.of(lead_bb)
+        sublead_bb_vec = p4.of(sublead_bb)
         higgs_boost    = lead_bb_vec + sublead_bb_vec
 
         output["mass_H_boosted"].fill(m_H=higgs_boost.mass, weight=weights_boosted_sel)
@@ -1582,11 +1489,11 @@ class TOTAL_Processor(processor.ProcessorABC):
         output["dR_bb_bb_ave_boosted"].fill(dr=lead_bb_vec.delta_r(sublead_bb_vec), weight=weights_boosted_sel)
 
         # leptons (selected)
-        leptons_boosted_sel = leptons[full_mask_double][pass_np]
+        leptons_boosted_sel = view(leptons, full_mask_double)[pass_np]
         lead_lep_boo = leptons_boosted_sel[:, 0]
         sub_lep_boo  = leptons_boosted_sel[:, 1]
-        vec_lead_lep_boo = make_vector(lead_lep_boo)
-        vec_sub_lep_boo  = make_vector(sub_lep_boo)
+        vec_lead_lep_boo = p4.of(lead_lep_boo)
+        vec_sub_lep_boo  = p4.of(sub_lep_boo)
         dilepton_boosted  = vec_lead_lep_boo + vec_sub_lep_boo
 
         output["pt_ll_boosted"].fill(  pt_ll=dilepton_boosted.pt,    weight=weights_boosted_sel)
@@ -1603,11 +1510,11 @@ class TOTAL_Processor(processor.ProcessorABC):
         output["dr_HZ_boosted"].fill(    dr=higgs_boost.delta_r(dilepton_boosted),           weight=weights_boosted_sel)
 
         # proxy jet for Δφ and pt
-        lead_untag_boo = ak.firsts(double_untag_boosted_sel)
-        fallback_bjet  = ak.firsts(double_bjets_boosted_sel[
+        lead_untag_boo = ak.firsts(double_untag_boosted_sel.materialize())
+        fallback_bjet  = ak.firsts(double_bjets_boosted_sel.materialize()[
             ak.argmin(double_bjets_boosted_sel.btagUParTAK4probbb, axis=1, keepdims=True)
         ])
-        has_untag_boo  = ak.num(double_untag_boosted_sel) > 0
+        has_untag_boo  = double_untag_boosted_sel.num() > 0
         proxy_jet_boo  = ak.where(has_untag_boo, lead_untag_boo, fallback_bjet)
 
         dphi_proxy_Z_boo = delta_phi_raw(proxy_jet_boo.phi, dilepton_boosted.phi)
@@ -1648,9 +1555,9 @@ class TOTAL_Processor(processor.ProcessorABC):
             output["mumu_dr_ll_boosted"].fill(  dr=vec_lead_lep_boo[mu_after_sel].delta_r(vec_sub_lep_boo[mu_after_sel]),          weight=w_mu)
             output["mumu_dR_bb_bb_ave_boosted"].fill(dr=lead_bb_vec.delta_r(sublead_bb_vec)[mu_after_sel], weight=w_mu)
 
-            output["mumu_n_untag_boosted"].fill(n=ak.to_numpy(ak.num(double_untag_boosted_sel[mu_after_sel])), weight=w_mu)
-            output["mumu_n_jets_boosted"].fill( n=ak.to_numpy(ak.num(double_jets_boosted_sel[mu_after_sel], axis=1)), weight=w_mu)
-            output["mumu_n_bjets_boosted"].fill(n=ak.to_numpy(ak.num(double_bjets_boosted_sel[mu_after_sel], axis=1)), weight=w_mu)
+            output["mumu_n_untag_boosted"].fill(n=ak.to_numpy(double_untag_boosted_sel[mu_after_sel].num()), weight=w_mu)
+            output["mumu_n_jets_boosted"].fill( n=ak.to_numpy(double_jets_boosted_sel[mu_after_sel].num()), weight=w_mu)
+            output["mumu_n_bjets_boosted"].fill(n=ak.to_numpy(double_bjets_boosted_sel[mu_after_sel].num()), weight=w_mu)
 
         if np.any(ee_after_sel):
             w_ee = weights_boosted_sel[ee_after_sel]
@@ -1681,12 +1588,13 @@ class TOTAL_Processor(processor.ProcessorABC):
             output["ee_deta_HZ_boosted"].fill(deta=delta_eta_vec(higgs_boost[ee_after_sel], dilepton_boosted[ee_after_sel]),     weight=w_ee)
             output["ee_dr_HZ_boosted"].fill(  dr=higgs_boost[ee_after_sel].delta_r(dilepton_boosted[ee_after_sel]),              weight=w_ee)
 
-            output["ee_n_untag_boosted"].fill(n=ak.to_numpy(ak.num(double_untag_boosted_sel[ee_after_sel])), weight=w_ee)
-            output["ee_n_jets_boosted"].fill( n=ak.to_numpy(ak.num(double_jets_boosted_sel[ee_after_sel], axis=1)), weight=w_ee)
-            output["ee_n_bjets_boosted"].fill(n=ak.to_numpy(ak.num(double_bjets_boosted_sel[ee_after_sel], axis=1)), weight=w_ee)
+            output["ee_n_untag_boosted"].fill(n=ak.to_numpy(double_untag_boosted_sel[ee_after_sel].num()), weight=w_ee)
+            output["ee_n_jets_boosted"].fill( n=ak.to_numpy(double_jets_boosted_sel[ee_after_sel].num()), weight=w_ee)
+            output["ee_n_bjets_boosted"].fill(n=ak.to_numpy(double_bjets_boosted_sel[ee_after_sel].num()), weight=w_ee)
             output["ee_dr_ll_boosted"].fill(  dr=vec_lead_lep_boo[ee_after_sel].delta_r(vec_sub_lep_boo[ee_after_sel]),          weight=w_ee)
             output["ee_dR_bb_bb_ave_boosted"].fill(dr=lead_bb_vec.delta_r(sublead_bb_vec)[ee_after_sel], weight=w_ee)
 
+        prof.mark("bdt", len(weights_boosted_sel), n_out=len(weights_boosted_sel))
         # ---------- BDT inputs (selected events only) ----------
         bdt_boosted = {
             "H_mass":         ak.to_numpy(higgs_boost.mass),
@@ -1754,7 +1662,7 @@ class TOTAL_Processor(processor.ProcessorABC):
                     output["ee_dm_shapes_boosted"].fill(       cut_index=i, dm=ak.to_numpy(dm_boosted[ele_mask_cut]),                                         weight=w_e)
                     output["ee_dRZh_shapes_boosted"].fill(     cut_index=i, dr=ak.to_numpy(higgs_boost.delta_r(dilepton_boosted)[ele_mask_cut]),              weight=w_e)
                     output["ee_ptratio_shapes_boosted"].fill(  cut_index=i, ratio=ak.to_numpy(pt_ratio_boo[ele_mask_cut]),                                    weight=w_e)
-                    output["ee_Njets_shapes_boosted"].fill(    cut_index=i, n_jets=ak.to_numpy(ak.num(double_jets_boosted_sel[ele_mask_cut], axis=1)),        weight=w_e)
+                    output["ee_Njets_shapes_boosted"].fill(    cut_index=i, n_jets=ak.to_numpy(double_jets_boosted_sel[ele_mask_cut].num()),        weight=w_e)
                     output["ee_btag_min_shapes_boosted"].fill( cut_index=i, btag=ak.to_numpy(btag_min_boosted[ele_mask_cut]),                                 weight=w_e)
 
                 if np.any(mu_mask_cut):
@@ -1774,7 +1682,7 @@ class TOTAL_Processor(processor.ProcessorABC):
                     output["mumu_dm_shapes_boosted"].fill(       cut_index=i, dm=ak.to_numpy(dm_boosted[mu_mask_cut]),                                          weight=w_mu)
                     output["mumu_dRZh_shapes_boosted"].fill(     cut_index=i, dr=ak.to_numpy(higgs_boost.delta_r(dilepton_boosted)[mu_mask_cut]),               weight=w_mu)
                     output["mumu_ptratio_shapes_boosted"].fill(  cut_index=i, pt_ratio=ak.to_numpy(pt_ratio_boo[mu_mask_cut]),                                  weight=w_mu)
-                    output["mumu_Njets_shapes_boosted"].fill(    cut_index=i, n_jets=ak.to_numpy(ak.num(double_jets_boosted_sel[mu_mask_cut], axis=1)),         weight=w_mu)
+                    output["mumu_Njets_shapes_boosted"].fill(    cut_index=i, n_jets=ak.to_numpy(double_jets_boosted_sel[mu_mask_cut].num()),         weight=w_mu)
                     output["mumu_btag_min_shapes_boosted"].fill( cut_index=i, btag=ak.to_numpy(btag_min_boosted[mu_mask_cut]),                                   weight=w_mu)
 
                                 
@@ -1787,6 +1695,7 @@ class TOTAL_Processor(processor.ProcessorABC):
         #######################################
         # STEP 2b: At least 3 single AK4 jets #
         #######################################
+        prof.mark("selection", n_ev)
         print("\nStarting STEP 2b: At least 3 single AK4 jets")
         mask_step2b = mask_step_trig_z & (n_single_jets >= 3)
         print(f"After STEP 2b: {np.sum(mask_step2b)} events remaining")
@@ -1812,20 +1721,17 @@ class TOTAL_Processor(processor.ProcessorABC):
         weights.add("btag_UParTAK4B_T_resolved", w_btag_evt)
 
         w2b = weights.weight()[np.asarray(mask_step2b)]
-        single_jets_2b = single_jets[mask_step2b]
-        output["n_single_jets_bef"].fill(n=ak.num(single_jets_2b), weight=weights.weight()[mask_step2b])
-        
-        n_single_jets_2b = ak.num(single_jets_2b)
-        single_untag_jets_2b = single_untag_jets[mask_step2b]
-        n_single_untag_jets_2b = ak.num(single_untag_jets_2b)
-        single_bjets_2b = single_bjets[mask_step2b]
-        n_single_bjets_2b = ak.num(single_bjets_2b)
-        output["n_bjets_single_bef"].fill(n=n_single_bjets_2b, weight=weights.weight()[mask_step2b])
-        has_ge1_sj = ak.num(single_jets_2b) >= 1
+        single_jets_2b = view(single_jets, mask_step2b)
+        n_single_jets_2b = single_jets_2b.num()
+        output["n_single_jets_bef"].fill(n=n_single_jets_2b, weight=w2b)
+        
+        n_single_bjets_2b = n_single_bjets[mask_step2b]
+        output["n_bjets_single_bef"].fill(n=n_single_bjets_2b, weight=w2b)
+        has_ge1_sj = n_single_jets_2b >= 1
         lead_sj_score = ak.to_numpy(single_jets_2b[has_ge1_sj][:, 0].btagUParTAK4B)
         w_lead_sj = ak.to_numpy(w2b[has_ge1_sj])
         
-        has_ge2_sj = ak.num(single_jets_2b) >= 2
+        has_ge2_sj = n_single_jets_2b >= 2
         sublead_sj_score = ak.to_numpy(single_jets_2b[has_ge2_sj][:, 1].btagUParTAK4B)
         w_sublead_sj = ak.to_numpy(w2b[has_ge2_sj])
         
@@ -1855,27 +1761,32 @@ class TOTAL_Processor(processor.ProcessorABC):
         weights_res = weights.weight()[full_mask_res]
         
         # Filtered objects
-        single_bjets_resolved = single_bjets[full_mask_res]
-        single_jets_resolved = single_jets[full_mask_res]
-        single_untag_jets_resolved = single_untag_jets[full_mask_res]
+        single_bjets_resolved = view(single_bjets, full_mask_res)
+        single_jets_resolved = view(single_jets, full_mask_res)
+        single_untag_jets_resolved = view(single_untag_jets, full_mask_res)
         
         vec_single_bjets_resolved = make_vector(single_bjets_resolved)
         vec_single_jets_resolved = make_vector(single_jets_resolved)
+
+        # one 2+2 pairing for dm_bb_bb_min, dr_bb_bb_ave, mbbj and the Higgs candidate
+        pairing_res = BBPairing(single_bjets_resolved, single_jets_resolved, btag="btagUParTAK4B")
+        dm_bb_bb_res = pairing_res.dm_min
+        dr_bb_bb_res = pairing_res.dr_ave
         
-        n_jets_res = ak.num(single_jets_resolved)
-        n_bjets_res = ak.num(single_bjets_resolved)
-        n_untagged_res = ak.num(single_untag_jets_resolved)
+        n_jets_res = single_jets_resolved.num()
+        n_bjets_res = single_bjets_resolved.num()
+        n_untagged_res = single_untag_jets_resolved.num()
         
         output["n_untag_resolved"].fill(n=n_untagged_res, weight=weights_res)
         output["n_jets_resolved"].fill(n=n_jets_res, weight=weights_res)
         output["n_bjets_resolved"].fill(n=n_bjets_res, weight=weights_res)
         ##leptons
-        leptons_res = leptons[full_mask_res]
+        leptons_res = view(leptons, full_mask_res)
         lead_lep_res = leptons_res[:, 0]
         sub_lep_res = leptons_res[:, 1]
         
-        vec_lead_lep_res = make_vector(lead_lep_res)
-        vec_sub_lep_res = make_vector(sub_lep_res)
+        vec_lead_lep_res = p4.of(lead_lep_res)
+        vec_sub_lep_res = p4.of(sub_lep_res)
         dilepton_res = vec_lead_lep_res + vec_sub_lep_res
         
         output["dr_ll_resolved"].fill(dr=vec_lead_lep_res.delta_r(vec_sub_lep_res), weight=weights_res)
@@ -1883,13 +1794,8 @@ class TOTAL_Processor(processor.ProcessorABC):
         output["mass_Z_resolved"].fill(m_ll=dilepton_res.mass, weight=weights_res)
         
         ### higgs dependent
-        mass_H, pt_H, phi_H, eta_H = higgs_kin(vec_single_bjets_resolved, vec_single_jets_resolved)
-        vec_H_res = ak.zip({
-            "pt": pt_H,
-            "eta": eta_H,
-            "phi": phi_H,
-            "mass": mass_H,
-        }, with_name="PtEtaPhiMLorentzVector", behavior=vector.behavior)
+        mass_H, pt_H, phi_H, eta_H = pairing_res.higgs
+        vec_H_res = P4.from_ptetaphim(pt_H, eta_H, phi_H, mass_H)
         
         output["mass_H_resolved"].fill(m_H=mass_H, weight=weights_res)
         output["pt_H_resolved"].fill(pt_H=pt_H, weight=weights_res)
@@ -1906,12 +1812,12 @@ class TOTAL_Processor(processor.ProcessorABC):
         
         # --- Quantities independent of Higgs definition ---
         output["dm_bb_bb_min_resolved"].fill(
-            dm=min_dm_bb_bb(vec_single_bjets_resolved, all_jets=vec_single_jets_resolved),
+            dm=dm_bb_bb_res,
             weight=weights_res
         )
         
         output["dr_bb_bb_ave_resolved"].fill(
-            dr=dr_bb_bb_avg(vec_single_bjets_resolved, all_jets=vec_single_jets_resolved),
+            dr=dr_bb_bb_res,
             weight=weights_res
         )
         
@@ -1920,7 +1826,7 @@ class TOTAL_Processor(processor.ProcessorABC):
             weight=weights_res
         )
         
-        met_res = PuppiMETCorr[full_mask_res]
+        met_res = view(PuppiMETCorr, full_mask_res)
         output["met_resolved"].fill(
             met=met_res.pt,
             weight=weights_res
@@ -1936,7 +1842,7 @@ class TOTAL_Processor(processor.ProcessorABC):
             weight=weights_res
         )
         
-        mbbj_resolved = m_bbj(vec_single_bjets_resolved, vec_single_jets_resolved)
+        mbbj_resolved = pairing_res.mbbj
         output["m_bbj_resolved"].fill(
             mbbj=mbbj_resolved,
             weight=weights_res
@@ -1944,16 +1850,16 @@ class TOTAL_Processor(processor.ProcessorABC):
         
         # Define a fallback: bjet with minimum b-tag
         fallback_bjet_res = ak.firsts(
-            single_bjets_resolved[
+            single_bjets_resolved.materialize()[
                 ak.argmin(single_bjets_resolved.btagUParTAK4B, axis=1, keepdims=True)
             ]
         )
         
         # Regular leading untagged jet
-        leading_untagged_res = ak.firsts(single_untag_jets_resolved)
+        leading_untagged_res = ak.firsts(single_untag_jets_resolved.materialize())
         
         # Condition: if there are untagged jets
-        has_untagged_res = ak.num(single_untag_jets_resolved) > 0
+        has_untagged_res = single_untag_jets_resolved.num() > 0
         
         # Final jet: use untagged if it exists, else fallback
         proxy_jet_res = ak.where(has_untagged_res, leading_untagged_res, fallback_bjet_res)
@@ -1983,7 +1889,7 @@ class TOTAL_Processor(processor.ProcessorABC):
             output["mumu_mass_Z_resolved"].fill(m_ll=dilepton_res[mumu_mask_res].mass, weight=w_res_mm)
             
             ### higgs dependent
-            mass_H_res_m, pt_H_res_m, phi_H_res_m, eta_H_res_m = higgs_kin(vec_single_bjets_resolved[mumu_mask_res], vec_single_jets_resolved[mumu_mask_res])
+            mass_H_res_m, pt_H_res_m, phi_H_res_m, eta_H_res_m = (x[mumu_mask_res] for x in pairing_res.higgs)
             vec_H_res_mu = ak.zip({
                 "pt": pt_H_res_m,
                 "eta": eta_H_res_m,
@@ -2005,12 +1911,12 @@ class TOTAL_Processor(processor.ProcessorABC):
             
             # --- Quantities independent of Higgs definition ---
             output["mumu_dm_bb_bb_min_resolved"].fill(
-                dm=min_dm_bb_bb(vec_single_bjets_resolved[mumu_mask_res], all_jets=vec_single_jets_resolved[mumu_mask_res]),
+                dm=dm_bb_bb_res[mumu_mask_res],
                 weight=w_res_mm
             )
             
             output["mumu_dr_bb_bb_ave_resolved"].fill(
-                dr=dr_bb_bb_avg(vec_single_bjets_resolved[mumu_mask_res], all_jets=vec_single_jets_resolved[mumu_mask_res]),
+                dr=dr_bb_bb_res[mumu_mask_res],
                 weight=w_res_mm
             )
             
@@ -2065,7 +1971,7 @@ class TOTAL_Processor(processor.ProcessorABC):
             output["ee_mass_Z_resolved"].fill(m_ll=dilepton_res[ee_mask_res].mass, weight=w_res_ee)
             
             ### higgs dependent
-            mass_H_res_e, pt_H_res_e, phi_H_res_e, eta_H_res_e = higgs_kin(vec_single_bjets_resolved[ee_mask_res], vec_single_jets_resolved[ee_mask_res])
+            mass_H_res_e, pt_H_res_e, phi_H_res_e, eta_H_res_e = (x[ee_mask_res] for x in pairing_res.higgs)
             vec_H_res_e = ak.zip({
                 "pt": pt_H_res_e,
                 "eta": eta_H_res_e,
@@ -2087,12 +1993,12 @@ class TOTAL_Processor(processor.ProcessorABC):
             
             # --- Quantities independent of Higgs definition ---
             output["ee_dm_bb_bb_min_resolved"].fill(
-                dm=min_dm_bb_bb(vec_single_bjets_resolved[ee_mask_res], all_jets=vec_single_jets_resolved[ee_mask_res]),
+                dm=dm_bb_bb_res[ee_mask_res],
                 weight=w_res_ee
             )
             
             output["ee_dr_bb_bb_ave_resolved"].fill(
-                dr=dr_bb_bb_avg(vec_single_bjets_resolved[ee_mask_res], all_jets=vec_single_jets_resolved[ee_mask_res]),
+                dr=dr_bb_bb_res[ee_mask_res],
                 weight=w_res_ee
             )
             
@@ -2117,7 +2023,7 @@ class TOTAL_Processor(processor.ProcessorABC):
                 weight=w_res_ee
             )
             
-            mbbj_resolved_e = m_bbj(vec_single_bjets_resolved[ee_mask_res], vec_single_jets_resolved[ee_mask_res])
+            mbbj_resolved_e = mbbj_resolved[ee_mask_res]
             output["ee_m_bbj_resolved"].fill(
                 mbbj=mbbj_resolved_e,
                 weight=w_res_ee
@@ -2128,6 +2034,7 @@ class TOTAL_Processor(processor.ProcessorABC):
                 weight=w_res_ee
             )
             
+        prof.mark("bdt", len(weights_res), n_out=len(weights_res))
         bdt_resolved = {
             "H_mass": ak.to_numpy(vec_H_res.mass),
             "H_pt": ak.to_numpy(vec_H_res.pt),
@@ -2138,9 +2045,9 @@ class TOTAL_Processor(processor.ProcessorABC):
             "puppimet_pt": ak.to_numpy(met_res.pt),
             "btag_max": ak.to_numpy(ak.max(single_bjets_resolved.btagUParTAK4B, axis=1)),
             "btag_min": ak.to_numpy(ak.min(single_bjets_resolved.btagUParTAK4B, axis=1)),
-            "dr_bb_bb_ave": ak.to_numpy(dr_bb_bb_avg(vec_single_bjets_resolved, all_jets=vec_single_jets_resolved)),
+            "dr_bb_bb_ave": ak.to_numpy(dr_bb_bb_res),
             "dr_bb_ave": ak.to_numpy(dr_bb_avg(vec_single_bjets_resolved)),
-            "dm_bb_bb_min": ak.to_numpy(min_dm_bb_bb(vec_single_bjets_resolved, all_jets=vec_single_jets_resolved)),
+            "dm_bb_bb_min": ak.to_numpy(dm_bb_bb_res),
             "dphi_HZ": ak.to_numpy(np.abs(vec_H_res.delta_phi(dilepton_res))),
             "deta_HZ": ak.to_numpy(delta_eta_vec(dilepton_res,vec_H_res)),
             "dr_HZ": ak.to_numpy(vec_H_res.delta_r(dilepton_res)),
@@ -2198,15 +2105,15 @@ class TOTAL_Processor(processor.ProcessorABC):
                     output["ee_dRbb_shapes_resolved"].fill(
                         cut_index=i, dr=dr_bb_avg(vec_single_bjets_resolved[ele_mask_cut]), weight=w)
                     output["ee_dRbbbb_shapes_resolved"].fill(
-                        cut_index=i, dr=dr_bb_bb_avg(vec_single_bjets_resolved[ele_mask_cut], vec_single_jets_resolved[ele_mask_cut]), weight=w)
+                        cut_index=i, dr=dr_bb_bb_res[ele_mask_cut], weight=w)
                     output["ee_dm_shapes_resolved"].fill(
-                        cut_index=i, dm=min_dm_bb_bb(vec_single_bjets_resolved[ele_mask_cut], all_jets=vec_single_jets_resolved[ele_mask_cut]), weight=w)
+                        cut_index=i, dm=dm_bb_bb_res[ele_mask_cut], weight=w)
                     output["ee_dRZh_shapes_resolved"].fill(
                         cut_index=i, dr=vec_H_res.delta_r(dilepton_res)[ele_mask_cut], weight=w)
                     output["ee_ptratio_shapes_resolved"].fill(
                         cut_index=i, pt_ratio=pt_ratio_res[ele_mask_cut], weight=w)
                     output["ee_Njets_shapes_resolved"].fill(
-                        cut_index=i, n_jets=ak.num(single_jets_resolved[ele_mask_cut], axis=1), weight=w)
+                        cut_index=i, n_jets=single_jets_resolved[ele_mask_cut].num(), weight=w)
                     output["ee_btag_min_shapes_resolved"].fill(
                         cut_index=i, btag=ak.min(single_bjets_resolved[ele_mask_cut].btagUParTAK4B, axis=1), weight=w)
                     output["ee_mbbj_shapes_resolved"].fill(cut_index=i, m=mbbj_resolved[ele_mask_cut], weight=w)
@@ -2237,15 +2144,15 @@ class TOTAL_Processor(processor.ProcessorABC):
                     output["mumu_dRbb_shapes_resolved"].fill(
                         cut_index=i, dr=dr_bb_avg(vec_single_bjets_resolved[mu_mask_cut]), weight=w)
                     output["mumu_dRbbbb_shapes_resolved"].fill(
-                        cut_index=i, dr=dr_bb_bb_avg(vec_single_bjets_resolved[mu_mask_cut], vec_single_jets_resolved[mu_mask_cut]), weight=w)
+                        cut_index=i, dr=dr_bb_bb_res[mu_mask_cut], weight=w)
                     output["mumu_dm_shapes_resolved"].fill(
-                        cut_index=i, dm=min_dm_bb_bb(vec_single_bjets_resolved[mu_mask_cut], all_jets=vec_single_jets_resolved[mu_mask_cut]), weight=w)
+                        cut_index=i, dm=dm_bb_bb_res[mu_mask_cut], weight=w)
                     output["mumu_dRZh_shapes_resolved"].fill(
                         cut_index=i, dr=vec_H_res.delta_r(dilepton_res)[mu_mask_cut], weight=w)
                     output["mumu_ptratio_shapes_resolved"].fill(
                         cut_index=i, pt_ratio=pt_ratio_res[mu_mask_cut], weight=w)
                     output["mumu_Njets_shapes_resolved"].fill(
-                        cut_index=i, n_jets=ak.num(single_jets_resolved[mu_mask_cut], axis=1), weight=w)
+                        cut_index=i, n_jets=single_jets_resolved[mu_mask_cut].num(), weight=w)
                     output["mumu_btag_min_shapes_resolved"].fill(
                         cut_index=i, btag=ak.min(single_bjets_resolved[mu_mask_cut].btagUParTAK4B, axis=1), weight=w)
                     output["mumu_mbbj_shapes_resolved"].fill(cut_index=i, m=mbbj_resolved[mu_mask_cut], weight=w)
@@ -2255,6 +2162,7 @@ class TOTAL_Processor(processor.ProcessorABC):
             for regime, trees in self._trees.items():
                 print(f"\n[DEBUG] Regime '{regime}' has {len(trees)} entries")
                 
+        output["profile"] = prof.result()
         return output
         
     def postprocess(self, accumulator):
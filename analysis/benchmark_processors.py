@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+# Throughput / memory benchmark of the analysis processors on synthetic skim-format events.
+#
+#   python benchmark_processors.py --nevents 50000 --processor wh 2lep 0lep
+#
+# The input file is generated offline with the branch set of skimming/skim_config.py
+# (`branches_to_keep`) plus the event-level branches written by run_skim.py, so no grid
+# access is needed. Every processor reports wall time, events/s and peak RSS per STEP
+# block through utils.profiling.StageProfiler.
+
+import os
+import sys
+import time
+import argparse
+import resource
+import warnings
+import numpy as np
+import awkward as ak
+import uproot
+from coffea.nanoevents import NanoEventsFactory, BaseSchema
+
+from utils.profiling import StageProfiler, StageProfile, rss_mb
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "skimming"))
+from skim_config import branches_to_keep
+
+warnings.filterwarnings("ignore", message="Missing cross-reference index")
+
+# Fields the processors read that are added/renamed after the skim
+EXTRA_FIELDS = {
+    "Muon": ["pfRelIso03_all"],
+    "Jet": ["pt_regressed", "svIdx1", "svIdx2"],
+    "PuppiMET": ["ptUnclusteredUp", "ptUnclusteredDown", "phiUnclusteredUp", "phiUnclusteredDown"],
+}
+
+# Mean multiplicities after the skim preselection
+MULTIPLICITY = {"Muon": 0.7, "Electron": 0.6, "Jet": 5.5}
+
+#----------------------------------------------------------------------------------------------------------------------------------------------
+
+def _synth_field(rng, coll, field, n_tot):
+    '''Rough but non-degenerate per-object values for one branch.'''
+    if field.endswith("_corr"):   # skim-time corrected copies (run_skim.py --corrections)
+        return _synth_field(rng, coll, field[:-len("_corr")], n_tot)
+    if field in ("pt", "upart_pt_reg", "pt_regressed", "pt_genMatched"):
+        lo = {"Muon": 10., "Electron": 15., "Jet": 20.}.get(coll, 20.)
+        return (lo + rng.exponential(40., n_tot)).astype("float32")
+    if field == "eta":
+        return rng.uniform(-2.5, 2.5, n_tot).astype("float32")
+    if field == "superclusterEta":
+        return rng.uniform(-2.5, 2.5, n_tot).astype("float32")
+    if field == "phi":
+        return rng.uniform(-np.pi, np.pi, n_tot).astype("float32")
+    if field == "mass":
+        m = {"Muon": 0.105, "Electron": 0.000511}.get(coll)
+        return np.full(n_tot, m, "float32") if m is not None else rng.uniform(2., 20., n_tot).astype("float32")
+    if field == "charge":
+        return rng.choice(np.array([-1, 1], "int32"), n_tot)
+    if field in ("tightId", "looseId", "mvaIso_WP90", "passJetIdTight", "passJetIdTightLepVeto"):
+        return rng.random(n_tot) < 0.9
+    if field == "cutBased":
+        return rng.integers(0, 5, n_tot).astype("int32")
+    if field.startswith("pfRelIso"):
+        return rng.exponential(0.08, n_tot).astype("float32")
+    if field == "seedGain":
+        return np.full(n_tot, 12, "uint8")
+    if field == "r9":
+        return rng.uniform(0.5, 1.0, n_tot).astype("float32")
+    if field == "rawFactor":
+        return rng.uniform(0.0, 0.3, n_tot).astype("float32")
+    if field == "area":
+        return rng.normal(0.5, 0.03, n_tot).astype("float32")
+    if field.startswith("btag"):
+        return rng.beta(0.4, 1.2, n_tot).astype("float32")
+    if field == "UParTAK4RegPtRawRes":
+        return rng.uniform(0.05, 0.2, n_tot).astype("float32")
+    if field == "hadronFlavour":
+        return rng.choice(np.array([0, 4, 5], "int32"), n_tot, p=[0.7, 0.1, 0.2])
+    if field == "partonFlavour":
+        return rng.choice(np.array([0, 1, 4, 5, 21], "int32"), n_tot)
+    if field in ("svIdx1", "svIdx2"):
+        return rng.integers(-1, 3, n_tot).astype("int32")
+    raise KeyError(f"no generator for {coll}_{field}")
+
+#----------------------------------------------------------------------------------------------------------------------------------------------
+
+def synthetic_skim(nevents, seed=1):
+    '''`nevents` synthetic events as the run_skim.py output dict ({"run": array, "Jet": records, ...}).'''
+    rng = np.random.default_rng(seed)
+    out = {
+        "run":                    np.full(nevents, 1, "uint32"),
+        "luminosityBlock":        (np.arange(nevents) // 1000 + 1).astype("uint32"),
+        "event":                  np.arange(nevents, dtype="uint64"),
+        "has_trigger":            np.ones(nevents, bool),
+        "trigger_type":           rng.choice(np.array([1 << 2, 1 << 4, 1 << 6, 1 << 8], "int64"), nevents),
+        "fixedGridRhoFastjetAll": rng.uniform(10., 40., nevents).astype("float32"),
+        "genWeight":              np.ones(nevents, "float32"),
+    }
+    for coll, fields in branches_to_keep.items():
+        fields = list(fields) + EXTRA_FIELDS.get(coll, [])
+        if coll in MULTIPLICITY:
+            counts = rng.poisson(MULTIPLICITY[coll], nevents)
+            n_tot = int(counts.sum())
+            out[coll] = ak.zip({f: ak.unflatten(_synth_field(rng, coll, f, n_tot), counts) for f in fields})
+        elif coll == "PuppiMET":
+            out.update({f"{coll}_{f}": (rng.exponential(50., nevents) if "pt" in f else rng.uniform(-np.pi, np.pi, nevents)).astype("float32") for f in fields})
+        else:
+            out.update({f"{coll}_{f}": rng.poisson(40, nevents).astype("int32") for f in fields})
+
+    # pt_regressed is what run_analysis.py reads; keep it consistent with the skim's upart_pt_reg
+    out["Jet"] = ak.with_field(out["Jet"], out["Jet"].upart_pt_reg, "pt_regressed")
+    return out
+
+
+def make_synthetic_skim(path, nevents, seed=1):
+    '''Write `nevents` synthetic events in the skim format (Events + Meta trees).'''
+    out = synthetic_skim(nevents, seed)
+    with uproot.recreate(path) as f:
+        f["Events"] = out
+        f["Meta"] = {"nEvents": np.array([nevents], dtype="i8")}
+    print(f"[BENCH] Wrote {nevents} synthetic events to {path} ({os.path.getsize(path) / 1024**2:.1f} MB)")
+
+#----------------------------------------------------------------------------------------------------------------------------------------------
+
+def load_events(path):
+    events = NanoEventsFactory.from_root(path, treepath="Events", schemaclass=BaseSchema).events()
+    fields = events.fields
+    for coll in list(branches_to_keep) + ["PuppiMET"]:
+        names = [f[len(coll) + 1:] for f in fields if f.startswith(f"{coll}_")]
+        if names:
+            events[coll] = ak.zip({f: events[f"{coll}_{f}"] for f in names})
+    return events
+
+
+def build_processor(name, run_eval):
+    if name == "wh":
+        from Wh_processor import Wh_Processor
+        return Wh_Processor(xsec=1.0, nevts=1.0, isMC=True, dataset_name="BENCH", isMVA=False, runEval=run_eval)
+    if name == "2lep":
+        from ZH_2lep_total_processor import TOTAL_Processor
+        return TOTAL_Processor(xsec=1.0, nevts=1.0, isMC=True, dataset_name="BENCH", isMVA=False, run_eval=run_eval)
+    if name == "0lep":
+        from ZH_0lep_total_processor_v3 import TOTAL_Processor
+        return TOTAL_Processor(xsec=1.0, nevts=1.0, isMC=True, dataset_name="BENCH", is_MVA=False, run_eval=run_eval)
+    raise ValueError(f"unknown processor '{name}'")
+
+#----------------------------------------------------------------------------------------------------------------------------------------------
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--nevents", type=int, default=20000)
+    parser.add_argument("--input", type=str, default="bench_synthetic.root", help="Synthetic file (regenerated with --regenerate)")
+    parser.add_argument("--regenerate", action="store_true")
+    parser.add_argument("--processor", nargs="+", default=["wh", "2lep", "0lep"], choices=["wh", "2lep", "0lep"])
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument("--run-eval", action="store_true", help="Evaluate the BDTs (needs xgb_model/)")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    if args.regenerate or not os.path.exists(args.input):
+        make_synthetic_skim(args.input, args.nevents, seed=args.seed)
+
+    rss0 = rss_mb()
+    events = load_events(args.input)
+    n = len(events)
+
+    summary = []
+    for name in args.processor:
+        proc = build_processor(name, args.run_eval)
+        proc.profiler = StageProfiler(sample_rss=True)
+        profile = StageProfile()
+        t0 = time.perf_counter()
+        for _ in range(args.repeat):
+            profile += proc.process(events)["profile"]
+        wall = time.perf_counter() - t0
+        proc.profiler.close()
+
+        print(f"\n[BENCH] {name}: {n * args.repeat} events in {wall:.2f} s")
+        profile.report()
+        summary.append((name, wall, n * args.repeat / wall))
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.
+    print(f"\n{'processor':<10}{'wall[s]':>10}{'ev/s':>12}")
+    for name, wall, evs in summary:
+        print(f"{name:<10}{wall:>10.2f}{evs:>12.4g}")
+    print(f"[BENCH] RSS at start {rss0:.0f} MB, process peak {peak:.0f} MB")
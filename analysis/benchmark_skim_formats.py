@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+# File size and read throughput of the skim formats on synthetic events.
+#
+#   python benchmark_skim_formats.py --nevents 200000 --repeat 3
+#
+# The same synthetic skim (benchmark_processors.synthetic_skim) is written as
+#   root-lzma       run_skim.py default (LZMA 9)
+#   root-zstd       skimming/compact_skims.py default (ZSTD 5, ZLIB 6 without zstandard)
+#   parquet-zstd    run_skim.py --format parquet (utils/skim_io.write_parquet)
+# and read back the way run_analysis.py does: the ROOT files branch by branch plus the zip into
+# collections (utils/skim_io.load_root), the Parquet file with the column projection of
+# utils/skim_io.load_parquet. Both a full read and an entry range (--range-fraction of the file,
+# taken from the middle) are timed; everything the analysis reads is materialized.
+
+import os
+import time
+import argparse
+import tempfile
+import warnings
+import numpy as np
+import awkward as ak
+import uproot
+
+from benchmark_processors import synthetic_skim
+from utils.skim_io import ROW_GROUP_SIZE, load_root, load_parquet, write_parquet
+warnings.filterwarnings("ignore", message="Missing cross-reference index")
+
+#----------------------------------------------------------------------------------------------------------------------------------------------
+
+def as_records(out):
+    '''Scalar collections (PuppiMET_pt, Pileup_nPU, ...) of the synthetic dict as records, like the skimmer output.'''
+    out, colls = dict(out), {}
+    for k in [k for k in out if "_" in k and k.split("_", 1)[0] in ("PuppiMET", "Pileup", "PV")]:
+        coll, field = k.split("_", 1)
+        colls.setdefault(coll, {})[field] = out.pop(k)
+    out.update({c: ak.zip(fields) for c, fields in colls.items()})
+    return out
+
+
+def write_root(out, path, codec, nevents):
+    with uproot.recreate(path, compression=codec) as f:
+        # explicit TTree (nJet / Jet_* branches), like the skims
+        tree = f.mktree("Events", {k: v.type if isinstance(v, ak.Array) else v.dtype for k, v in out.items()})
+        tree.extend(out)
+        f["Meta"] = {"nEvents": np.array([nevents], dtype="i8")}
+
+
+def read_root(path, entry_start=None, entry_stop=None):
+    with uproot.open(path) as f:
+        return load_root(f["Events"], True, "BENCH", entry_start, entry_stop)
+
+
+def read_parquet(path, entry_start=None, entry_stop=None):
+    # ak.from_parquet reads eagerly: the returned records are already in memory
+    return load_parquet(path, True, "BENCH", entry_start, entry_stop)
+
+
+def timed(fn, repeat):
+    best = None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        n = len(fn())
+        dt = time.perf_counter() - t0
+        best = dt if best is None else min(best, dt)
+    return n, best
+
+#----------------------------------------------------------------------------------------------------------------------------------------------
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--nevents", type=int, default=200000)
+    parser.add_argument("--repeat", type=int, default=3, help="reads per format (best time reported)")
+    parser.add_argument("--row-group-size", type=int, default=ROW_GROUP_SIZE)
+    parser.add_argument("--range-fraction", type=float, default=0.25, help="size of the timed entry range")
+    parser.add_argument("--outdir", type=str, default=None, help="keep the files here (default: temporary directory)")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    flat = synthetic_skim(args.nevents, seed=args.seed)
+    out  = as_records(flat)
+    n = args.nevents
+    start = int(n * (0.5 - args.range_fraction / 2))
+    stop  = start + int(n * args.range_fraction)
+
+    try:
+        import zstandard  # noqa: F401
+        fast = ("root-zstd", uproot.ZSTD(5))
+    except ImportError:
+        fast = ("root-zlib", uproot.ZLIB(6))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        outdir = args.outdir or tmp
+        os.makedirs(outdir, exist_ok=True)
+        files = {}
+        for name, codec in [("root-lzma", uproot.LZMA(9)), fast]:
+            files[name] = os.path.join(outdir, f"bench_{name}.root")
+            write_root(flat, files[name], codec, n)
+        files["parquet-zstd"] = os.path.join(outdir, "bench_parquet-zstd.parquet")
+        write_parquet(out, files["parquet-zstd"], {"nEvents": n, "sumGenWeight": float(n), "corrVersion": 0},
+                      row_group_size=args.row_group_size)
+
+        rows = []
+        for name, path in files.items():
+            if path.endswith(".parquet"):
+                full = lambda: read_parquet(path)
+                part = lambda: read_parquet(path, start, stop)
+            else:
+                full = lambda: read_root(path)
+                part = lambda: read_root(path, start, stop)
+            n_full, t_full = timed(full, args.repeat)
+            n_part, t_part = timed(part, args.repeat)
+            assert n_full == n and n_part == stop - start, f"{name}: read {n_full}/{n_part} events"
+            rows.append((name, os.path.getsize(path) / 2**20, t_full, n / t_full, t_part, n_part / t_part))
+
+    print(f"\n{'format':<14}{'size[MB]':>10}{'full[s]':>10}{'ev/s':>12}{'range[s]':>10}{'ev/s':>12}")
+    for name, size, t_full, r_full, t_part, r_part in rows:
+        print(f"{name:<14}{size:>10.1f}{t_full:>10.3f}{r_full:>12.4g}{t_part:>10.3f}{r_part:>12.4g}")
+    print(f"[BENCH] {n} events, range [{start}, {stop}), Parquet row groups of {args.row_group_size} events")
+
+
+if __name__ == "__main__":
+    main()
@@ -6,8 +6,8 @@ import shutil
 output_dir = "CMSSW_15_0_5/src/outputs/"
 os.makedirs(output_dir, exist_ok=True)
 
-# Move all .root files to the output directory
-root_files = glob.glob("*.root")
+# Move all .root files (and profile/diagnostics sidecars) to the output directory
+root_files = glob.glob("*.root") + glob.glob("*.profile.json") + glob.glob("*.diagnostics.json")
 for f in root_files:
     try:
         shutil.move(f, os.path.join(output_dir, os.path.basename(f)))
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+# b-tag efficiency map of one MC sample (utils/btag_eff.py).
+# Runs a processor in its counting mode (btag_eff_counts=True: object selection and jet cleaning
+# as in the analysis, then the jets are counted per flavour, |eta|, pt and WP decision) over every
+# file of the sample, as partitions on a local dask cluster like run_dask.py, and writes the
+# efficiencies of the merged counts as a correctionlib JSON for run_analysis.py / run_dask.py
+# --btag-eff. Wh_Processor counts both lepton isolations (corrections "<name>" and "<name>_antiiso"),
+# TOTAL_Processor (--processor 2lep) its one selection; EffMap picks the correction of its selection.
+#
+#   python make_btag_eff.py --json ../skimmed.json --dataset TTto2L2Nu --output btag_eff_TTto2L2Nu.json --workers 16
+#   python make_btag_eff.py --json ../skimmed.json --dataset DYto2L --processor 2lep --output btag_eff_DY_2lep.json
+#   python run_analysis.py ... --btag-eff btag_eff_TTto2L2Nu.json
+
+import os
+import argparse
+import warnings
+import numpy as np
+
+from Wh_processor import Wh_Processor
+from run_dask import dataset_files, open_skim
+from utils.btag_eff import FLAVOURS, count_corrections, efficiencies, write_map
+from utils.prefetch import CHUNK_SIZE
+from utils.dask_exec import local_client, partitions, run_partitions, worker_cached
+warnings.filterwarnings("ignore", message="Missing cross-reference index")
+
+#----------------------------------------------------------------------------------------------------------------------------------------------
+
+# --processor: the selection recorded in the map
+SELECTIONS = {"wh": "Wh_Processor", "2lep": "TOTAL_Processor"}
+
+def counting_processor(kind, config, corr_version):
+    if kind == "2lep":
+        from ZH_2lep_total_processor import TOTAL_Processor
+        return TOTAL_Processor(xsec=config["xsec"], nevts=config["nevts"], isMC=True, dataset_name=config["dataset_name"],
+                               isMVA=False, btag_eff_counts=True)
+    return Wh_Processor(corr_version=corr_version, btag_eff_counts=True, **config)
+
+
+def count_partition(task, config, kind="wh"):
+    '''{"": {"btag_eff_counts": hist, ...}} of one partition (url, start, stop): the counts of every output directory.'''
+    url, start, stop = task
+    reader, corr_version = open_skim(url, True, config["dataset_name"])
+    events = reader.read(start, stop)
+    reader.report()
+    if len(events) == 0:
+        return {}
+    proc = worker_cached((config["dataset_name"], corr_version, "btag_eff", kind),
+                         lambda: counting_processor(kind, config, corr_version))
+    return {"": {k: v for k, v in proc.process(events).items() if k.split("/")[-1] == "btag_eff_counts"}}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="b-tag efficiency map of an MC sample (correctionlib JSON)")
+    parser.add_argument("--json", type=str, required=True, help="Path to JSON file (or SQLite catalogue .db)")
+    parser.add_argument("--dataset", type=str, required=True, help="Dataset key inside JSON")
+    parser.add_argument("--files", type=str, default=None, help="File indices, e.g. 0-9,12 (default: all)")
+    parser.add_argument("--output", type=str, required=True, help="Output correctionlib JSON")
+    parser.add_argument("--name", type=str, default="UParTAK4B_T_eff", help="Correction name in the JSON")
+    parser.add_argument("--processor", choices=sorted(SELECTIONS), default="wh", help="Selection the jets are counted with")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Worker processes (0: run in this process)")
+    parser.add_argument("--scheduler", type=str, default=None, help="Address of a running dask scheduler instead of a local cluster")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE, help="Entries per partition")
+    args = parser.parse_args()
+
+    meta, entries = dataset_files(args.json, args.dataset, args.files)
+    if meta["isMC"].lower() != "true":
+        raise ValueError(f"[BTAG-EFF] {args.dataset} is not MC")
+    config = {
+        "xsec":         float(meta["xsec"]),
+        "nevts":        int(meta["nevents"]),
+        "isMC":         True,
+        "dataset_name": meta["sample"],
+        "isolations":   ("iso", "antiiso"),
+        "isMVA":        False,
+        "runEval":      False,
+    }
+    tasks = partitions(entries, args.chunk_size)
+    print(f"[BTAG-EFF] Sample: {config['dataset_name']}: {len(entries)} file(s), {sum(entries.values())} entries, "
+          f"{len(tasks)} partition(s)")
+
+    fn = lambda task: count_partition(task, config, args.processor)
+    if args.scheduler:
+        from distributed import Client
+        client = Client(args.scheduler)
+    else:
+        client = local_client(args.workers) if args.workers > 0 else None
+    try:
+        output = run_partitions(client, fn, tasks)
+    finally:
+        if client is not None:
+            client.close()
+
+    if "" not in output:
+        raise RuntimeError(f"[BTAG-EFF] No events read for {args.dataset}")
+    for key, h in sorted(output[""].items()):
+        counts = h.values()
+        eff = efficiencies(counts)
+        for k, flav in enumerate(FLAVOURS):
+            n_jets, n_pass = counts[k].sum(), counts[k, 1].sum()
+            print(f"[BTAG-EFF] {key} flavour {flav}: {n_jets:.0f} jets, {n_pass:.0f} tagged, "
+                  f"{int(np.sum(counts[k].sum(axis=0) == 0))} empty bins, ε in [{eff[k].min():.4f}, {eff[k].max():.4f}]")
+    write_map(args.output, count_corrections(output[""], args.name, f"MC b-tag efficiency of {config['dataset_name']} (UParTAK4B >= WP T)",
+                                             SELECTIONS[args.processor]))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,15 @@
 #!/usr/bin/env python3
 
 import os
-import json
-import glob
 import subprocess
 
-def job_outputs_exist(dataset_key, dataset_info, job_idx, outdir="."):
-    # Default single-file naming 
+from utils.output_index import index_dirs, validate_files
+from utils.catalogue import Catalogue, process_jsons
+from utils.provenance import pack_dir
+from utils.splitting import CostModel, TARGET_WALL, dataset_type, plan, pack, job_spec, unit_suffix
+
+def job_outputs_exist(dataset_key, dataset_info, job_idx, existing):
+    # Default single-file naming (job_idx: file index, or <index>-<first entry> for an entry range)
     candidates = [f"{dataset_key}_{job_idx}.root"]
 
     # If this dataset is TT*, also accept flavor-split outputs
@@ -16,51 +19,71 @@ def job_outputs_exist(dataset_key, dataset_info, job_idx, outdir="."):
         for flav in ("ttLF", "ttCC", "ttBB"):
             candidates.append(f"{sample_base}_{flav}_{job_idx}.root")
 
-    return any(os.path.exists(os.path.join(outdir, c)) for c in candidates)
+    return any(c in existing for c in candidates)
 
 
 OUTPUT_DIR = "."
 DATASET_DIR = "datasets"
 FILES_TO_TRANSFER = ["run_analysis.py", "Wh_processor.py", "x509up", "run_analysis.sh", "utils.tar.gz", "xgb_model.tar.gz"]
-
-json_files = sorted(glob.glob(f"{DATASET_DIR}/*.json"))
-
-for json_path in json_files:
-    with open(json_path) as f:
-        data = json.load(f)
-
-    dataset_basename = os.path.basename(json_path)  
+# Set VALIDATE=1 to also open existing outputs and resubmit the truncated ones
+VALIDATE = os.environ.get("VALIDATE", "0") == "1"
+# CATALOGUE=catalogue.db: datasets from the SQLite catalogue, jobs get it as --json and it records the resubmission
+CATALOGUE = os.environ.get("CATALOGUE")
+# Same splitting as submit_all.py (SPLIT, TARGET_HOURS), so the expected outputs are the same
+SPLIT  = os.environ.get("SPLIT", "1") == "1"
+TARGET = float(os.environ.get("TARGET_HOURS", TARGET_WALL / 3600)) * 3600
+model  = CostModel.load("analysis")
+cat    = Catalogue(CATALOGUE, readonly=True) if CATALOGUE else None
+
+# The jobs import utils/ from utils.tar.gz: packed from the current sources, as in submit_all.py
+HERE = os.path.dirname(os.path.abspath(__file__))
+pack_dir(os.path.join(HERE, "utils"), os.path.join(HERE, "utils.tar.gz"), patterns=("*.py",))
+
+# One listing of the output directory instead of an os.path.exists per job
+existing = index_dirs([OUTPUT_DIR], cache_file=None)[OUTPUT_DIR] or set()
+if VALIDATE:
+    roots = [f for f in existing if f.endswith(".root")]
+    bad = [os.path.basename(u) for u, n in
+           validate_files([os.path.join(OUTPUT_DIR, f) for f in roots], tree=None, branch=None).items() if not n]
+    if bad:
+        print(f"[WARNING] {len(bad)} unreadable outputs will be resubmitted")
+    existing -= set(bad)
+
+for json_name, data, json_path in process_jsons(DATASET_DIR, catalogue=CATALOGUE):
+    dataset_basename = os.path.basename(json_path)
+    dtype = dataset_type(json_name)
 
     for dataset_key, dataset_info in data.items():
-        n_jobs = len(dataset_info["files"])
-        missing_jobs = []
-
-        for i in range(n_jobs):
-            if not job_outputs_exist(dataset_key, dataset_info, i, OUTPUT_DIR):
-                missing_jobs.append(i)
+        counts = cat.counts(dataset_key, "analysis") if cat else {i: None for i in range(len(dataset_info["files"]))}
+        units = plan(dtype, counts, dataset_info["metadata"].get("nevents"), model, TARGET, split=SPLIT)
+        missing_units = [u for u in units if not job_outputs_exist(dataset_key, dataset_info, unit_suffix(u), existing)]
 
-        if not missing_jobs:
+        if not missing_units:
             print(f"All jobs complete for {dataset_key}")
             continue
 
-        print(f"Found {len(missing_jobs)} missing jobs for {dataset_key}")
+        if SPLIT:
+            missing_jobs, _ = pack(missing_units, lambda u: model.cost(dtype, u[3]), TARGET, model.job_overhead)
+        else:
+            missing_jobs = [[u] for u in missing_units]
+        print(f"Found {len(missing_units)} missing files/ranges for {dataset_key}, {len(missing_jobs)} jobs")
 
         resub_joblist = f"resub_joblist_{dataset_key}.txt"
         with open(resub_joblist, "w") as jf:
-            for i in missing_jobs:
-                jf.write(f"{i} {dataset_basename} {dataset_key}\n")
+            for job in missing_jobs:
+                jf.write(f"{job_spec(job)} {dataset_basename} {dataset_key}\n")
 
         resub_jdl = f"resubmit_{dataset_key}.jdl"
         with open(resub_jdl, "w") as f:
             f.write("universe = vanilla\n")
             f.write("executable = run_analysis.sh\n")
-            f.write("arguments = $(jobindex) $(dataset_json) $(dataset_key)\n")
+            f.write("arguments = $(jobspec) $(dataset_json) $(dataset_key)\n")
             f.write(f"transfer_input_files = {', '.join(FILES_TO_TRANSFER)}, $(dataset_json)\n")
             f.write("should_transfer_files = YES\n")
             f.write("when_to_transfer_output = ON_EXIT\n")
-            f.write("output = out/job_$(Cluster)_$(jobindex)_$(dataset_key).out\n")
-            f.write("error  = err/job_$(Cluster)_$(jobindex)_$(dataset_key).err\n")
-            f.write("log    = log/job_$(Cluster)_$(jobindex)_$(dataset_key).log\n")
+            f.write("output = out/job_$(Cluster)_$(Process)_$(dataset_key).out\n")
+            f.write("error  = err/job_$(Cluster)_$(Process)_$(dataset_key).err\n")
+            f.write("log    = log/job_$(Cluster)_$(Process)_$(dataset_key).log\n")
             f.write('+SingularityImage = "/cvmfs/unpacked.cern.ch/registry.hub.docker.com/coffeateam/coffea-dask:latest"\n')
             f.write("+SingularityBindCVMFS = True\n")
             f.write("+JobFlavour = \"workday\"\n")
@@ -68,6 +91,9 @@ for json_path in json_files:
             f.write("request_memory = 3000\n")
             f.write('environment = "X509_USER_PROXY=x509up"\n')
             f.write("X509 = x509up\n")
-            f.write(f"queue jobindex, dataset_json, dataset_key from {resub_joblist}\n")
+            f.write(f"queue jobspec, dataset_json, dataset_key from {resub_joblist}\n")
 
-        subprocess.run(["condor_submit", resub_jdl])
+        res = subprocess.run(["condor_submit", resub_jdl])
+        if CATALOGUE and res.returncode == 0:
+            with Catalogue(CATALOGUE) as wcat:
+                wcat.set_status({(dataset_key, u[0]) for u in missing_units}, "analysis", "submitted")
@@ -1,171 +1,79 @@
-import sys, hist, uproot, time, warnings, os 
-from coffea.nanoevents import NanoEventsFactory, BaseSchema
+import sys, uproot, warnings, os 
 from Wh_processor import Wh_Processor
-import awkward as ak
+from utils.provenance import Provenance
+from utils.hist_io import write_output
+from utils.catalogue import Catalogue, is_catalogue
+from utils.skim_io import is_parquet, load_parquet, load_root, parquet_columns, read_meta_parquet, root_branches
+from utils.remote import RemoteReader
+from utils.prefetch import Prefetcher, accumulate, chunk_ranges, CHUNK_SIZE, DEPTH, MAX_MB
+from utils.btag_eff import count_corrections, write_map
 import numpy as np
+import tempfile
 import json
-import hist as _hist
 import inspect
 import argparse
-from uproot.writing import identify as upid
 from array import array
 warnings.filterwarnings("ignore", message="Missing cross-reference index")
 
-# ------------------ Uproot THx writers with Sumw2 ------------------
-
-def _is_num_axis(ax):
-    return isinstance(ax, (_hist.axis.Regular, _hist.axis.Variable))
-
-#----------------------------------------------------------------------------------------------------------------------------------------------
-
-def _call_to_TH1x(name, title, data, fEntries, fTsumw, fTsumw2, fTsumwx, fTsumwx2, sumw2, xaxis, yaxis, zaxis):
-    """
-    Call identify.to_TH1x with the correct signature for the installed uproot version.
-    """
-    sig = inspect.signature(upid.to_TH1x)
-    params = list(sig.parameters.keys())
-    if len(params) > 0 and params[0] == "classname":
-        return upid.to_TH1x(
-            "TH1D", name, title, data, fEntries, fTsumw, fTsumw2, fTsumwx, fTsumwx2,
-            sumw2, xaxis, yaxis, zaxis
-        )
-    elif "classname" in sig.parameters:
-        return upid.to_TH1x(
-            name, title, data, fEntries, fTsumw, fTsumw2, fTsumwx, fTsumwx2,
-            sumw2, xaxis, yaxis, zaxis, classname="TH1D"
-        )
-    else:
-        return upid.to_TH1x(
-            name, title, data, fEntries, fTsumw, fTsumw2, fTsumwx, fTsumwx2,
-            sumw2, xaxis, yaxis, zaxis
-        )
-
-#----------------------------------------------------------------------------------------------------------------------------------------------
-
-def _call_to_TH2x(name, title, data, fEntries, fTsumw, fTsumw2, fTsumwx, fTsumwx2, fTsumwy, fTsumwy2, sumw2, xaxis, yaxis, zaxis):
-    sig = inspect.signature(upid.to_TH2x)
-    params = list(sig.parameters.keys())
-    if len(params) > 0 and params[0] == "classname":
-        return upid.to_TH2x(
-            "TH2D", name, title, data, fEntries, fTsumw, fTsumw2, fTsumwx, fTsumwx2,
-            fTsumwy, fTsumwy2, sumw2, xaxis, yaxis, zaxis
-        )
-    elif "classname" in sig.parameters:
-        return upid.to_TH2x(
-            name, title, data, fEntries, fTsumw, fTsumw2, fTsumwx, fTsumwx2,
-            fTsumwy, fTsumwy2, sumw2, xaxis, yaxis, zaxis, classname="TH2D"
-        )
-    else:
-        return upid.to_TH2x(
-            name, title, data, fEntries, fTsumw, fTsumw2, fTsumwx, fTsumwx2,
-            fTsumwy, fTsumwy2, sumw2, xaxis, yaxis, zaxis
-        )
-
-#----------------------------------------------------------------------------------------------------------------------------------------------
-
-def write_hist_uproot_sumw2(rootfile, fullpath, h):
-    """
-    Write 1D/2D numeric-axes boost-hist 'hist.Hist' to ROOT TH1/TH2 with Sumw2.
-    Falls back to plain numpy if uproot signature mismatches or axes are categorical.
-    """
-    try:
-        # Skip truly empty
-        if float(np.sum(h.values())) == 0.0:
-            return
-
-        # 1D numeric
-        if h.ndim == 1 and _is_num_axis(h.axes[0]):
-            counts, xedges = h.to_numpy()
-            vari = h.variances()
-            nb = len(xedges) - 1
-
-            data = np.zeros(nb + 2, dtype=np.float64); data[1:-1] = counts
-            sumw2 = np.zeros(nb + 2, dtype=np.float64); sumw2[1:-1] = (vari if vari is not None else counts)
-
-            xcent   = 0.5 * (xedges[:-1] + xedges[1:])
-            fEntries = float((counts**2).sum() / max(sumw2[1:-1].sum(), 1e-12))
-            fTsumw   = float(counts.sum())
-            fTsumw2  = float(sumw2[1:-1].sum())
-            fTsumwx  = float((counts * xcent).sum())
-            fTsumwx2 = float((counts * xcent * xcent).sum())
-
-            xaxis = upid.to_TAxis("xaxis", "xaxis", nb, float(xedges[0]), float(xedges[-1]), xedges.astype(np.float64))
-            yaxis = upid.to_TAxis("yaxis", "yaxis", 0, 0.0, 0.0, None)
-            zaxis = upid.to_TAxis("zaxis", "zaxis", 0, 0.0, 0.0, None)
-
-            th1 = _call_to_TH1x(fullpath, fullpath, data, fEntries, fTsumw, fTsumw2, fTsumwx, fTsumwx2, sumw2, xaxis, yaxis, zaxis)
-            rootfile[fullpath] = th1
-            return
-
-        if h.ndim == 2 and _is_num_axis(h.axes[0]) and _is_num_axis(h.axes[1]):
-            counts, xedges, yedges = h.to_numpy()
-            vari = h.variances()
-            nx, ny = counts.shape
-
-            data = np.zeros((nx + 2, ny + 2), dtype=np.float64); data[1:-1, 1:-1] = counts
-            sumw2 = np.zeros((nx + 2, ny + 2), dtype=np.float64); sumw2[1:-1, 1:-1] = (vari if vari is not None else counts)
-
-            xcent = 0.5 * (xedges[:-1] + xedges[1:])
-            ycent = 0.5 * (yedges[:-1] + yedges[1:])
-            fEntries = float((counts**2).sum() / max(sumw2[1:-1,1:-1].sum(), 1e-12))
-            fTsumw   = float(counts.sum())
-            fTsumw2  = float(sumw2[1:-1,1:-1].sum())
-            fTsumwx  = float((counts * xcent[:, None]).sum())
-            fTsumwx2 = float((counts * (xcent[:, None] ** 2)).sum())
-            fTsumwy  = float((counts * ycent[None, :]).sum())
-            fTsumwy2 = float((counts * (ycent[None, :] ** 2)).sum())
-
-            xaxis = upid.to_TAxis("xaxis", "xaxis", nx, float(xedges[0]), float(xedges[-1]), xedges.astype(np.float64))
-            yaxis = upid.to_TAxis("yaxis", "yaxis", ny, float(yedges[0]), float(yedges[-1]), yedges.astype(np.float64))
-            zaxis = upid.to_TAxis("zaxis", "zaxis", 0, 0.0, 0.0, None)
-
-            th2 = _call_to_TH2x(fullpath, fullpath, data, fEntries, fTsumw, fTsumw2, fTsumwx, fTsumwx2, fTsumwy, fTsumwy2, sumw2, xaxis, yaxis, zaxis)
-            rootfile[fullpath] = th2
-            return
-
-        # Fallback: categorical axes or anything unexpected → write plain numpy 
-        rootfile[fullpath] = h.to_numpy()
-
-    except Exception as e:
-        print(f"[WARN] TH writer failed for {fullpath}: {e} — writing plain numpy without sumw2")
-        rootfile[fullpath] = h.to_numpy()
-
-#----------------------------------------------------------------------------------------------------------------------------------------------
-
 # --- Argument parser --- #
 parser = argparse.ArgumentParser()
-parser.add_argument("--json", type=str, required=True, help="Path to JSON file")
+parser.add_argument("--json", type=str, required=True, help="Path to JSON file (or SQLite catalogue .db)")
 parser.add_argument("--job-index", type=int, required=True)
+parser.add_argument("--entries", type=str, default=None, help="START-STOP: process only this entry range of the file (see utils/splitting.py)")
+parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE, help="Entries per processed chunk (0: whole file/range at once)")
+parser.add_argument("--prefetch", type=int, default=DEPTH, help="Chunks read ahead on a background thread (0: no read-ahead)")
+parser.add_argument("--prefetch-mb", type=float, default=MAX_MB, help="Memory cap [MB] of the chunks held ahead")
 parser.add_argument("--output", type=str, required=True, help="Histogram output ROOT file")
 parser.add_argument("--dataset", type=str, required=True, help="Dataset key inside JSON")
 parser.add_argument("--bdt_output", type=str, default=None, help="Optional: output file for BDT trees")
+parser.add_argument("--profile", action="store_true", help="Record per-stage timing/memory (tree 'profile' + <output>.profile.json)")
+parser.add_argument("--diagnostics", action="store_true", help="Collect sampled summary stats of intermediate corrections")
+parser.add_argument("--diag-fraction", type=float, default=0.01, help="Fraction of events sampled by --diagnostics")
+parser.add_argument("--btag-eff", type=str, default=None, help="b-tag efficiency map of the sample (make_btag_eff.py); default: counted over the whole file first")
 args = parser.parse_args()
+entry_start, entry_stop = (int(x) for x in args.entries.split("-")) if args.entries else (None, None)
 
 # --- Load dataset info --- #
-with open(args.json) as f:
-    all_datasets = json.load(f)
-    
-if args.dataset not in all_datasets:
-    raise ValueError(f"[ERROR] Dataset '{args.dataset}' not found in {args.json}")
+if is_catalogue(args.json):
+    # SQLite catalogue: one indexed lookup of (dataset, job-index)
+    with Catalogue(args.json, readonly=True) as cat:
+        file_to_process, meta = cat.job(args.dataset, args.job_index, stage="analysis")
+        nfiles = cat.totals(args.dataset)["files"]
+else:
+    with open(args.json) as f:
+        all_datasets = json.load(f)
+
+    if args.dataset not in all_datasets:
+        raise ValueError(f"[ERROR] Dataset '{args.dataset}' not found in {args.json}")
 
-dataset = all_datasets[args.dataset]
-meta = dataset["metadata"]
-files = dataset["files"]
+    dataset = all_datasets[args.dataset]
+    meta = dataset["metadata"]
+    files = dataset["files"]
+    nfiles = len(files)
 
-# Safe check
-if args.job_index >= len(files):
-    raise IndexError(f"[ERROR] job-index {args.job_index} is out of range (0 - {len(files)-1})")
+    # Safe check
+    if args.job_index >= len(files):
+        raise IndexError(f"[ERROR] job-index {args.job_index} is out of range (0 - {len(files)-1})")
 
-file_to_process = files[args.job_index]
+    file_to_process = files[args.job_index]
+
+# --- Provenance of this output (input file, dataset metadata, code, corrections, models) --- #
+provenance = Provenance(
+    processor=inspect.getsourcefile(Wh_Processor),
+    driver=os.path.abspath(__file__),
+    here=os.path.dirname(os.path.abspath(__file__)),
+).record(file_to_process, args.dataset, meta, job_index=args.job_index, entries=args.entries)
 dataset_name = meta["sample"]
 nevts   = int(meta["nevents"])
 isMC    = meta["isMC"].lower() == "true"
 lumi    = 108960  
 isMVA   = False
 runEval = True
-isQCD   = False
+isolations = ("iso", "antiiso")   # ABCD: regions A/C and B/D (antiiso/) in one pass
 
-print(f"[INFO] Processing file {args.job_index+1}/{len(files)}: {file_to_process}")
+print(f"[INFO] Processing file {args.job_index+1}/{nfiles}: {file_to_process}")
+if args.entries:
+    print(f"[INFO] Entry range [{entry_start}, {entry_stop})")
 if isMC:
     xsec = float(meta["xsec"])
     print(f"[INFO] Sample: {dataset_name} (xsec={xsec}, nevts={nevts})")
@@ -173,159 +81,154 @@ else:
     xsec = 1.0
     print(f"[INFO] Sample: {dataset_name} (xsec=1.0, nevts={nevts})")
 
-# --- Load NanoAOD events --- #
-for attempt in range(1, 6):
+# --- Open the skim; chunks of its entries are read ahead while the processor runs (utils/prefetch.py) --- #
+# Opens and chunk reads are retried with backoff and fail over to mirrors / a local copy (utils/remote.py)
+if is_parquet(file_to_process):
+    # Parquet skim (run_skim.py --format parquet): collections are stored as records, read with a column projection
+    reader = RemoteReader(file_to_process,
+                          open_fn=lambda url: (url, read_meta_parquet(url), parquet_columns(url, isMC, dataset_name)),
+                          read_fn=lambda h, a, b: load_parquet(h[0], isMC, dataset_name, a, b, columns=h[2]))
+else:
+    reader = RemoteReader(file_to_process,
+                          open_fn=lambda url: uproot.open(url, timeout=300),
+                          read_fn=lambda f, a, b: load_root(f["Events"], isMC, dataset_name, a, b, branches=branches))
+try:
+    skim = reader.open()
+except OSError as e:
+    print(f"[ERROR] {e}")
+    sys.exit(1)
+
+if is_parquet(file_to_process):
+    n_entries    = skim[1]["entries"]
+    corr_version = int(skim[1].get("corrVersion", 0)) or None
+else:
+    n_entries = skim["Events"].num_entries
+
+    # --- Skim-time corrections (Meta/corrVersion; absent or 0: not corrected in the skim) --- #
+    corr_version = None
     try:
-        #factory = NanoEventsFactory.from_root(
-        #    file_to_process,
-        #    schemaclass=NanoAODSchema,
-        #    uproot_options={"timeout": 300}
-        #)
-        #events = factory.events()
-        
-        events = NanoEventsFactory.from_root(file_to_process,
-                                             treepath="Events", 
-                                             schemaclass=BaseSchema,
-                                             uproot_options={"timeout": 300}
-                                             ).events()
-        
-        break
+        if "Meta" in skim and "corrVersion" in skim["Meta"].keys():
+            corr_version = int(skim["Meta"]["corrVersion"].array(library="np")[0]) or None
     except Exception as e:
-        print(f"[WARNING] Attempt {attempt} failed: {e}")
-        if attempt == 5:
-            print("[ERROR] Max attempts reached. Skipping file.")
-            sys.exit(1)
-            time.sleep(10)
-            
-# --- Rebuild Muon ---
-events["Muon"] = ak.zip({f: events[f"Muon_{f}"] for f in [
-    "pt","eta","phi","charge","tightId","looseId","mass","pfRelIso04_all"
-]})
-# --- Rebuild Electron ---
-events["Electron"] = ak.zip({f: events[f"Electron_{f}"] for f in [
-    "pt","eta","phi","charge","cutBased","mass","pfRelIso03_all",
-    "seedGain","r9","superclusterEta","mvaIso_WP90"
-]})
+        print(f"[WARNING] Could not read Meta/corrVersion: {e}")
 
-# --- Rebuild Jet ---
-jet_fields = [
-    "pt","eta","phi","mass","rawFactor","area","pt_genMatched",
-    "btagUParTAK4probbb","btagUParTAK4B","passJetIdTightLepVeto",
-    "pt_regressed"
-]
-if isMC:
-    jet_fields += ["hadronFlavour", "partonFlavour"]
-
-events["Jet"] = ak.zip({f: events[f"Jet_{f}"] for f in jet_fields})
-
-# --- Rebuild PuppiMET ---
-events["PuppiMET"] = ak.zip({f: events[f"PuppiMET_{f}"] for f in ["pt", "phi"]})
-
-# --- Pileup (PU) info ---
-if isMC:
-    events["Pileup"] = ak.zip({f: events[f"Pileup_{f}"] for f in ["nPU", "nTrueInt"]})
-
-# --- PV info ---
-if not dataset_name.startswith("QCD"):
-    events["PV"] = ak.zip({f: events[f"PV_{f}"] for f in ["npvsGood", "npvs"]})
+    # Only the branches the analysis reads; Muon, Electron, Jet, PuppiMET, Pileup (MC), PV (not QCD) rebuilt per chunk
+    branches = root_branches(skim["Events"].keys(), isMC, dataset_name)
 
+if corr_version is not None:
+    print(f"[INFO] Skim carries corrected objects, corrVersion {corr_version:015x}")
 
 #  Split TTbar samples to tt+bb tt+cc tt+qq
 #  way to split found at: https://github.com/cms-sw/cmssw/blob/master/TopQuarkAnalysis/TopTools/plugins/GenTtbarCategorizer.cc
 #see also:  https://twiki.cern.ch/twiki/bin/view/CMSPublic/GenHFHadronMatcher
 # about tt+LF : https://bamboo-hep.readthedocs.io/en/latest/recipes.html
-if dataset_name.startswith("TTto") and not isMVA:
-    print("[INFO] TTbar sample detected splitting into ttLF, ttCC, ttBB")
-    gen_id = events.genTtbarId
+split_ttbar = dataset_name.startswith("TTto") and not isMVA
+flavors     = ("ttLF", "ttCC", "ttBB")
 
+def split(events):
+    '''{"": events}, or {flavor: events} of a TTbar chunk.'''
+    if not split_ttbar:
+        return {"": events}
+    gen_id = events.genTtbarId
     masks = {
         "ttLF": (gen_id % 100 < 41),
         "ttCC": (gen_id % 100 >= 41) & (gen_id % 100 <= 45),
         "ttBB": (gen_id % 100 >= 51) & (gen_id % 100 <= 55),
     }
+    return {flavor: events[mask] for flavor, mask in masks.items()}
+
+# --- b-tag efficiencies ε of MC: the sample's map (--btag-eff), else counted over this whole file first --- #
+# ε is then one table per file (and TTbar flavour), whatever --chunk-size and --entries
+def count_btag_eff():
+    '''{"" or flavor: path of the map counted over all entries of the file} (utils/btag_eff.py).'''
+    counters = {key: Wh_Processor(xsec=xsec, nevts=nevts, isMC=True, dataset_name=dataset_name, isolations=isolations,
+                                  isMVA=False, corr_version=corr_version, btag_eff_counts=True)
+                for key in (flavors if split_ttbar else ("",))}
+    counts = {}
+    loader = Prefetcher(reader.read, chunk_ranges(n_entries, args.chunk_size), depth=args.prefetch, max_mb=args.prefetch_mb)
+    for events in loader:
+        for key, events_key in split(events).items():
+            if len(events_key) > 0:
+                counts[key] = accumulate(counts.get(key), counters[key].process(events_key))
+    loader.report()
+
+    out_dir, maps = tempfile.mkdtemp(prefix="btag_eff_"), {}
+    for key, output in counts.items():
+        maps[key] = os.path.join(out_dir, f"btag_eff{'_' + key if key else ''}.json")
+        write_map(maps[key], count_corrections(output, "UParTAK4B_T_eff",
+                                               f"MC b-tag efficiency of {dataset_name} {key} file {args.job_index} (UParTAK4B >= WP T)",
+                                               "Wh_Processor"))
+    return maps
+
+btag_eff_maps = {}
+if isMC and args.btag_eff is None:
+    print(f"[INFO] No --btag-eff map: counting the b-tag efficiencies over all {n_entries} entries of the file first")
+    btag_eff_maps = count_btag_eff()
+
+loader = Prefetcher(reader.read, chunk_ranges(n_entries, args.chunk_size, entry_start, entry_stop),
+                    depth=args.prefetch, max_mb=args.prefetch_mb)
+print(f"[INFO] {len(loader)} chunk(s) of up to {args.chunk_size} entries, {args.prefetch} read ahead")
+
+def make_processor(mva, key=""):
+    return Wh_Processor(
+        xsec=xsec,
+        nevts=nevts,
+        isMC=isMC,
+        dataset_name=dataset_name,
+        isolations=isolations,
+        isMVA=mva,
+        runEval=runEval,
+        profile=args.profile,
+        diagnostics=args.diagnostics,
+        diag_fraction=args.diag_fraction,
+        corr_version=corr_version,
+        btag_eff_map=args.btag_eff or btag_eff_maps.get(key),
+    )
+
+if split_ttbar:
+    print("[INFO] TTbar sample detected splitting into ttLF, ttCC, ttBB")
+    processors = {flavor: make_processor(False, flavor) for flavor in flavors}
+    outputs    = {}
+
+    for events in loader:
+        for flavor, events_flavor in split(events).items():
+            n_flavor = len(events_flavor)
+            print(f"[INFO] Processing flavor: {flavor} (nEvents: {n_flavor})")
+            if n_flavor == 0:
+                continue
+            outputs[flavor] = accumulate(outputs.get(flavor), processors[flavor].process(events_flavor))
+    loader.report()
+    reader.report()
 
     job_suffix = os.path.basename(args.output).split("_")[-1]
-
-    for flavor, mask in masks.items():
-        events_flavor = events[mask]
-        n_flavor = len(events_flavor)
-        print(f"[INFO] Processing flavor: {flavor} (nEvents: {n_flavor})")
-
-        if n_flavor == 0:
+    sample_base = os.path.basename(dataset_name).replace(".root", "").replace("/", "_")
+    io_counted = False
+    for flavor in flavors:
+        if flavor not in outputs:
             print(f"[INFO] No events found for {flavor} — skipping.")
             continue
-
-        processor_instance = Wh_Processor(
-            xsec=xsec,
-            nevts=nevts,
-            isMC=isMC,
-            dataset_name=dataset_name,
-            isQCD=isQCD,
-            isMVA=False,
-            runEval=runEval,
-        )
-        output = processor_instance.process(events_flavor)
-
-        sample_base = os.path.basename(dataset_name).replace(".root", "").replace("/", "_")
-        out_name = f"{sample_base}_{flavor}_{job_suffix}"
-
-        with uproot.recreate(out_name) as rootfile:
-            for name, h in output.items():
-                if not isinstance(h, hist.Hist):
-                    continue
-                if np.sum(h.values()) == 0:
-                    continue
-        
-                if "gen:" in name:
-                    uproot_name = f"gen/{name}"
-                elif "_boosted" in name:
-                    uproot_name = f"boosted/{name}"
-                elif "_resolved" in name:
-                    uproot_name = f"resolved/{name}"
-                else:
-                    uproot_name = name
-        
-                write_hist_uproot_sumw2(rootfile, uproot_name, h)
+        output = outputs[flavor]
+        if args.profile and not io_counted:
+            # the I/O wait is shared by the flavours: booked once, so that summed sidecars stay right
+            output["profile"] += loader.profile()
+            io_counted = True
+        write_output(f"{sample_base}_{flavor}_{job_suffix}", output, provenance, args.profile, args.diagnostics)
                
 else:
     # --- Normal (non-TTbar) processing --- #
-    if isMC:
-        xsec = float(meta["xsec"])
-    else:
-        xsec = 1.0
-        
-    processor_instance = Wh_Processor(
-           xsec=xsec,
-           nevts=nevts,
-           isMC=isMC,
-           dataset_name=dataset_name,
-           isQCD=isQCD,
-           isMVA=isMVA,
-           runEval=runEval
-       )
+    processor_instance = make_processor(isMVA)
 
-    output = processor_instance.process(events)
+    output = None
+    for events in loader:
+        output = accumulate(output, processor_instance.process(events))
+    loader.report()
+    reader.report()
+    if args.profile:
+        output["profile"] += loader.profile()
 
     # --- Save output root file--- #
     out_name = args.output
-    with uproot.recreate(out_name) as rootfile:
-        for name, h in output.items():
-            if not isinstance(h, hist.Hist):
-                continue
-            if np.sum(h.values()) == 0:
-                continue
-    
-            if "gen:" in name:
-                uproot_name = f"gen/{name}"
-            elif "_boosted" in name:
-                uproot_name = f"boosted/{name}"
-            elif "_resolved" in name:
-                uproot_name = f"resolved/{name}"
-            else:
-                uproot_name = name
-    
-            write_hist_uproot_sumw2(rootfile, uproot_name, h)
-
+    write_output(out_name, output, provenance, args.profile, args.diagnostics)
     print(f"[INFO] Wrote ROOT histograms with Sumw2 to {out_name}")
                                                         
     # --- Save BDT trees --- #
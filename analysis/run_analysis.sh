@@ -3,7 +3,8 @@
 echo "Running on: $(hostname)"
 echo "Current directory: $(pwd)"
 
-JOBIDX=$1
+# JOBSPEC: file indices and entry ranges of this job (utils/splitting.py), e.g. "3+4+5" or "7:0-250000"
+JOBSPEC=$1
 DATASET_JSON=$2
 DATASET_KEY=$3
 
@@ -23,20 +24,32 @@ if [ -f xgb_model.tar.gz ]; then
 fi
 
 
-# Output file names (written in current working directory)
-OUTFILE="${DATASET_KEY}_${JOBIDX}.root"
-BDTFILE="bdt_${DATASET_KEY}_${JOBIDX}.root"
-
-# Run main analysis
-python run_analysis.py \
-    --job-index ${JOBIDX} \
-    --json ${DATASET_JSON} \
-    --dataset ${DATASET_KEY} \
-    --output ${OUTFILE} \
-    --bdt_output ${BDTFILE}
-
-
-
-
-echo "Job finished for ${OUTFILE} and ${BDTFILE}"
-
+# Run main analysis once per unit of the job
+STATUS=0
+for UNIT in ${JOBSPEC//+/ }; do
+    JOBIDX=${UNIT%%:*}
+    if [[ "${UNIT}" == *:* ]]; then
+        RANGE=${UNIT#*:}
+        SUFFIX="${JOBIDX}-${RANGE%%-*}"
+        ENTRIES="--entries ${RANGE}"
+    else
+        SUFFIX=${JOBIDX}
+        ENTRIES=""
+    fi
+
+    # Output file names (written in current working directory)
+    OUTFILE="${DATASET_KEY}_${SUFFIX}.root"
+    BDTFILE="bdt_${DATASET_KEY}_${SUFFIX}.root"
+
+    python run_analysis.py \
+        --job-index ${JOBIDX} \
+        ${ENTRIES} \
+        --json ${DATASET_JSON} \
+        --dataset ${DATASET_KEY} \
+        --output ${OUTFILE} \
+        --bdt_output ${BDTFILE} || STATUS=1
+
+    echo "Job finished for ${OUTFILE} and ${BDTFILE}"
+done
+
+exit ${STATUS}
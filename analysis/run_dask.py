@@ -0,0 +1,256 @@
+#!/usr/bin/env python3
+# Whole-dataset analysis on one node with dask.distributed (utils/dask_exec.py).
+# run_analysis.py is one condor job per file; this runs every file of a dataset as partitions of
+# --chunk-size entries on a LocalCluster with one worker process per core (or on an existing
+# scheduler, --scheduler). By default every partition is one task reading only the analysis
+# columns of its entry range; --graph builds one dask-awkward graph instead (skims read through
+# uproot.dask / dask_awkward.from_parquet, one delayed processor call per partition, tree-reduced
+# in the graph), optimised to read only the analysis columns.
+# MC without --btag-eff first counts the b-tag efficiencies over all selected files (per TTbar
+# flavour) and writes them next to the output, so that every partition uses the same map.
+# --check recomputes the histograms in this process, one whole file at a time, with that map.
+#
+#   python run_dask.py --json ../skimmed.json --dataset WH_M30 --output WH_M30.root --workers 16
+#   python run_dask.py --json catalogue.db --dataset TTto2L2Nu --output TT.root --files 0-49 --graph --check
+#     -> TT_ttLF.root, TT_ttCC.root, TT_ttBB.root (maps TT_ttLF_btag_eff.json, ...)
+
+import os
+import sys
+import json
+import inspect
+import argparse
+import warnings
+import uproot
+
+from Wh_processor import Wh_Processor
+from utils.provenance import Provenance
+from utils.hist_io import write_output
+from utils.catalogue import Catalogue, is_catalogue
+from utils.btag_eff import count_corrections, write_map
+from utils.skim_io import is_parquet, load_parquet, load_root, num_entries, parquet_columns, read_meta_parquet
+from utils.remote import RemoteReader
+from utils.prefetch import CHUNK_SIZE
+from utils.dask_exec import compare, local_client, partitions, run_graph, run_partitions, skim_collection, worker_cached
+warnings.filterwarnings("ignore", message="Missing cross-reference index")
+
+#----------------------------------------------------------------------------------------------------------------------------------------------
+
+def ttbar_masks(gen_id):
+    '''tt+LF / tt+CC / tt+BB by genTtbarId, as in run_analysis.py'''
+    return {
+        "ttLF": (gen_id % 100 < 41),
+        "ttCC": (gen_id % 100 >= 41) & (gen_id % 100 <= 45),
+        "ttBB": (gen_id % 100 >= 51) & (gen_id % 100 <= 55),
+    }
+
+
+def _corr_version(skim):
+    '''corrVersion in the Meta tree of an open ROOT skim (None: not corrected in the skim).'''
+    if "Meta" in skim and "corrVersion" in skim["Meta"].keys():
+        return int(skim["Meta"]["corrVersion"].array(library="np")[0]) or None
+    return None
+
+
+def open_skim(url, is_mc, dataset_name):
+    '''RemoteReader of a skim and its corrVersion (None: not corrected in the skim).'''
+    if is_parquet(url):
+        reader = RemoteReader(url,
+                              open_fn=lambda u: (u, read_meta_parquet(u), parquet_columns(u, is_mc, dataset_name)),
+                              read_fn=lambda h, a, b: load_parquet(h[0], is_mc, dataset_name, a, b, columns=h[2]))
+        return reader, int(reader.open()[1].get("corrVersion", 0)) or None
+
+    reader = RemoteReader(url,
+                          open_fn=lambda u: uproot.open(u, timeout=300),
+                          read_fn=lambda f, a, b: load_root(f["Events"], is_mc, dataset_name, a, b))
+    return reader, _corr_version(reader.open())
+
+
+def corr_version_of(url):
+    '''corrVersion of a skim (None: not corrected in the skim), from its Meta tree or footer.'''
+    if is_parquet(url):
+        return int(read_meta_parquet(url).get("corrVersion", 0)) or None
+    with uproot.open(url, timeout=300) as skim:
+        return _corr_version(skim)
+
+
+def process_events(events, corr_version, config, btag_eff_maps=None, counting=False):
+    '''
+    Output of the events of one partition: {"": output}, or {flavour: output} for TTbar.
+    `config` holds the Wh_Processor arguments of the dataset; btag_eff_maps {"" or flavour: path}
+    is used when config["btag_eff_map"] is not set. counting=True: only the b-tag efficiency counts.
+    '''
+    if config["dataset_name"].startswith("TTto"):
+        parts = {flavor: events[mask] for flavor, mask in ttbar_masks(events.genTtbarId).items()}
+    else:
+        parts = {"": events}
+
+    out = {}
+    for key, evts in parts.items():
+        if len(evts) == 0:
+            continue
+        eff_map = None if counting else config["btag_eff_map"] or (btag_eff_maps or {}).get(key)
+        # one processor per (corrVersion, flavour, map) in each worker process, reused by its partitions
+        proc = worker_cached((config["dataset_name"], corr_version, key, counting, eff_map),
+                             lambda: Wh_Processor(corr_version=corr_version, btag_eff_counts=counting,
+                                                  **dict(config, btag_eff_map=eff_map)))
+        out[key] = proc.process(evts)
+        if counting:
+            out[key] = {k: v for k, v in out[key].items() if k.split("/")[-1] == "btag_eff_counts"}
+    return out
+
+
+def process_partition(task, config, btag_eff_maps=None, counting=False):
+    '''process_events of one partition (url, start, stop), read through utils/remote.py.'''
+    url, start, stop = task
+    reader, corr_version = open_skim(url, config["isMC"], config["dataset_name"])
+    events = reader.read(start, stop)
+    reader.report()
+    return process_events(events, corr_version, config, btag_eff_maps, counting)
+
+
+def process_graph_partition(events, task, config, btag_eff_maps=None, counting=False):
+    '''process_events of one partition of a --graph run (events computed by the graph).'''
+    corr_version = worker_cached(("corrVersion", task[0]), lambda: corr_version_of(task[0]))
+    return process_events(events, corr_version, config, btag_eff_maps, counting)
+
+
+def write_btag_eff_maps(counts, output, config, n_files):
+    '''{"" or flavour: path} of the maps of the merged counts, written as <output stem>[_<flavour>]_btag_eff.json.'''
+    stem, maps = os.path.splitext(output)[0], {}
+    for key, out in sorted(counts.items()):
+        maps[key] = f"{stem}_{key}_btag_eff.json" if key else f"{stem}_btag_eff.json"
+        write_map(maps[key], count_corrections(out, "UParTAK4B_T_eff",
+                                               f"MC b-tag efficiency of {config['dataset_name']} {key} {n_files} file(s) (UParTAK4B >= WP T)",
+                                               "Wh_Processor"))
+    return maps
+
+#----------------------------------------------------------------------------------------------------------------------------------------------
+
+def select(n, spec):
+    '''File indices of "0-9,12" (None: all n).'''
+    if not spec:
+        return list(range(n))
+    idx = []
+    for part in spec.split(","):
+        a, _, b = part.partition("-")
+        idx += list(range(int(a), int(b) + 1)) if b else [int(a)]
+    return [i for i in idx if i < n]
+
+
+def dataset_files(path, dataset, spec):
+    '''(metadata, {url: entries}) of the selected files of `dataset` (JSON or catalogue).'''
+    if is_catalogue(path):
+        with Catalogue(path, readonly=True) as cat:
+            counts = cat.counts(dataset)
+            jobs = [cat.job(dataset, i) for i in select(len(counts), spec)]
+            meta = cat.metadata(dataset)
+            known = {url: counts[i] for i, (url, _) in zip(select(len(counts), spec), jobs)}
+    else:
+        with open(path) as f:
+            all_datasets = json.load(f)
+        if dataset not in all_datasets:
+            raise ValueError(f"[ERROR] Dataset '{dataset}' not found in {path}")
+        meta  = all_datasets[dataset]["metadata"]
+        files = all_datasets[dataset]["files"]
+        known = {files[i]: None for i in select(len(files), spec)}
+
+    missing = [url for url, n in known.items() if n is None]
+    if missing:
+        print(f"[INFO] Reading the entries of {len(missing)} file(s)")
+        from concurrent.futures import ThreadPoolExecutor
+        with ThreadPoolExecutor(max_workers=16) as pool:
+            known.update(zip(missing, pool.map(num_entries, missing)))
+    return meta, known
+
+#----------------------------------------------------------------------------------------------------------------------------------------------
+
+def main():
+    parser = argparse.ArgumentParser(description="Analysis of a whole dataset on a local dask cluster")
+    parser.add_argument("--json", type=str, required=True, help="Path to JSON file (or SQLite catalogue .db)")
+    parser.add_argument("--dataset", type=str, required=True, help="Dataset key inside JSON")
+    parser.add_argument("--files", type=str, default=None, help="File indices, e.g. 0-9,12 (default: all)")
+    parser.add_argument("--output", type=str, required=True, help="Histogram output ROOT file (TTbar: <stem>_<flavour>.root)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Worker processes (0: run in this process)")
+    parser.add_argument("--scheduler", type=str, default=None, help="Address of a running dask scheduler instead of a local cluster")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE, help="Entries per partition (--graph Parquet: one per row group)")
+    parser.add_argument("--graph", action="store_true", help="Run as one dask-awkward graph (uproot.dask / from_parquet input)")
+    parser.add_argument("--check", action="store_true", help="Recompute in this process and compare the histograms")
+    parser.add_argument("--profile", action="store_true", help="Record per-stage timing/memory (summed over partitions)")
+    parser.add_argument("--diagnostics", action="store_true", help="Collect sampled summary stats of intermediate corrections")
+    parser.add_argument("--diag-fraction", type=float, default=0.01, help="Fraction of events sampled by --diagnostics")
+    parser.add_argument("--btag-eff", type=str, default=None, help="b-tag efficiency map of the sample (make_btag_eff.py); default: counted over the selected files first")
+    args = parser.parse_args()
+
+    meta, entries = dataset_files(args.json, args.dataset, args.files)
+    is_mc = meta["isMC"].lower() == "true"
+    config = {
+        "xsec":          float(meta["xsec"]) if is_mc else 1.0,
+        "nevts":         int(meta["nevents"]),
+        "isMC":          is_mc,
+        "dataset_name":  meta["sample"],
+        "isolations":    ("iso", "antiiso"),
+        "isMVA":         False,
+        "runEval":       True,
+        "profile":       args.profile,
+        "diagnostics":   args.diagnostics,
+        "diag_fraction": args.diag_fraction,
+        "btag_eff_map":  args.btag_eff,
+    }
+    if args.graph:
+        import dask_awkward as dak
+
+        events, tasks = skim_collection(entries, is_mc, config["dataset_name"], args.chunk_size)
+        columns = sorted(set().union(*dak.necessary_columns(events).values()))
+        print(f"[DASK] The graph reads {len(columns)} column(s): {', '.join(columns)}")
+        # Parquet: already projected by from_parquet(columns=...), read as is
+        optimize = not is_parquet(tasks[0][0])
+        run = lambda client, **kw: run_graph(client, events, lambda evts, task: process_graph_partition(evts, task, config, **kw),
+                                             tasks, optimize=optimize)
+    else:
+        tasks = partitions(entries, args.chunk_size)
+        run = lambda client, **kw: run_partitions(client, lambda task: process_partition(task, config, **kw), tasks)
+    print(f"[INFO] Sample: {config['dataset_name']} (xsec={config['xsec']}, nevts={config['nevts']}): "
+          f"{len(entries)} file(s), {sum(entries.values())} entries, {len(tasks)} partition(s)")
+
+    provenance = Provenance(
+        processor=inspect.getsourcefile(Wh_Processor),
+        driver=os.path.abspath(__file__),
+        here=os.path.dirname(os.path.abspath(__file__)),
+    ).record(args.json, args.dataset, meta, files=sorted(entries))
+
+    if args.scheduler:
+        from distributed import Client
+        client = Client(args.scheduler)
+    else:
+        client = local_client(args.workers) if args.workers > 0 else None
+    try:
+        # one b-tag efficiency map per sample (and TTbar flavour) for every partition and for --check
+        btag_eff_maps = {}
+        if is_mc and not args.btag_eff:
+            print(f"[INFO] No --btag-eff map: counting the b-tag efficiencies over the {len(entries)} selected file(s) first")
+            btag_eff_maps = write_btag_eff_maps(run(client, counting=True), args.output, config, len(entries))
+        outputs = run(client, btag_eff_maps=btag_eff_maps)
+    finally:
+        if client is not None:
+            client.close()
+
+    if args.check:
+        print("[CHECK] Recomputing in process, one partition per file")
+        eager = run_partitions(None, lambda task: process_partition(task, config, btag_eff_maps), partitions(entries, 0))
+        bad = [(key, name, diff) for key in set(outputs) | set(eager)
+               for name, diff in compare(outputs.get(key, {}), eager.get(key, {}))]
+        for key, name, diff in bad:
+            print(f"[CHECK] {key or args.dataset}/{name}: max |difference| {diff:.3g}")
+        print(f"[CHECK] {'identical to' if not bad else f'{len(bad)} histograms differ from'} the eager result")
+        if bad:
+            sys.exit(1)
+
+    stem, ext = os.path.splitext(args.output)
+    for key, output in sorted(outputs.items()):
+        out_name = f"{stem}_{key}{ext}" if key else args.output
+        write_output(out_name, output, provenance, args.profile, args.diagnostics)
+        print(f"[INFO] Wrote ROOT histograms with Sumw2 to {out_name}")
+
+
+if __name__ == "__main__":
+    main()
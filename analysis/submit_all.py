@@ -1,47 +1,110 @@
 import os
-import glob
-import json
 import subprocess
 import sys
 import re
 
+from utils.output_index import index_dirs
+from utils.provenance import Provenance, input_fingerprints, pack_dir, stale_jobs, summarize
+from utils.catalogue import Catalogue, process_jsons
+from utils.splitting import CostModel, TARGET_WALL, dataset_type, plan, pack, job_spec, unit_suffix
+
 DATASET_DIR = "datasets"
-FILES_TO_TRANSFER = ["run_analysis.py", "ZH_0lep_total_processor_v3.py", "x509up", "run_analysis.sh", "utils.tar.gz", "xgb_model.tar.gz"]
+PROCESSOR   = "Wh_processor.py"   # the processor imported by run_analysis.py
+FILES_TO_TRANSFER = ["run_analysis.py", PROCESSOR, "x509up", "run_analysis.sh", "utils.tar.gz", "xgb_model.tar.gz"]
+OUTPUT_DIR  = os.environ.get("OUTPUT_DIR", ".")
+# INCREMENTAL=0 submits every file; by default only jobs whose output is missing or whose
+# provenance record (input file, dataset metadata, code, corrections, models) is stale
+INCREMENTAL = os.environ.get("INCREMENTAL", "1") == "1"
+# CATALOGUE=catalogue.db takes the datasets from the SQLite catalogue instead of datasets/*.json;
+# the jobs then receive the catalogue as --json and look their file up by (dataset, index)
+CATALOGUE   = os.environ.get("CATALOGUE")
+# Jobs are packed/split to about TARGET_HOURS of estimated wall time each (utils/splitting.py);
+# SPLIT=0 goes back to one job per file
+SPLIT       = os.environ.get("SPLIT", "1") == "1"
+TARGET      = float(os.environ.get("TARGET_HOURS", TARGET_WALL / 3600)) * 3600
+
+def output_candidates(dataset_key, dataset_info, suffix):
+    # Default single-file naming (suffix: file index, or <index>-<first entry> for an entry range);
+    # TT* samples may be written flavour-split (see run_analysis.py)
+    candidates = [f"{dataset_key}_{suffix}.root"]
+    meta = dataset_info.get("metadata", {})
+    sample_base = os.path.basename(meta.get("sample", dataset_key)).replace(".root", "").replace("/", "_")
+    if sample_base.startswith("TT") or dataset_key.startswith("TT"):
+        candidates += [f"{sample_base}_{flav}_{suffix}.root" for flav in ("ttLF", "ttCC", "ttBB")]
+    return candidates
+
+model = CostModel.load("analysis")
+cat   = Catalogue(CATALOGUE, readonly=True) if CATALOGUE else None
+
+# The jobs import utils/ from utils.tar.gz: packed from the current sources at every submission
+HERE = os.path.dirname(os.path.abspath(__file__))
+pack_dir(os.path.join(HERE, "utils"), os.path.join(HERE, "utils.tar.gz"), patterns=("*.py",))
+
+if INCREMENTAL:
+    prov = Provenance(processor=os.path.join(HERE, PROCESSOR), driver=os.path.join(HERE, "run_analysis.py"), here=HERE)
+    existing = index_dirs([OUTPUT_DIR], cache_file=None)[OUTPUT_DIR] or set()
 
 # Read optional filter
 dataset_key_pattern = os.environ.get("FILTER_KEY")
 # Allow optional pattern for which files to submit
 pattern = sys.argv[1] if len(sys.argv) > 1 else "ZH*.json"
-json_files = sorted(glob.glob(f"{DATASET_DIR}/{pattern}"))
 
-for json_path in json_files:
-    with open(json_path) as f:
-        data = json.load(f)
+for dataset_basename, data, json_path in process_jsons(DATASET_DIR, pattern, catalogue=CATALOGUE):
+    job_json = os.path.basename(json_path)   # e.g., ZH.json, or catalogue.db
+
+    if not os.path.exists(job_json):
+        os.system(f"cp {json_path} {job_json}")
+
+    dtype = dataset_type(dataset_basename)
+    units = []   # (dataset_key, (idx, start, stop, events))
+    for dataset_key, dataset_info in data.items():
+        if dataset_key_pattern and not re.search(dataset_key_pattern, dataset_key):
+            continue
+        counts = cat.counts(dataset_key, "analysis") if cat else {i: None for i in range(len(dataset_info["files"]))}
+        units += [(dataset_key, u) for u in plan(dtype, counts, dataset_info["metadata"].get("nevents"), model, TARGET, split=SPLIT)]
 
-    dataset_basename = os.path.basename(json_path)  # e.g., ZH.json
+    if INCREMENTAL and units:
+        fps = input_fingerprints(data[k]["files"][u[0]] for k, u in units)
+        expected = {}
+        for k, u in units:
+            outs = [os.path.join(OUTPUT_DIR, c) for c in output_candidates(k, data[k], unit_suffix(u)) if c in existing]
+            url  = data[k]["files"][u[0]]
+            expected[(k, u)] = (outs, prov.record(url, k, data[k]["metadata"], fingerprint=fps[url]))
+        stale = stale_jobs(expected)
+        print(f"[PROV] {dataset_basename}: {len(stale)} / {len(units)} files/ranges stale {summarize(stale)}")
+        units = [ku for ku in units if ku in stale]
+        if not units:
+            print(f"All jobs up to date for {dataset_basename}")
+            continue
 
-    if not os.path.exists(dataset_basename):
-        os.system(f"cp {json_path} {dataset_basename}")
+    # Pack the units of each dataset into jobs of about TARGET seconds
+    jobs = []
+    for dataset_key in dict.fromkeys(k for k, _ in units):
+        mine = [u for k, u in units if k == dataset_key]
+        if SPLIT:
+            packed, loads = pack(mine, lambda u: model.cost(dtype, u[3]), TARGET, model.job_overhead)
+            print(f"[SPLIT] {dataset_key}: {len(mine)} units -> {len(packed)} jobs, "
+                  f"estimated max {max(loads) / 3600:.2f} h, mean {sum(loads) / len(loads) / 3600:.2f} h")
+        else:
+            packed = [[u] for u in mine]
+        jobs += [(dataset_key, j) for j in packed]
 
     joblist_file = f"joblist_{dataset_basename}.txt"
     with open(joblist_file, "w") as jf:
-        for dataset_key, dataset_info in data.items():
-            if dataset_key_pattern and not re.search(dataset_key_pattern, dataset_key):
-                continue
-            for i in range(len(dataset_info["files"])):
-                jf.write(f"{i} {dataset_basename} {dataset_key}\n")
+        for dataset_key, job in jobs:
+            jf.write(f"{job_spec(job)} {job_json} {dataset_key}\n")
 
     jdl_file = f"submit_{dataset_basename}.jdl"
     with open(jdl_file, "w") as f:
         f.write("universe = vanilla\n")
         f.write("executable = run_analysis.sh\n")
-        f.write("arguments = $(jobindex) $(dataset_json) $(dataset_key)\n")
+        f.write("arguments = $(jobspec) $(dataset_json) $(dataset_key)\n")
         f.write(f"transfer_input_files = {', '.join(FILES_TO_TRANSFER)}, $(dataset_json)\n")
         f.write("should_transfer_files = YES\n")
         f.write("when_to_transfer_output = ON_EXIT\n")
-        f.write("output = out/job_$(Cluster)_$(jobindex)_$(dataset_key).out\n")
-        f.write("error  = err/job_$(Cluster)_$(jobindex)_$(dataset_key).err\n")
-        f.write("log    = log/job_$(Cluster)_$(jobindex)_$(dataset_key).log\n")
+        f.write("output = out/job_$(Cluster)_$(Process)_$(dataset_key).out\n")
+        f.write("error  = err/job_$(Cluster)_$(Process)_$(dataset_key).err\n")
+        f.write("log    = log/job_$(Cluster)_$(Process)_$(dataset_key).log\n")
         f.write('+SingularityImage = "/cvmfs/unpacked.cern.ch/registry.hub.docker.com/coffeateam/coffea-dask:latest"\n')
         f.write("+SingularityBindCVMFS = True\n")
         f.write("+JobFlavour = \"workday\"\n")
@@ -49,7 +112,10 @@ for json_path in json_files:
         f.write("request_memory = 3000\n")
         f.write('environment = "X509_USER_PROXY=x509up"\n')
         f.write("X509 = x509up\n")
-        f.write(f"queue jobindex, dataset_json, dataset_key from {joblist_file}\n")
+        f.write(f"queue jobspec, dataset_json, dataset_key from {joblist_file}\n")
 
     print(f"Submitting jobs from: {dataset_basename}")
-    subprocess.run(["condor_submit", jdl_file])
+    res = subprocess.run(["condor_submit", jdl_file])
+    if CATALOGUE and res.returncode == 0:
+        with Catalogue(CATALOGUE) as wcat:
+            wcat.set_status({(k, u[0]) for k, job in jobs for u in job}, "analysis", "submitted")
@@ -0,0 +1,168 @@
+import re
+import json
+import numpy as np
+from hist import Hist
+
+from utils.lookup_table import Binning, LookupTable
+
+# b-tag efficiency maps: MC tagging efficiency ε per hadron flavour, |eta| and pt, for the fixed-WP
+# event weight. A processor in counting mode fills the additive `btag_eff_counts` histogram
+# (count_jets: one np.bincount over the fused (flavour, passed, |eta|, pt) bin); the merged counts
+# become one correctionlib correction per output directory, tagged with the selection that counted
+# the jets, and EffMap evaluates one of them per jet collection in one call.
+#
+#   h = build(count_hist()); h.view()[...] += count_jets(pt, abseta, flav, passed)   # per chunk, then merged
+#   write_map("btag_eff_WH.json", count_corrections(output, "UParTAK4B_T_eff", "UParTAK4B >= T", "Wh_Processor"))
+#   eff = EffMap("btag_eff_WH.json", selection="Wh_Processor/antiiso").evaluate(flav, abseta, pt)
+#
+# ε depends on the jet selection (lepton cleaning, WP), so a correction records it in its
+# description ("[selection: Wh_Processor]", "[selection: Wh_Processor/antiiso]" for the counts
+# under antiiso/) and EffMap only loads the correction of the selection it is asked for.
+
+PT_EDGES     = np.array([20., 30., 50., 70., 100., 140., 200., 300., 600.])
+ABSETA_EDGES = np.array([0.0, 2.5])
+FLAVOURS     = (0, 4, 5)      # hadronFlavour: udsg, c, b
+EFF_CLIP     = 1e-6           # ε is kept in [EFF_CLIP, 1 - EFF_CLIP] (1 - ε divides the untagged factor)
+
+# bins of the count table (flavour index, passed, |eta|, pt) and of the ε table (flavour index, |eta|, pt)
+COUNT_BINNING = Binning([np.arange(len(FLAVOURS) + 1), [0, 1, 2], ABSETA_EDGES, PT_EDGES])
+EFF_BINNING   = Binning([np.arange(len(FLAVOURS) + 1), ABSETA_EDGES, PT_EDGES])
+
+#----------------------------------------------------------------------------------------------------------------------------------------------
+
+def count_hist():
+    '''Booking of the `btag_eff_counts` histogram: flavour x passed x |eta| x pt, jet counts.'''
+    return (Hist.new
+            .IntCategory(list(FLAVOURS), name="flavour")
+            .Integer(0, 2, name="passed", underflow=False, overflow=False)
+            .Variable(ABSETA_EDGES, name="abseta")
+            .Variable(PT_EDGES, name="pt")
+            .Double)
+
+
+def flavour_index(flav):
+    '''Position of each hadronFlavour in FLAVOURS and whether it is one of them.'''
+    flav = np.asarray(flav, dtype=np.int64)
+    f = np.minimum(np.searchsorted(FLAVOURS, flav), len(FLAVOURS) - 1)
+    return f, np.asarray(FLAVOURS)[f] == flav
+
+
+def count_jets(pt, abseta, flav, passed):
+    '''
+    Jet counts (len(FLAVOURS), 2, n_abseta, n_pt) of flat per-jet arrays, in one np.bincount.
+    Jets of other flavours are not counted.
+    '''
+    f, ok = flavour_index(flav)
+    flat = COUNT_BINNING.index(f, passed, abseta, pt)
+    return np.bincount(flat[ok], minlength=COUNT_BINNING.size).reshape(COUNT_BINNING.shape).astype(np.float64)
+
+
+def efficiencies(counts):
+    '''
+    ε (len(FLAVOURS), n_abseta, n_pt) of count_jets() / btag_eff_counts values: passed / all per bin,
+    empty bins set to the flavour's overall rate, clipped to [EFF_CLIP, 1 - EFF_CLIP].
+    '''
+    counts = np.asarray(counts, dtype=np.float64)
+    num, den = counts[:, 1], counts.sum(axis=1)
+    eff = num / np.maximum(den, 1)
+    for k in range(len(FLAVOURS)):
+        tot = den[k].sum()
+        eff[k][den[k] == 0] = num[k].sum() / tot if tot else 0.0
+    return np.clip(eff, EFF_CLIP, 1 - EFF_CLIP)
+
+
+def lookup(eff, flav, abseta, pt):
+    '''ε of each jet from an efficiencies() table (processors without a map); 0 for other flavours.'''
+    f, ok = flavour_index(flav)
+    return np.where(ok, LookupTable(EFF_BINNING, eff)(f, abseta, pt), 0.0)
+
+#----------------------------------------------------------------------------------------------------------------------------------------------
+
+def to_correction(eff, name, description="", selection=None):
+    '''
+    correctionlib (schema v2) Correction of ε: inputs flavor (int), abseta, pt; clamped outside the edges.
+    `selection` is recorded in the description, for EffMap.
+    '''
+    def multibinning(table):
+        return {"nodetype": "multibinning", "inputs": ["abseta", "pt"],
+                "edges": [ABSETA_EDGES.tolist(), PT_EDGES.tolist()],
+                "content": [float(v) for v in np.ravel(table)], "flow": "clamp"}
+
+    if selection is not None:
+        description = f"{description} [selection: {selection}]"
+    return {
+        "name": name,
+        "description": description,
+        "version": 1,
+        "inputs": [
+            {"name": "flavor", "type": "int",  "description": "hadronFlavour (0, 4, 5)"},
+            {"name": "abseta", "type": "real", "description": "|eta|"},
+            {"name": "pt",     "type": "real", "description": "jet pt [GeV]"},
+        ],
+        "output": {"name": "eff", "type": "real", "description": "MC b-tag efficiency"},
+        "data": {"nodetype": "category", "input": "flavor",
+                 "content": [{"key": f, "value": multibinning(eff[k])} for k, f in enumerate(FLAVOURS)]},
+    }
+
+
+def map_selection(selection, directory=""):
+    '''Selection of the counts stored under `directory`/ of an output ("": top level).'''
+    return f"{selection}/{directory}" if directory else selection
+
+
+def count_corrections(output, name, description, selection):
+    '''
+    Corrections of the `btag_eff_counts` histograms of a counting-mode output: "btag_eff_counts" gives
+    `name`, "<dir>/btag_eff_counts" gives `name`_<dir>, made with map_selection(selection, dir).
+    '''
+    out = []
+    for key in sorted((k for k in output if k.split("/")[-1] == "btag_eff_counts"), key=lambda k: (k.count("/"), k)):
+        directory = key.rpartition("/")[0]
+        out.append(to_correction(efficiencies(output[key].values()), f"{name}_{directory}" if directory else name,
+                                 description, map_selection(selection, directory)))
+    return out
+
+
+def write_map(path, corrections):
+    '''Write corrections (to_correction / count_corrections) as one correctionlib CorrectionSet JSON.'''
+    cset = {"schema_version": 2, "description": "b-tag efficiencies (make_btag_eff.py)", "corrections": list(corrections)}
+    with open(path, "w") as f:
+        json.dump(cset, f, indent=1)
+    print(f"[BTAG-EFF] Wrote {', '.join(c['name'] for c in cset['corrections'])} to {path}")
+
+
+def recorded_selection(description):
+    found = re.search(r"\[selection: ([^\]]+)\]", description or "")
+    return found.group(1) if found else None
+
+
+class EffMap:
+    '''
+    One ε correction of a map written by write_map, evaluated with correctionlib on whole flat arrays.
+    eff = EffMap(path, selection="Wh_Processor").evaluate(flav, abseta, pt)    # flavours outside FLAVOURS get ε = 0
+    selection=...: the correction made with that selection (with `name`: raise unless it was).
+    '''
+
+    def __init__(self, path, name=None, selection=None):
+        import correctionlib
+
+        cset = correctionlib.CorrectionSet.from_file(path)
+        if name is None:
+            made = {key: recorded_selection(cset[key].description) for key in cset.keys()}
+            name = next((key for key, sel in made.items() if sel == selection), next(iter(made)))
+        self.name = name
+        self.path = path
+        self._corr = cset[self.name]
+        self.selection = recorded_selection(self._corr.description)
+        if selection is not None and self.selection != selection:
+            raise ValueError(f"[BTAG-EFF] {path} has no map made with the {selection} selection "
+                             f"({self.name}: {self.selection or 'unrecorded'})")
+
+    def evaluate(self, flav, abseta, pt):
+        flav = np.asarray(flav, dtype=np.int64)
+        known = flavour_index(flav)[1]
+        out = np.zeros(flav.shape, dtype=np.float64)
+        if np.any(known):
+            out[known] = self._corr.evaluate(flav[known], np.asarray(abseta, dtype=np.float64)[known],
+                                             np.asarray(pt, dtype=np.float64)[known])
+        return out
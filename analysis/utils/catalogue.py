@@ -0,0 +1,395 @@
+import os
+import re
+import glob
+import json
+import fnmatch
+import sqlite3
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import uproot
+except ImportError:
+    uproot = None
+
+# SQLite dataset catalogue.
+# One file holds what the per-process JSONs of analysis/datasets and skimming/datasets carry,
+# plus per-file bookkeeping: the NanoAOD URL (skim input), the skim URL (analysis input), size,
+# nEvents, sum of gen weights, and the skim / analysis job status. A job looks up its file with
+# one primary-key query on (dataset, idx) instead of json.load-ing the whole process JSON, and
+# the JSON format is still exported for anything that wants it.
+#
+#   python -m utils.catalogue import catalogue.db datasets/*.json --stage analysis
+#   python -m utils.catalogue import catalogue.db ../skimming/datasets/*.json --stage skim
+#   python -m utils.catalogue scan catalogue.db --server root://eosuser.cern.ch --base /eos/user/a/ataxeidi/skim
+#   python -m utils.catalogue totals catalogue.db --pattern DYto2E
+#   python -m utils.catalogue count catalogue.db --stage skim          # per-file entries for utils/splitting.py
+#   python -m utils.catalogue export catalogue.db exported/ --stage analysis
+
+STAGES = ("skim", "analysis")
+_URL_COLUMN = {"skim": "url", "analysis": "skim_url"}   # input file of each stage
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS datasets (
+    key           TEXT PRIMARY KEY,
+    json_name     TEXT NOT NULL,
+    skim_meta     TEXT,              -- metadata block of the skim / analysis JSON, verbatim
+    analysis_meta TEXT               -- (they may differ, e.g. nevents after a partial production)
+);
+CREATE TABLE IF NOT EXISTS files (
+    dataset         TEXT    NOT NULL REFERENCES datasets(key),
+    idx             INTEGER NOT NULL,
+    url             TEXT,            -- NanoAOD input of the skim
+    skim_url        TEXT,            -- skimmed file, input of the analysis
+    size            INTEGER,
+    nevents         INTEGER,         -- Meta/nEvents of the skim (events before the skim selection = NanoAOD entries)
+    entries         INTEGER,         -- Events entries of the skim (events the analysis reads)
+    sumw            REAL,            -- Meta/sumGenWeight of the skim (MC)
+    skim_status     TEXT DEFAULT 'new',
+    analysis_status TEXT DEFAULT 'new',
+    PRIMARY KEY (dataset, idx)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS merged (  -- compacted skims (skimming/compact_skims.py); when a dataset has rows
+    dataset         TEXT    NOT NULL REFERENCES datasets(key),   -- here they replace its skim files as analysis input
+    idx             INTEGER NOT NULL,
+    skim_url        TEXT    NOT NULL,
+    size            INTEGER,
+    nevents         INTEGER,         -- summed Meta/nEvents of the sources
+    sumw            REAL,
+    entries         INTEGER,
+    sources         TEXT,            -- JSON list of the files.idx merged into it
+    analysis_status TEXT DEFAULT 'new',
+    PRIMARY KEY (dataset, idx)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS datasets_by_json ON datasets(json_name);
+'''
+# Columns added after the first version, ALTERed into older catalogues
+_ADDED_COLUMNS = {"entries": "INTEGER"}
+_COUNT_COLUMN  = {"skim": "nevents", "analysis": "entries"}   # events in the input file of each stage
+
+#----------------------------------------------------------------------------------------------------------------------------------------------
+
+def is_catalogue(path):
+    return str(path).endswith((".db", ".sqlite"))
+
+
+class Catalogue:
+    '''
+    cat = Catalogue("catalogue.db")
+    url, meta = cat.job("WH_WToAll_HToAATo4B_M-12_2024", 3, stage="analysis")   # one indexed lookup
+    data = cat.to_dict("WH_WToAll_HToAATo4B.json", stage="analysis")           # the old JSON content
+    cat.set_status([(key, 3)], "analysis", "submitted")
+    '''
+
+    def __init__(self, path, readonly=False):
+        self.path = path
+        if readonly:
+            self.db = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+        else:
+            self.db = sqlite3.connect(path)
+            self.db.executescript(_SCHEMA)
+            have = {row[1] for row in self.db.execute("PRAGMA table_info(files)")}
+            for col, typ in _ADDED_COLUMNS.items():
+                if col not in have:
+                    self.db.execute(f"ALTER TABLE files ADD COLUMN {col} {typ}")
+
+    def close(self):
+        self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.db.commit()
+        self.close()
+
+    #------------------------------------------------------------------------------------------------------------------------------------------
+
+    def import_json(self, path, stage):
+        '''Add/refresh the datasets of one process JSON; `stage` says whose input its file list is.'''
+        col, meta = _URL_COLUMN[stage], f"{stage}_meta"
+        with open(path) as f:
+            data = json.load(f)
+        json_name = os.path.basename(path)
+        with self.db:
+            for key, info in data.items():
+                self.db.execute(f"INSERT INTO datasets(key, json_name, {meta}) VALUES (?, ?, ?) "
+                                f"ON CONFLICT(key) DO UPDATE SET json_name = excluded.json_name, {meta} = excluded.{meta}",
+                                (key, json_name, json.dumps(info.get("metadata", {}))))
+                self.db.executemany(f"INSERT INTO files(dataset, idx, {col}) VALUES (?, ?, ?) "
+                                    f"ON CONFLICT(dataset, idx) DO UPDATE SET {col} = excluded.{col}",
+                                    [(key, i, url) for i, url in enumerate(info["files"])])
+        print(f"[CATALOGUE] {json_name}: {len(data)} datasets imported ({stage})")
+        return len(data)
+
+    def to_dict(self, json_name, stage="analysis", pattern=None):
+        '''
+        {key: {"metadata": ..., "files": [...]}} in the format of the process JSONs. Datasets with
+        files that have no URL for `stage` yet (e.g. only the skim stage imported) are left out.
+        '''
+        col = _URL_COLUMN[stage]
+        out = {}
+        for (key,) in self.db.execute("SELECT key FROM datasets WHERE json_name = ? ORDER BY key", (json_name,)).fetchall():
+            if pattern and not re.search(pattern, key):
+                continue
+            table = self._table(key, stage)
+            files = [u for (u,) in self.db.execute(f"SELECT {col} FROM {table} WHERE dataset = ? ORDER BY idx", (key,))]
+            n_none = sum(u is None for u in files)
+            if n_none:
+                # a job's index is its position in `files`: dropping the rows would shift the others
+                print(f"[CATALOGUE] Skipping {key}: {n_none}/{len(files)} files have no {stage} URL")
+                continue
+            out[key] = {"metadata": self.metadata(key, stage), "files": files}
+        return out
+
+    def export_json(self, json_name, path, stage="analysis"):
+        with open(path, "w") as f:
+            json.dump(self.to_dict(json_name, stage), f, indent=4)
+
+    #------------------------------------------------------------------------------------------------------------------------------------------
+
+    def json_names(self):
+        return [n for (n,) in self.db.execute("SELECT DISTINCT json_name FROM datasets ORDER BY json_name")]
+
+    def datasets(self, json_name=None, pattern=None):
+        q, args = "SELECT key FROM datasets", ()
+        if json_name:
+            q, args = q + " WHERE json_name = ?", (json_name,)
+        keys = [k for (k,) in self.db.execute(q + " ORDER BY key", args)]
+        return [k for k in keys if not pattern or re.search(pattern, k)]
+
+    def metadata(self, dataset, stage="analysis"):
+        '''Metadata of `dataset` as given by the JSON of `stage` (the other stage's if only that one was imported).'''
+        row = self.db.execute("SELECT skim_meta, analysis_meta FROM datasets WHERE key = ?", (dataset,)).fetchone()
+        if row is None:
+            raise KeyError(f"[CATALOGUE] Dataset '{dataset}' not in {self.path}")
+        skim, ana = row
+        meta = (ana or skim) if stage == "analysis" else (skim or ana)
+        return json.loads(meta)
+
+    def _table(self, dataset, stage):
+        '''"merged" for the analysis input of a compacted dataset, "files" otherwise.'''
+        if stage != "analysis":
+            return "files"
+        try:
+            row = self.db.execute("SELECT 1 FROM merged WHERE dataset = ? LIMIT 1", (dataset,)).fetchone()
+        except sqlite3.OperationalError:   # catalogue written before the table existed
+            return "files"
+        return "merged" if row else "files"
+
+    def job(self, dataset, idx, stage="analysis"):
+        '''(input URL, metadata) of job `idx` of `dataset`.'''
+        table = self._table(dataset, stage)
+        row = self.db.execute(f"SELECT {_URL_COLUMN[stage]} FROM {table} WHERE dataset = ? AND idx = ?", (dataset, idx)).fetchone()
+        if row is None or row[0] is None:
+            n = self.db.execute(f"SELECT COUNT(*) FROM {table} WHERE dataset = ?", (dataset,)).fetchone()[0]
+            raise IndexError(f"[CATALOGUE] No {stage} input for {dataset}[{idx}] ({n} files)")
+        return row[0], self.metadata(dataset, stage)
+
+    def files(self, dataset):
+        '''All rows of a dataset as dicts, ordered by index.'''
+        cur = self.db.execute("SELECT * FROM files WHERE dataset = ? ORDER BY idx", (dataset,))
+        names = [d[0] for d in cur.description]
+        return [dict(zip(names, row)) for row in cur]
+
+    def counts(self, dataset, stage="analysis"):
+        '''{idx: events in the input file of `stage`, or None if not known yet}.'''
+        col, table = _COUNT_COLUMN[stage], self._table(dataset, stage)
+        try:
+            rows = self.db.execute(f"SELECT idx, {col} FROM {table} WHERE dataset = ? ORDER BY idx", (dataset,)).fetchall()
+        except sqlite3.OperationalError:   # catalogue written before the column existed
+            return {i: None for (i,) in self.db.execute("SELECT idx FROM files WHERE dataset = ? ORDER BY idx", (dataset,))}
+        return dict(rows)
+
+    def totals(self, dataset):
+        '''{"files", "nevents", "sumw", "size", "skimmed"} summed over the files of a dataset.'''
+        row = self.db.execute("SELECT COUNT(*), SUM(nevents), SUM(sumw), SUM(size), SUM(skim_status = 'done') "
+                              "FROM files WHERE dataset = ?", (dataset,)).fetchone()
+        return dict(zip(("files", "nevents", "sumw", "size", "skimmed"), row))
+
+    #------------------------------------------------------------------------------------------------------------------------------------------
+
+    def set_status(self, jobs, stage, status):
+        if stage not in STAGES:
+            raise ValueError(f"[CATALOGUE] Unknown stage '{stage}'")
+        with self.db:
+            for d, i in jobs:
+                self.db.execute(f"UPDATE {self._table(d, stage)} SET {stage}_status = ? WHERE dataset = ? AND idx = ?",
+                                (status, d, i))
+
+    def skims(self, dataset):
+        '''[(idx, skim_url, size, entries)] of the per-file skims of a dataset (the compaction input).'''
+        return self.db.execute("SELECT idx, skim_url, size, entries FROM files WHERE dataset = ? AND skim_url IS NOT NULL "
+                               "ORDER BY idx", (dataset,)).fetchall()
+
+    def set_merged(self, dataset, rows):
+        '''
+        Replace the compacted files of a dataset; rows: dicts with skim_url, size, nevents, sumw,
+        entries and sources (list of file indices), indexed in order. rows=[] goes back to the skims.
+        '''
+        with self.db:
+            self.db.execute("DELETE FROM merged WHERE dataset = ?", (dataset,))
+            self.db.executemany("INSERT INTO merged(dataset, idx, skim_url, size, nevents, sumw, entries, sources) "
+                                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                                [(dataset, i, r["skim_url"], r.get("size"), r.get("nevents"), r.get("sumw"),
+                                  r.get("entries"), json.dumps(r.get("sources", []))) for i, r in enumerate(rows)])
+
+    def update(self, dataset, idx, **values):
+        '''Set columns (skim_url, size, nevents, sumw, ...) of one file.'''
+        cols = ", ".join(f"{k} = ?" for k in values)
+        with self.db:
+            self.db.execute(f"UPDATE files SET {cols} WHERE dataset = ? AND idx = ?", (*values.values(), dataset, idx))
+
+    def scan(self, base, server=None, pattern=None, max_workers=16):
+        '''
+        Match the skim outputs that really exist under `base`/<dataset>/ (named <dataset>_<idx>.root,
+        or .parquet), read their Meta (nEvents, sumGenWeight) and size, and set skim_url and
+        skim_status ("done", "bad" if unreadable, "missing" if absent).
+        '''
+        from utils.output_index import index_dirs, to_url
+
+        keys  = self.datasets(pattern=pattern)
+        index = index_dirs([f"{base}/{k}" for k in keys], server=server)
+        todo, missing = [], []
+        for k in keys:
+            listing = index[f"{base}/{k}"] or set()
+            for (i,) in self.db.execute("SELECT idx FROM files WHERE dataset = ?", (k,)).fetchall():
+                name = next((n for n in (f"{k}_{i}.root", f"{k}_{i}.parquet") if n in listing), None)
+                if name:
+                    todo.append((k, i, to_url(f"{base}/{k}", name, server)))
+                else:
+                    missing.append((k, i))
+
+        print(f"[CATALOGUE] Reading Meta of {len(todo)} skims ({len(missing)} missing)")
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            metas = list(pool.map(lambda t: _read_skim_meta(t[2]), todo))
+        with self.db:
+            for (k, i, url), meta in zip(todo, metas):
+                status = "bad" if meta is None else "done"
+                self.db.execute("UPDATE files SET skim_url = ?, skim_status = ?, nevents = ?, sumw = ?, size = ?, entries = ? "
+                                "WHERE dataset = ? AND idx = ?",
+                                (url, status, *(meta or (None, None, None, None)), k, i))
+            self.db.executemany("UPDATE files SET skim_status = 'missing' WHERE dataset = ? AND idx = ?", missing)
+        return len(todo), len(missing)
+
+    def count_entries(self, stage, pattern=None, max_workers=16):
+        '''
+        Open the input files of `stage` whose event count is unknown and store their number of
+        Events entries (NanoAOD files for "skim", skims for "analysis"); used by the job splitting.
+        '''
+        col, url_col = _COUNT_COLUMN[stage], _URL_COLUMN[stage]
+        todo = [(k, i, u) for k in self.datasets(pattern=pattern)
+                for i, u in self.db.execute(f"SELECT idx, {url_col} FROM files WHERE dataset = ? AND {col} IS NULL "
+                                            f"AND {url_col} IS NOT NULL", (k,)).fetchall()]
+        print(f"[CATALOGUE] Counting entries of {len(todo)} {stage} inputs")
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            counts = list(pool.map(lambda t: _num_entries(t[2]), todo))
+        with self.db:
+            self.db.executemany(f"UPDATE files SET {col} = ? WHERE dataset = ? AND idx = ?",
+                                [(n, k, i) for (k, i, _), n in zip(todo, counts) if n is not None])
+        return sum(n is not None for n in counts)
+
+#----------------------------------------------------------------------------------------------------------------------------------------------
+
+def process_jsons(dataset_dir, pattern="*.json", stage="analysis", catalogue=None):
+    '''
+    (json_name, data, job_json) per process JSON matching `pattern`, for the submitters:
+    read from `dataset_dir`/*.json, or from the SQLite `catalogue` when given, in which case
+    job_json (the file a job receives as --json) is the catalogue itself.
+    '''
+    if catalogue is None:
+        for path in sorted(glob.glob(os.path.join(dataset_dir, pattern))):
+            with open(path) as f:
+                yield os.path.basename(path), json.load(f), path
+        return
+    with Catalogue(catalogue, readonly=True) as cat:
+        names = [n for n in cat.json_names() if fnmatch.fnmatch(n, pattern)]
+        for name in names:
+            yield name, cat.to_dict(name, stage), catalogue
+
+def _read_skim_meta(url):
+    '''(nEvents, sumGenWeight or None, size in bytes, Events entries) from a skim; None if unreadable.'''
+    if uproot is None:
+        raise ImportError("uproot is required to scan skims")
+    try:
+        if url.endswith(".parquet"):
+            from utils.skim_io import read_meta_parquet
+            meta = read_meta_parquet(url)
+            return int(meta["nEvents"]), meta.get("sumGenWeight"), meta["size"], meta["entries"]
+        with uproot.open(url) as f:
+            meta = f["Meta"]
+            nev  = int(meta["nEvents"].array(library="np").sum())
+            sumw = float(meta["sumGenWeight"].array(library="np").sum()) if "sumGenWeight" in meta.keys() else None
+            return nev, sumw, int(f.file.source.num_bytes), int(f["Events"].num_entries)
+    except Exception as e:
+        print(f"[WARNING] Invalid skim {url}: {e}")
+        return None
+
+def _num_entries(url):
+    if uproot is None:
+        raise ImportError("uproot is required to count entries")
+    try:
+        if url.endswith(".parquet"):
+            from utils.skim_io import read_meta_parquet
+            return int(read_meta_parquet(url)["entries"])
+        with uproot.open(url, timeout=300) as f:
+            return int(f["Events"].num_entries)
+    except Exception as e:
+        print(f"[WARNING] Could not count entries of {url}: {e}")
+        return None
+
+#----------------------------------------------------------------------------------------------------------------------------------------------
+
+def main():
+    parser = argparse.ArgumentParser(description="SQLite dataset catalogue")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+
+    p = sub.add_parser("import", help="import process JSONs")
+    p.add_argument("db")
+    p.add_argument("jsons", nargs="+")
+    p.add_argument("--stage", choices=STAGES, required=True, help="skim: NanoAOD file lists, analysis: skim file lists")
+
+    p = sub.add_parser("export", help="write the process JSONs back")
+    p.add_argument("db")
+    p.add_argument("outdir")
+    p.add_argument("--stage", choices=STAGES, default="analysis")
+
+    p = sub.add_parser("scan", help="find existing skims and read their Meta")
+    p.add_argument("db")
+    p.add_argument("--base", required=True)
+    p.add_argument("--server", default=None)
+    p.add_argument("--pattern", default=None)
+
+    p = sub.add_parser("count", help="store the Events entries of the stage inputs (for the job splitting)")
+    p.add_argument("db")
+    p.add_argument("--stage", choices=STAGES, required=True)
+    p.add_argument("--pattern", default=None)
+
+    p = sub.add_parser("totals", help="per-dataset file/event/sumw totals")
+    p.add_argument("db")
+    p.add_argument("--pattern", default=None)
+    args = parser.parse_args()
+
+    with Catalogue(args.db) as cat:
+        if args.cmd == "import":
+            for path in args.jsons:
+                cat.import_json(path, args.stage)
+        elif args.cmd == "export":
+            os.makedirs(args.outdir, exist_ok=True)
+            for name in cat.json_names():
+                cat.export_json(name, os.path.join(args.outdir, name), args.stage)
+            print(f"[CATALOGUE] Exported {len(cat.json_names())} JSONs to {args.outdir}")
+        elif args.cmd == "scan":
+            cat.scan(args.base, server=args.server, pattern=args.pattern)
+        elif args.cmd == "count":
+            print(f"[CATALOGUE] {cat.count_entries(args.stage, pattern=args.pattern)} files counted")
+        elif args.cmd == "totals":
+            print(f"{'dataset':60}  {'files':>6}  {'skimmed':>7}  {'nEvents':>12}  {'sumw':>14}")
+            for k in cat.datasets(pattern=args.pattern):
+                t = cat.totals(k)
+                sumw = f"{t['sumw']:14.6g}" if t["sumw"] is not None else f"{'-':>14}"
+                print(f"{k:60}  {t['files']:6d}  {t['skimmed'] or 0:7d}  {t['nevents'] or 0:12d}  {sumw}")
+
+
+if __name__ == "__main__":
+    main()
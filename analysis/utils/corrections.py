@@ -0,0 +1,370 @@
+import os
+import hashlib
+import numpy as np
+import awkward as ak
+import correctionlib
+
+from utils.rng import CounterRNG
+from utils.deltas_array import overlap_mask
+
+# Nominal object corrections of Wh_Processor (STEP 2-4): EGM scale/smearing, JEC L2 (+ residual
+# on data) with JER smearing, and PUPPI Type-1 MET. The same code runs in the processor and,
+# with `run_skim.py --corrections`, once at skim time, where the results are stored as
+# Electron_pt_corr, Jet_pt_corr, Jet_mass_corr, PuppiMET_pt_corr and PuppiMET_phi_corr.
+# The skim's Meta tree carries `corrVersion`, a hash of the correction JSON contents, the RNG
+# seed and CORR_SCHEME; the processor reuses the stored branches only when its own hash agrees.
+# The smearing draws come from CounterRNG, keyed by (run, lumi, event, object index), so the
+# skim has to correct the collections exactly as they are written out (after the object cuts).
+
+CORR_SCHEME = "wh:egm-ss/jec-l2res/jer-hybrid/type1-puppi:v1"   # bump when the recipe below changes
+
+EGM_JSON  = "electronSS_EtDependent_v1.json.gz"
+JERC_JSON = "jet_jerc.json.gz"
+
+SKIM_BRANCHES = {
+    "Electron": ["pt_corr"],
+    "Jet":      ["pt_corr", "mass_corr"],
+    "PuppiMET": ["pt_corr", "phi_corr"],
+}
+
+#----------------------------------------------------------------------------------------------------------------------------------------------
+
+def corrections_version(paths, seed, scheme=CORR_SCHEME):
+    '''
+    60-bit hash of the correction files (name + content), the smearing seed and the recipe tag.
+    Fits a signed int64 Meta branch; a missing file hashes as such, so it never matches a real one.
+    '''
+    h = hashlib.sha1(scheme.encode())
+    h.update(str(int(seed)).encode())
+    for path in sorted(paths):
+        h.update(os.path.basename(path).encode())
+        if not os.path.exists(path):
+            h.update(b"<missing>")
+            continue
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                h.update(block)
+    return int(h.hexdigest()[:15], 16)
+
+#----------------------------------------------------------------------------------------------------------------------------------------------
+
+def _no_stats(x, title):
+    pass
+
+def _flat_np(x):
+    return ak.to_numpy(ak.flatten(x))
+
+def _ptphi_to_pxpy(pt, phi):
+    return pt * np.cos(phi), pt * np.sin(phi)
+
+def _pxpy_to_ptphi(px, py):
+    return np.hypot(px, py), np.arctan2(py, px)
+
+def _clip_nextafter(x, lo, hi):
+    lo2 = np.nextafter(lo, 1.0)
+    hi2 = np.nextafter(hi, -1.0)
+    x = ak.where(x < lo2, lo2, x)
+    x = ak.where(x > hi2, hi2, x)
+    return x
+
+def _jec_args(corr, jets, pt, rho, run, what):
+    '''Positional correctionlib inputs of a JEC level, in the order the correction declares them.'''
+    args = []
+    for name in [v.name for v in corr.inputs]:
+        if   name == "JetA":   args.append(_flat_np(jets.area))
+        elif name == "JetEta": args.append(_flat_np(jets.eta))
+        elif name == "JetPhi": args.append(_flat_np(jets.phi))
+        elif name == "Rho":    args.append(_flat_np(rho))
+        elif name == "JetPt":  args.append(_flat_np(pt))
+        elif name == "run":    args.append(_flat_np(ak.broadcast_arrays(run, pt)[0]))
+        else: raise RuntimeError(f"Unexpected input '{name}' in {what}")
+    return args
+
+#----------------------------------------------------------------------------------------------------------------------------------------------
+
+class Corrections:
+    '''
+    corr = Corrections(egm_scale=..., jec_L2=..., jer_sf=..., is_mc=True, rng=rng, paths=[egm_json, jerc_json])
+    ElectronCorr           = corr.egm(events, stats)
+    jets, pt_jec, pt_corr  = corr.jec_jer(events, stats)
+    PuppiMETCorr           = corr.type1_met(events, ElectronCorr, pt_jec, pt_corr, stats)
+
+    corr.matches(meta_version) and Corrections.has_branches(events)
+        -> Corrections.from_branches(events) gives the same three objects from the skim branches.
+
+    `events` needs run, luminosityBlock, event, fixedGridRhoFastjetAll, Electron, Jet, Muon, PuppiMET.
+    '''
+
+    def __init__(self, egm_scale=None, egm_smear=None, jec_L2=None, jec_residual=None, jer_sf=None, jer_res=None,
+                 is_mc=True, rng=None, paths=()):
+        self.egm_scale    = egm_scale
+        self.egm_smear    = egm_smear
+        self.jec_L2       = jec_L2
+        self.jec_residual = jec_residual
+        self.jer_sf       = jer_sf
+        self.jer_res      = jer_res
+        self.is_mc        = is_mc
+        self.rng          = rng if rng is not None else CounterRNG(seed=12345)
+        self.version      = corrections_version(paths, self.rng.seed)
+
+    @classmethod
+    def load(cls, corr_dir, is_mc, seed=12345):
+        '''Same correction keys as Wh_Processor.__init__ (used by the skimmer).'''
+        egm_path  = os.path.join(corr_dir, EGM_JSON)
+        jerc_path = os.path.join(corr_dir, JERC_JSON)
+        kw = {}
+        if os.path.exists(egm_path):
+            egm = correctionlib.CorrectionSet.from_file(egm_path)
+            kw["egm_scale"] = egm["EGMScale_ElePTsplit_2024"]
+            kw["egm_smear"] = egm["EGMSmearAndSyst_ElePTsplit_2024"]
+        else:
+            print(f"[CORR] {egm_path} not found; no EGM corrections.")
+        if os.path.exists(jerc_path):
+            jerc = correctionlib.CorrectionSet.from_file(jerc_path)
+            keys = list(jerc.keys())
+            tag  = "MC" if is_mc else "DATA"
+
+            def pick(*parts):
+                k = [k for k in keys if all(p in k for p in parts)]
+                if len(k) != 1:
+                    print(f"[CORR] WARNING: {parts} not unique: {k}")
+                    return None
+                return jerc[k[0]]
+
+            kw["jec_L2"] = pick("L2Relative", "AK4PFPuppi", tag)
+            if not is_mc:
+                kw["jec_residual"] = pick("L2L3Residual", "AK4PFPuppi", "DATA")
+            kw["jer_res"] = pick("PtResolution", "AK4PFPuppi", "MC")
+            kw["jer_sf"]  = pick("ScaleFactor",  "AK4PFPuppi", "MC")
+        else:
+            print(f"[CORR] {jerc_path} not found; no JEC/JER corrections.")
+        return cls(is_mc=is_mc, rng=CounterRNG(seed=seed), paths=[egm_path, jerc_path], **kw)
+
+    def matches(self, version):
+        return version is not None and int(version) == self.version
+
+    #------------------------------------------------------------------------------------------------------------------------------------------
+
+    @staticmethod
+    def has_branches(events):
+        fields = ak.fields(events)
+        return all(obj in fields and set(names).issubset(ak.fields(events[obj])) for obj, names in SKIM_BRANCHES.items())
+
+    @staticmethod
+    def from_branches(events):
+        '''(ElectronCorr, jets, PuppiMETCorr) from the skim-time corrected branches.'''
+        ele  = ak.with_field(events.Electron, events.Electron.pt_corr, "pt")
+        jets = ak.with_field(events.Jet, events.Jet.pt_corr, "pt")
+        jets = ak.with_field(jets, events.Jet.mass_corr, "mass")
+        met  = ak.zip({"pt": events.PuppiMET.pt_corr, "phi": events.PuppiMET.phi_corr}, with_name="MET")
+        return ele, jets, met
+
+    #------------------------------------------------------------------------------------------------------------------------------------------
+
+    def egm(self, events, stats=_no_stats):
+        '''STEP 2: data scale / MC smearing of the electron pT (pt, r9, |scEta|).'''
+        ele_all  = events.Electron
+        absScEta = np.abs(ele_all.superclusterEta)
+        counts   = ak.num(ele_all.pt, axis=1)
+
+        if (not self.is_mc) and (self.egm_scale is not None):
+            print("[DEBUG] EGM scale axis order:", [v.name for v in self.egm_scale.inputs])
+            # EGM scale axis order: ['syst', 'pt', 'r9', 'AbsScEta']
+            scale_flat = self.egm_scale.evaluate("scale", _flat_np(ele_all.pt), _flat_np(ele_all.r9), _flat_np(absScEta))
+            scale = ak.unflatten(ak.Array(scale_flat), counts)
+
+            stats(scale, "EGM scale (DATA)")
+            stats(ele_all.pt, "Electron pt (pre EGM)")
+            stats(lambda: ele_all.pt * scale, "Electron pt (post EGM)")
+
+            val = ele_all.pt * scale
+
+        elif self.is_mc and (self.egm_smear is not None):
+            print("[DEBUG] EGM smear axis order:", [v.name for v in self.egm_smear.inputs])
+            # EGM smear axis order: ['syst', 'pt', 'r9', 'AbsScEta']
+            width_flat  = self.egm_smear.evaluate("smear", _flat_np(ele_all.pt), _flat_np(ele_all.r9), _flat_np(absScEta))
+            smear_width = ak.unflatten(ak.Array(width_flat), counts)
+            n = self.rng.normal(events, ele_all, "egm_smear")   # deterministic per electron
+
+            stats(smear_width, "EGM smear width (MC)")
+            stats(n, "EGM smear RNG n (MC)")
+
+            val = ele_all.pt * (1.0 + smear_width * n)
+        else:
+            return ele_all
+
+        # electrons with corrected pt (all other fields unchanged)
+        ele_corr = ak.with_field(ele_all, ak.values_astype(ak.where(val > 0.0, val, 0.0), "float32"), "pt")
+        stats(lambda: (ele_corr.pt / ele_all.pt) - 1.0, "EGM relative pt shift (MC)" if self.is_mc else "EGM relative pt scale shift (DATA)")
+        return ele_corr
+
+    #------------------------------------------------------------------------------------------------------------------------------------------
+
+    def jec_jer(self, events, stats=_no_stats):
+        '''
+        STEP 3: L2Relative (+ L2L3Residual on data) on the raw pT, then hybrid JER smearing (MC).
+        Returns (jets with corrected pt/mass + jecFactor/jerFactor, pt after JEC, pt after JER).
+        '''
+        jets_in   = events.Jet
+        rawFactor = getattr(jets_in, "rawFactor", ak.zeros_like(jets_in.pt))
+        pt_raw    = jets_in.pt   * (1.0 - rawFactor)
+        mass_raw  = jets_in.mass * (1.0 - rawFactor)
+        rho       = ak.broadcast_arrays(events.fixedGridRhoFastjetAll, pt_raw)[0]
+        counts    = ak.num(pt_raw, axis=1)
+
+        # Run 3 PUPPI: no L1, L3 is unity. Mandatory L2 (MC), L2 + L2L3Residual (DATA).
+        pt_step = pt_raw
+        if self.jec_L2 is not None:
+            print("[JEC:L2 inputs]", [v.name for v in self.jec_L2.inputs])
+            # [JEC:L2 inputs] ['JetEta', 'JetPhi', 'JetPt']
+            fac_L2  = ak.unflatten(self.jec_L2.evaluate(*_jec_args(self.jec_L2, jets_in, pt_step, rho, events.run, "JEC L2")), counts)
+            pt_step = pt_step * fac_L2
+            stats(fac_L2, "JEC L2 factor")
+
+        if (not self.is_mc) and (self.jec_residual is not None):
+            print("[JEC:Residual inputs]", [v.name for v in self.jec_residual.inputs])
+            fac_RES = ak.unflatten(self.jec_residual.evaluate(*_jec_args(self.jec_residual, jets_in, pt_step, rho, events.run, "JEC residual")), counts)
+            pt_step = pt_step * fac_RES
+            stats(fac_RES, "JEC Residual factor")
+
+        # --- JEC factor and mass --- #
+        jec_factor = ak.where(pt_raw > 0, pt_step / pt_raw, 1.0)
+        jec_factor = ak.where(np.isfinite(jec_factor), jec_factor, 1.0)  # guard NaN/Inf
+        jec_factor = ak.values_astype(_clip_nextafter(jec_factor, 0.0, np.inf), "float32")
+        pt_jec     = pt_step
+        mass_jec   = mass_raw * jec_factor
+
+        # --- JER (MC) --- #
+        if self.is_mc and (self.jer_sf is not None):
+            pt  = pt_jec
+            eta = jets_in.eta
+
+            order = [v.name for v in self.jer_sf.inputs]
+            print("[JER:SF inputs]", order)
+            # [JER:SF inputs] ['JetEta', 'JetPt', 'systematic']
+            arrs   = {"JetEta": _flat_np(eta), "JetPt": _flat_np(pt), "systematic": "nom"}
+            sf_nom = ak.unflatten(self.jer_sf.evaluate(*[arrs[name] for name in order]), counts)
+
+            if self.jer_res is not None:
+                order = [v.name for v in self.jer_res.inputs]
+                print("[JER:Res inputs]", order)
+                arrs = {"JetEta": _flat_np(eta), "Rho": _flat_np(rho), "JetPt": _flat_np(pt)}
+                for name in order:
+                    if name not in arrs:
+                        raise RuntimeError(f"Unexpected input '{name}' in JER Res")
+                res = ak.unflatten(self.jer_res.evaluate(*[arrs[name] for name in order]), counts)
+            else:
+                res = ak.zeros_like(pt)
+
+            # gen-match if available (NaN for unmatched)
+            if hasattr(jets_in, "pt_genMatched"):
+                pt_gen  = jets_in.pt_genMatched
+                has_gen = ak.fill_none(np.isfinite(pt_gen), False)
+            else:
+                pt_gen  = ak.full_like(pt, np.nan)
+                has_gen = ak.zeros_like(pt, dtype=bool)
+
+            # tight match: |pT - pT_gen| < 3 * σ * pT
+            # https://cms-jerc.web.cern.ch/JER/
+            ptdiff_ok   = ak.fill_none(np.abs(ak.mask(pt, has_gen) - ak.mask(pt_gen, has_gen)) < (3.0 * ak.mask(res, has_gen) * ak.mask(pt, has_gen)), False)
+            match_tight = has_gen & ptdiff_ok
+
+            # matched & tight: scale; unmatched or not-tight: stochastic smear (deterministic per jet)
+            pt_matched = ak.where((pt_gen + sf_nom * (pt - pt_gen)) > 0.0, pt_gen + sf_nom * (pt - pt_gen), 0.0)
+            pt_corr    = ak.where(match_tight, pt_matched, pt)
+            nsm     = self.rng.normal(events, jets_in, "jer_smear")
+            sigma   = res * np.sqrt(np.maximum(sf_nom**2 - 1.0, 0.0))
+            pt_corr = ak.where(~match_tight, pt * (1.0 + sigma * nsm), pt_corr)
+            pt_corr = ak.where(pt_corr > 1e-6, pt_corr, 1e-6)
+
+            jer_factor = ak.values_astype(ak.where(pt > 0, pt_corr / pt, 1.0), "float32")
+            mass_corr  = mass_jec * jer_factor
+        else:
+            pt_corr    = pt_jec
+            mass_corr  = mass_jec
+            jer_factor = ak.values_astype(ak.ones_like(pt_jec), "float32")
+
+        jets = ak.with_field(jets_in, ak.values_astype(pt_corr,   "float32"), "pt")
+        jets = ak.with_field(jets,    ak.values_astype(mass_corr, "float32"), "mass")
+        jets = ak.with_field(jets,    jec_factor, "jecFactor")
+        jets = ak.with_field(jets,    jer_factor, "jerFactor")
+
+        stats(rawFactor, "Jet rawFactor")
+        stats(pt_raw,    "Jet pt_raw")
+        frac_hi = np.mean(_flat_np(jec_factor > 2.0)) if ak.sum(counts) else 0.0
+        print(f"[JEC] frac(jec_factor>2) = {frac_hi:.3%}")
+        return jets, pt_jec, pt_corr
+
+    #------------------------------------------------------------------------------------------------------------------------------------------
+
+    def type1_met(self, events, ele_corr, pt_jec, pt_corr, stats=_no_stats):
+        '''
+        STEP 4: PUPPI Type-1 MET from L2(xL3) jets with raw-pT > 15, |eta| < 4.8, tight ID and no lepton
+        within ΔR 0.4, plus the JER ratio of STEP 3 (MC) and the EGM electron shift. No x-y correction.
+        '''
+        met_in = events.PuppiMET
+        met_px, met_py = _ptphi_to_pxpy(met_in.pt, met_in.phi)
+
+        jets_nom  = events.Jet
+        rawFactor = ak.fill_none(getattr(jets_nom, "rawFactor", ak.zeros_like(jets_nom.pt)), 0.0)
+        pt_raw    = jets_nom.pt * (1.0 - rawFactor)
+        counts_j  = ak.num(jets_nom.pt, axis=1)
+        rho_forL  = ak.broadcast_arrays(events.fixedGridRhoFastjetAll, pt_raw)[0]
+
+        # --- L2xL3-only pT for PUPPI Type-1 "new" JEC --- #
+        pt_L2L3 = pt_raw
+        if self.jec_L2 is not None:
+            print("[Type-1] JEC L2 inputs:", [v.name for v in self.jec_L2.inputs])
+            c2_flat = self.jec_L2.evaluate(*_jec_args(self.jec_L2, jets_nom, pt_L2L3, rho_forL, events.run, "[Type-1 MET] JEC L2"))
+            if not np.all(np.isfinite(c2_flat)):
+                raise RuntimeError("[Type-1 MET] Non-finite values from JEC L2.")
+            pt_L2L3 = pt_L2L3 * ak.unflatten(c2_flat, counts_j)
+
+        # --- Jet mask for PUPPI Type-1 --- #
+        overlap_mu, _ = overlap_mask(jets_nom, events.Muon, 0.4)
+        overlap_el, _ = overlap_mask(jets_nom, ele_corr, 0.4)
+        jet_for_met = (
+            (pt_L2L3 > 15.0)
+            & (np.abs(jets_nom.eta) < 4.8)
+            & ak.values_astype(jets_nom.passJetIdTight, bool)
+            & overlap_mu & overlap_el
+        )
+        if ak.any(ak.is_none(jet_for_met)):
+            raise RuntimeError("[Type-1 MET] jet_for_met has None values; investigate overlap masks or jetId fields.")
+
+        dpt_jec = ak.where(jet_for_met, (pt_L2L3 - jets_nom.pt), 0.0)
+
+        # --- JER propagation (MC): scale L2L3 by (pt_corr / pt_jec) from STEP 3 --- #
+        if self.is_mc:
+            jer_ratio = ak.where(pt_jec > 0, pt_corr / pt_jec, 1.0)
+            dpt_jer   = ak.where(jet_for_met, (pt_L2L3 * jer_ratio - pt_L2L3), 0.0)
+        else:
+            dpt_jer = ak.zeros_like(dpt_jec)
+
+        # --- Update MET: jets, then the electron energy correction --- #
+        dpx = ak.sum((dpt_jec + dpt_jer) * np.cos(jets_nom.phi), axis=1)
+        dpy = ak.sum((dpt_jec + dpt_jer) * np.sin(jets_nom.phi), axis=1)
+        ele_all = events.Electron
+        dpx_el  = ak.sum((ele_corr.pt - ele_all.pt) * np.cos(ele_all.phi), axis=1)
+        dpy_el  = ak.sum((ele_corr.pt - ele_all.pt) * np.sin(ele_all.phi), axis=1)
+
+        met_px_corr = met_px - dpx - ak.values_astype(dpx_el, "float64")
+        met_py_corr = met_py - dpy - ak.values_astype(dpy_el, "float64")
+        met_pt_corr, met_phi_corr = _pxpy_to_ptphi(met_px_corr, met_py_corr)
+
+        met = ak.zip({"pt": ak.values_astype(met_pt_corr, "float32"), "phi": ak.values_astype(met_phi_corr, "float32")}, with_name="MET")
+
+        n_jets_all  = ak.sum(counts_j)
+        n_jets_used = ak.sum(jet_for_met)
+        frac_used   = float(n_jets_used) / float(n_jets_all) if n_jets_all > 0 else 0.0
+        print(f"[Type-1] jets used: {int(n_jets_used)}/{int(n_jets_all)}  ({frac_used:.1%})")
+
+        stats(dpt_jec,  "MET Δpt from JEC (per jet)")
+        stats(dpt_jer,  "MET Δpt from JER (per jet)")
+        stats(dpx,      "MET Δpx sum (jets)")
+        stats(dpy,      "MET Δpy sum (jets)")
+        stats(dpx_el,   "MET Δpx from electrons")
+        stats(dpy_el,   "MET Δpy from electrons")
+        stats(met.pt,   "PuppiMETCorr pt (final)")
+        stats(met.phi,  "PuppiMETCorr phi (final)")
+        return met
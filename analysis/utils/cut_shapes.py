@@ -0,0 +1,128 @@
+import numpy as np
+import hist
+
+# Cumulative, sparse storage of the `cut_index x observable` SR shape histograms.
+# Row i of a shape holds the events with BDT score > cuts[i]. CutShapes fills every event once, in
+# the row of the highest cut it passes, and keeps only the touched (row, bin) cells as sorted flat
+# indices with their sumw/sumw2; to_hist() sums the rows >= i (reverse cumsum) into the dense
+# IntCategory x axis hist.Hist that is projected and written as a TH2. Once more than
+# DENSE_FRACTION of the cells are touched (high-statistics merges) the cells are kept dense.
+#
+#   h = CutShapes(cuts, hist.axis.Regular(50, 0, 1000, name="H_mass"))
+#   h.fill(score=bdt, H_mass=mass, weight=w)    # one fill for all cuts
+#   h.fill(cut_index=0, H_mass=mass, weight=w)  # one row only, like the IntCategory histogram
+#   h = h + other                               # chunks / jobs
+#   dense = h.to_hist()                         # IntCategory(range(len(cuts)), name="cut_index") x H_mass
+
+DENSE_FRACTION = 0.5   # touched cells above which the storage turns dense (a sparse cell costs 24 bytes, a dense one 16)
+
+#----------------------------------------------------------------------------------------------------------------------------------------------
+
+def passed_cuts(cuts, score):
+    '''Number of `cuts` (ascending) below each score, i.e. of `score > cut` that hold; 0 for NaN.'''
+    score = np.asarray(score, dtype=np.float64)
+    n = np.searchsorted(np.asarray(cuts, dtype=np.float64), score, side="left")
+    return np.where(np.isnan(score), 0, n)
+
+
+class CutShapes:
+    '''
+    Sparse cumulative `cut_index x axis` histogram with Weight storage (see module comment).
+    `cuts` must be ascending; `axis` is the observable's hist axis (its name is the fill keyword).
+    '''
+
+    def __init__(self, cuts, axis, name="cut_index"):
+        self.cuts = np.asarray(cuts, dtype=np.float64)
+        if np.any(np.diff(self.cuts) < 0):
+            raise ValueError("[CUT-SHAPES] cuts must be ascending")
+        self.axis   = axis
+        self.name   = name
+        self._flow  = 1 if axis.traits.underflow else 0
+        self._ext   = axis.extent
+        self._idx   = np.zeros(0, dtype=np.int64)   # flat (row * extent + bin), sorted, unique; None once dense
+        self._sumw  = np.zeros(0)
+        self._sumw2 = np.zeros(0)
+
+    @property
+    def _size(self):
+        return len(self.cuts) * self._ext
+
+    def _add(self, idx, sumw, sumw2):
+        if self._idx is None:
+            # dense: sumw/sumw2 hold every cell
+            self._sumw  += np.bincount(idx, weights=sumw, minlength=self._size)
+            self._sumw2 += np.bincount(idx, weights=sumw2, minlength=self._size)
+            return
+        idx, inv = np.unique(np.concatenate([self._idx, idx]), return_inverse=True)
+        self._sumw  = np.bincount(inv, weights=np.concatenate([self._sumw, sumw]), minlength=len(idx))
+        self._sumw2 = np.bincount(inv, weights=np.concatenate([self._sumw2, sumw2]), minlength=len(idx))
+        self._idx   = idx
+        if len(idx) > DENSE_FRACTION * self._size:
+            self._sumw, self._sumw2 = self._dense()
+            self._idx = None
+
+    def _dense(self):
+        if self._idx is None:
+            return self._sumw, self._sumw2
+        sumw, sumw2 = np.zeros(self._size), np.zeros(self._size)
+        sumw[self._idx], sumw2[self._idx] = self._sumw, self._sumw2
+        return sumw, sumw2
+
+    def _cells(self):
+        idx = np.arange(self._size) if self._idx is None else self._idx
+        return idx, self._sumw, self._sumw2
+
+    def fill(self, score=None, weight=None, cut_index=None, **values):
+        '''
+        fill(score=s, x=...): each entry once, in the row of the highest cut below its score.
+        fill(cut_index=i, x=...): row i only, as the IntCategory histogram would (+w in row i,
+        -w in row i-1, so that the rows below i do not get it).
+        '''
+        if list(values) != [self.axis.name] or (score is None) == (cut_index is None):
+            raise TypeError(f"[CUT-SHAPES] fill expects score= or cut_index=, {self.axis.name}= and weight=, got {list(values)}")
+        x = np.atleast_1d(np.asarray(values[self.axis.name], dtype=np.float64))
+        w = np.ones(len(x)) if weight is None else np.broadcast_to(np.asarray(weight, dtype=np.float64), x.shape)
+        if score is not None:
+            row  = passed_cuts(self.cuts, score) - 1
+            keep = row >= 0
+            x, w, row = x[keep], w[keep], row[keep].astype(np.int64)
+        else:
+            row = np.full(len(x), int(cut_index), dtype=np.int64)
+        bins = np.asarray(self.axis.index(x), dtype=np.int64) + self._flow
+        flat, sumw, sumw2 = row * self._ext + bins, w, w * w
+        if cut_index is not None and cut_index > 0:
+            flat  = np.concatenate([flat, flat - self._ext])
+            sumw  = np.concatenate([sumw, -sumw])
+            sumw2 = np.concatenate([sumw2, -sumw2])
+        self._add(flat, sumw, sumw2)
+        return self
+
+    def copy(self):
+        out = CutShapes(self.cuts, self.axis, self.name)
+        out._idx = None if self._idx is None else self._idx.copy()
+        out._sumw, out._sumw2 = self._sumw.copy(), self._sumw2.copy()
+        return out
+
+    def __add__(self, other):
+        if not (np.array_equal(self.cuts, other.cuts) and self.axis == other.axis):
+            raise ValueError(f"[CUT-SHAPES] cannot add shapes of different cuts or axes ({self.axis.name}, {other.axis.name})")
+        out = self.copy()
+        out._add(*other._cells())
+        return out
+
+    @property
+    def nbytes(self):
+        return (0 if self._idx is None else self._idx.nbytes) + self._sumw.nbytes + self._sumw2.nbytes
+
+    def to_hist(self):
+        '''The dense IntCategory(cut_index) x axis Weight histogram the per-cut fills would have given.'''
+        n = len(self.cuts)
+        h = hist.Hist(hist.axis.IntCategory(range(n), name=self.name), self.axis, storage=hist.storage.Weight())
+        sumw, sumw2 = self._dense()
+        view = h.view(flow=True)
+        view.value[:n]    = sumw.reshape(n, self._ext)[::-1].cumsum(axis=0)[::-1]
+        view.variance[:n] = sumw2.reshape(n, self._ext)[::-1].cumsum(axis=0)[::-1]
+        return h
+
+    def values(self, flow=False):
+        return self.to_hist().values(flow=flow)
@@ -0,0 +1,141 @@
+import numpy as np
+
+from utils.views import View
+
+# Declarative cutflow for the STEP blocks of the processors.
+# Each step is declared once with its parent, its predicate, the regimes it belongs to and the
+# eventflow label it fills. A predicate only sees the events that survived the parent step and
+# the survivors are kept as a sorted index array, so nothing is recomputed on the full chunk.
+# All eventflow yields (regime x channel x cut) live in one weighted array that is written
+# to the `eventflow_*` / `{ch}_eventflow_*` histograms once, in fill().
+
+
+class Cutflow:
+    '''
+    flow = Cutflow(w_evt, cuts=["raw", "step1", ...], regimes=["boosted", "resolved"], channels=["e", "mu"])
+    flow.register(leptons=leptons, double_jets=double_jets)
+    flow.step("raw", cut="raw", split=False)
+    flow.step("step1", lambda idx: n_lep[idx] == 1, cut="step1")               # parent: last shared step
+    flow.set_channels(e=mask_e, mu=mask_mu)
+    flow.step("step2a", lambda idx: n_dj[idx] >= 2, after="step1", regimes=["boosted"], cut="step2")
+    idx  = flow["step2a"]                       # surviving event indices
+    jets = flow.take("step2a", "double_jets")   # utils.views.View: fields gathered only when read
+    flow.fill(output)
+
+    - predicate(idx) gets the parent's survivors and returns a bool mask aligned with them.
+    - cut=None: the step selects but does not appear in the eventflow.
+    - weight: full-length per-event weight for this branch (e.g. resolved = base * b-tag).
+    - split=False: the yield goes to every channel row (used for "raw", before channels exist).
+    '''
+
+    def __init__(self, weight, cuts, regimes, channels, verbose=True):
+        self.weight   = np.asarray(weight, dtype=np.float64)
+        self.n        = len(self.weight)
+        self.cuts     = list(cuts)
+        self.regimes  = list(regimes)
+        self.channels = list(channels)
+        self.verbose  = verbose
+
+        # yields[regime, row, cut]; row 0 = all channels, row 1+c = channel c
+        self.yields  = np.zeros((len(self.regimes), len(self.channels) + 1, len(self.cuts)))
+        self.channel = np.full(self.n, -1, dtype=np.int64)
+
+        self._idx         = {"all": np.arange(self.n)}
+        self._w           = {"all": self.weight}
+        self._last        = "all"
+        self._records     = []
+        self._collections = {}
+        self._slices      = {}
+
+    def __getitem__(self, name):
+        return self._idx[name]
+
+    def __contains__(self, name):
+        return name in self._idx
+
+    def register(self, **collections):
+        '''Full-length collections that steps may hand out with take().'''
+        self._collections.update(collections)
+
+    def collection(self, name):
+        '''A registered full-length collection (e.g. for Views on other indices, utils/observables.py).'''
+        return self._collections[name]
+
+    def set_channels(self, **masks):
+        '''Assign the per-event channel from full-length boolean masks (first match wins).'''
+        for c, ch in reversed(list(enumerate(self.channels))):
+            m = masks.get(ch)
+            if m is not None:
+                self.channel[np.asarray(m, dtype=bool)] = c
+
+    def step(self, name, predicate=None, after=None, regimes=None, cut=None, weight=None, split=True):
+        parent = self._idx[after or self._last]
+        if predicate is None:
+            idx = parent
+        else:
+            keep = np.asarray(predicate(parent), dtype=bool)
+            if keep.shape != parent.shape:
+                raise ValueError(f"[CUTFLOW] step '{name}': predicate returned shape {keep.shape}, expected {parent.shape}")
+            idx = parent[keep]
+
+        w = (self.weight if weight is None else np.asarray(weight, dtype=np.float64))[idx]
+        self._idx[name] = idx
+        self._w[name]   = w
+        if regimes is None:
+            self._last = name
+
+        if cut is not None:
+            regs = range(len(self.regimes)) if regimes is None else [self.regimes.index(r) for r in regimes]
+            self._records.append((self.cuts.index(cut), list(regs), name, split))
+
+        if self.verbose:
+            print(f"[CUTFLOW] {name}: {idx.size} / {parent.size} events")
+        return idx
+
+    def weights(self, name):
+        '''Per-event weights of the survivors of `name`, as given to step().'''
+        return self._w[name]
+
+    def channel_mask(self, name, ch):
+        '''Boolean mask over the survivors of `name` selecting channel `ch`.'''
+        return self.channel[self._idx[name]] == self.channels.index(ch)
+
+    def mask(self, name):
+        '''Full-length boolean mask of `name` (for debug printouts only).'''
+        m = np.zeros(self.n, dtype=bool)
+        m[self._idx[name]] = True
+        return m
+
+    def take(self, name, *collections):
+        '''Views of registered collections on the survivors of `name` (one View per step and collection).'''
+        out = []
+        for c in collections:
+            key = (name, c)
+            if key not in self._slices:
+                self._slices[key] = View(self._collections[c], self._idx[name])
+            out.append(self._slices[key])
+        return out[0] if len(out) == 1 else tuple(out)
+
+    def _accumulate(self):
+        n_rows = len(self.channels) + 1
+        for cut, regs, name, split in self._records:
+            w = self._w[name]
+            if split:
+                # channel c -> row c+1; unassigned events land in row 0, which is then set to the total
+                per_row = np.bincount(self.channel[self._idx[name]] + 1, weights=w, minlength=n_rows)
+                per_row[0] = w.sum()
+            else:
+                per_row = np.full(n_rows, w.sum())
+            for r in regs:
+                self.yields[r, :, cut] += per_row
+        self._records = []
+
+    def fill(self, output):
+        '''Write the accumulated yields into eventflow_{regime} and {ch}_eventflow_{regime}.'''
+        self._accumulate()
+        for r, regime in enumerate(self.regimes):
+            for row, ch in enumerate([None] + self.channels):
+                key = f"eventflow_{regime}" if ch is None else f"{ch}_eventflow_{regime}"
+                if key in output:
+                    output[key].fill(cut=self.cuts, weight=self.yields[r, row])
+        self.yields[:] = 0.0
@@ -0,0 +1,192 @@
+import numpy as np
+import awkward as ak
+
+from utils.prefetch import accumulate, chunk_ranges, CHUNK_SIZE
+from utils.skim_io import is_parquet, parquet_columns, rebuild_root, root_branches, unmask
+
+# Execution of the processors over a dataset with dask.distributed, in two forms.
+# run_partitions: every partition - (file, entry range), the chunks of utils/prefetch.py - is one
+# task that reads only the analysis columns of its range (utils/skim_io.py), runs the processor
+# and returns the output; outputs are tree-reduced on the workers as tasks finish.
+# run_graph: the skims are a dask-awkward collection (skim_collection, one partition per task),
+# the processor is one delayed call per partition and the outputs are tree-reduced in the same
+# graph; the graph optimisation reads only the branches the collection is projected onto.
+# The processors stay eager awkward/numpy code in both (Cutflow index arrays, b-tag weight loops,
+# BDT evaluation): they fill plain hist.Hist per partition, not dask-histogram. The smearing draws
+# are keyed by event (utils/rng.py), so for a fixed b-tag efficiency map (btag_eff_map) the result
+# does not depend on the partitioning.
+#
+#   client = local_client(8)                                   # LocalCluster, one process per core
+#   tasks  = partitions({url: n_entries, ...}, chunk_size=200000)
+#   output = run_partitions(client, process_partition, tasks)  # process_partition(task) -> output dict
+#   events, tasks = skim_collection({url: n_entries, ...}, is_mc, dataset_name)
+#   output = run_graph(client, events, process_events, tasks)  # process_events(events, task) -> output dict
+
+#----------------------------------------------------------------------------------------------------------------------------------------------
+
+def local_client(workers, memory_limit="auto", dashboard=False):
+    '''dask.distributed Client of a LocalCluster with `workers` single-threaded worker processes.'''
+    try:
+        from distributed import Client, LocalCluster
+    except ImportError as e:
+        raise ImportError("[DASK] dask.distributed is required for --workers > 0") from e
+    cluster = LocalCluster(n_workers=workers, threads_per_worker=1, processes=True, memory_limit=memory_limit,
+                           dashboard_address=":8787" if dashboard else None)
+    client = Client(cluster)
+    print(f"[DASK] Local cluster with {workers} workers" + (f", dashboard {client.dashboard_link}" if dashboard else ""))
+    return client
+
+
+def partitions(entries, chunk_size=CHUNK_SIZE):
+    '''[(url, start, stop)] of {url: n_entries}, in chunks of `chunk_size` entries.'''
+    return [(url, a, b) for url, n in entries.items() for a, b in chunk_ranges(n, chunk_size)]
+
+
+# Objects kept in a worker process between its tasks (see worker_cached)
+_CACHE = {}
+
+def worker_cached(key, factory):
+    '''factory() built once per worker process (and key), e.g. a processor with its corrections loaded.'''
+    if key not in _CACHE:
+        _CACHE[key] = factory()
+    return _CACHE[key]
+
+
+def merge(a, b):
+    '''Merge two partition results ({key: output dict}, e.g. one key per TTbar flavour).'''
+    for key, out in b.items():
+        a[key] = accumulate(a.get(key), out)
+    return a
+
+
+def merge_all(*results):
+    '''merge of any number of partition results (one node of the run_graph reduction).'''
+    total = {}
+    for r in results:
+        total = merge(total, r)
+    return total
+
+#----------------------------------------------------------------------------------------------------------------------------------------------
+
+def run_partitions(client, fn, tasks):
+    '''
+    Run fn(task) -> {key: output dict} for every task and merge the results (see `merge`).
+    With client=None the tasks run one after the other in this process (eager reference).
+    '''
+    if client is None:
+        total = {}
+        for k, task in enumerate(tasks):
+            total = merge(total, fn(task))
+            print(f"[DASK] {k + 1}/{len(tasks)} partitions done (in process)")
+        return total
+
+    from distributed import as_completed
+
+    futures = client.map(fn, tasks, pure=False)
+    # only keys are kept here, so that a partition result is released once merged
+    keys, seq = {f.key for f in futures}, as_completed(futures)
+    del futures
+    done, carry = 0, None
+    for fut in seq:
+        if fut.status == "error":
+            fut.result()        # re-raises the worker exception
+        if fut.key in keys:     # a partition, not a merge
+            done += 1
+            if done % max(1, len(tasks) // 10) == 0 or done == len(tasks):
+                print(f"[DASK] {done}/{len(tasks)} partitions done")
+        if carry is None:
+            carry = fut
+        else:
+            seq.add(client.submit(merge, carry, fut, pure=False))
+            carry = None
+    return carry.result() if carry is not None else {}
+
+#----------------------------------------------------------------------------------------------------------------------------------------------
+
+def _rebuild(events, is_mc, dataset_name):
+    events = rebuild_root(events, is_mc, dataset_name)
+    # the processors read every projected column: mark them all as used for the column optimisation
+    ak.typetracer.touch_data(events)
+    return events
+
+
+def skim_collection(entries, is_mc, dataset_name, chunk_size=CHUNK_SIZE):
+    '''
+    (dask-awkward Array of the skims {url: n_entries}, [(url, start, stop)] of its partitions).
+    ROOT: one partition per partitions() task, projected onto root_branches and zipped into the
+    analysis collections inside the graph. Parquet: one partition per row group, read with the
+    parquet_columns projection. All files must have the same format.
+    '''
+    import dask_awkward as dak
+
+    urls = [url for url, n in entries.items() if n]
+    if not urls:
+        raise ValueError("[DASK] No entries to process")
+    if len({is_parquet(url) for url in urls}) > 1:
+        raise ValueError("[DASK] ROOT and Parquet skims cannot be mixed in one graph")
+
+    if is_parquet(urls[0]):
+        tasks = []
+        for url in urls:
+            edges = np.concatenate([[0], np.cumsum(ak.metadata_from_parquet(url)["col_counts"])])
+            tasks += [(url, int(a), int(b)) for a, b in zip(edges[:-1], edges[1:])]
+        events = dak.from_parquet(urls, columns=parquet_columns(urls[0], is_mc, dataset_name), split_row_groups=True)
+        return events.map_partitions(unmask), tasks
+
+    import uproot
+
+    tasks = partitions({url: entries[url] for url in urls}, chunk_size)
+    files = {url: {"object_path": "Events", "steps": [[a, b] for u, a, b in tasks if u == url]} for url in urls}
+    events = uproot.dask(files, open_files=False)
+    events = events[root_branches(events.fields, is_mc, dataset_name)]
+    return events.map_partitions(_rebuild, is_mc, dataset_name), tasks
+
+
+def run_graph(client, events, fn, tasks, optimize=True, split_every=8):
+    '''
+    fn(partition events, task) -> {key: output dict} over the partitions of a skim_collection, as
+    one delayed call per partition and a tree reduction (merge_all of `split_every` results per
+    node) in the same graph. optimize=True lets dask-awkward drop the columns the graph does not
+    use before reading. With client=None the graph runs in this process (synchronous scheduler).
+    '''
+    import dask
+
+    parts = events.to_delayed(optimize_graph=optimize)
+    if len(parts) != len(tasks):
+        raise ValueError(f"[DASK] {len(parts)} partitions for {len(tasks)} tasks")
+    level = [dask.delayed(fn, pure=False)(part, task) for part, task in zip(parts, tasks)]
+    while len(level) > 1:
+        level = [dask.delayed(merge_all, pure=False)(*level[i:i + split_every]) for i in range(0, len(level), split_every)]
+    if not level:
+        return {}
+    print(f"[DASK] Graph of {len(parts)} partitions" + (" (in process)" if client is None else ""))
+    if client is None:
+        return level[0].compute(scheduler="synchronous")
+    return client.compute(level[0]).result()
+
+#----------------------------------------------------------------------------------------------------------------------------------------------
+
+def compare(a, b, rtol=1e-6, atol=1e-9):
+    '''
+    Differences between two outputs' histograms: [(name, max |a - b|)] of the ones that differ
+    beyond rtol/atol or are filled in only one of them (max difference inf).
+    '''
+    import hist
+
+    bad = []
+    for name in sorted(set(a) | set(b)):
+        ha, hb = (h.to_hist() if hasattr(h, "to_hist") else h for h in (a.get(name), b.get(name)))
+        if not isinstance(ha, hist.Hist) and not isinstance(hb, hist.Hist):
+            continue
+        if ha is None or hb is None:
+            # histograms are built on first use (utils/hist_book.py): missing equals empty
+            h = ha if hb is None else hb
+            if np.any(h.values(flow=True)):
+                bad.append((name, np.inf))
+            continue
+        va, vb = ha.values(flow=True), hb.values(flow=True)
+        if va.shape != vb.shape:
+            bad.append((name, np.inf))
+        elif not np.allclose(va, vb, rtol=rtol, atol=atol):
+            bad.append((name, float(np.max(np.abs(va - vb)))))
+    return bad
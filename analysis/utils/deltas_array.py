@@ -26,9 +26,61 @@ def delta_r(obj1, obj2):
     dphi = np.where(dphi > np.pi, 2 * np.pi - dphi, dphi)
     return np.sqrt(deta**2 + dphi**2)
 
+def _flat(x):
+    return np.asarray(ak.to_numpy(ak.flatten(x, axis=None)))
+
+def min_dr_flat(objects, others):
+    '''
+    Per object: minimum ΔR to any of `others` in the same event (+inf if the event has none).
+    Works on the flat eta/phi buffers and the per-event offsets: for k = 0..max(n_others)-1
+    every object is compared to the k-th "other" of its event, so no [evt, nobj, noth] pair
+    array is built. Returns (flat float64 min-ΔR, object counts per event).
+    '''
+    n_obj = np.asarray(ak.to_numpy(ak.num(objects, axis=1)), dtype=np.int64)
+    n_oth = np.asarray(ak.to_numpy(ak.num(others,  axis=1)), dtype=np.int64)
+    best  = np.full(int(n_obj.sum()), np.inf)
+    if best.size == 0 or n_oth.sum() == 0:
+        return best, n_obj
+
+    o_eta, o_phi = _flat(objects.eta).astype(np.float64), _flat(objects.phi).astype(np.float64)
+    r_eta, r_phi = _flat(others.eta).astype(np.float64),  _flat(others.phi).astype(np.float64)
+
+    # per object: offset of its event's first "other" and how many there are
+    evt   = np.repeat(np.arange(n_obj.size), n_obj)
+    start = (np.cumsum(n_oth) - n_oth)[evt]
+    n_r   = n_oth[evt]
+
+    # objects sorted by decreasing n_r, so pass k only touches the leading prefix
+    order = np.argsort(-n_r, kind="stable")
+    o_eta, o_phi, start, n_r = o_eta[order], o_phi[order], start[order], n_r[order]
+    best2 = np.full(order.size, np.inf)
+    n_active = np.searchsorted(-n_r, -np.arange(1, n_r[0] + 1), side="right")
+    # phi in [-pi, pi], so |dphi| <= 2pi and min(|dphi|, 2pi - |dphi|) is the wrapped value
+    dphi, deta = np.empty(order.size), np.empty(order.size)
+    for k, m in enumerate(n_active):
+        j  = start[:m] + k
+        dp, de = dphi[:m], deta[:m]
+        np.subtract(o_phi[:m], r_phi[j], out=dp)
+        np.abs(dp, out=dp)
+        np.minimum(dp, 2 * np.pi - dp, out=dp)
+        np.subtract(o_eta[:m], r_eta[j], out=de)
+        dp *= dp
+        de *= de
+        dp += de
+        np.minimum(best2[:m], dp, out=best2[:m])
+
+    best[order] = np.sqrt(best2)
+    return best, n_obj
+
+def overlap_mask(objects, others, drmin):
+    '''
+    (mask, min_dr) with the jagged layout of `objects`:
+    mask is True for objects with ΔR > drmin to ALL `others` (vacuously True if there are none).
+    '''
+    dr_min, counts = min_dr_flat(objects, others)
+    return ak.unflatten(dr_min > drmin, counts), ak.unflatten(dr_min, counts)
+
 def clean_by_dr(objects, others, drmin):
-    pairs = ak.cartesian([objects, others], nested=True)
-    dr = delta_r(pairs['0'], pairs['1'])
-    mask = ak.all(dr > drmin, axis=-1)
+    mask, _ = overlap_mask(objects, others, drmin)
     return objects[mask]
 
@@ -0,0 +1,128 @@
+import json
+import numpy as np
+import awkward as ak
+
+# Cheap replacement for the eager `_stats(...)` dumps in the processors.
+# Off by default; when on, each call takes a strided sample of the events (outermost axis),
+# flattens only that sample and folds it into streaming moments (n, mean, M2, min, max) that merge
+# across chunks, instead of computing medians and printing a line per chunk.
+
+
+def _sample_events(x, step):
+    '''Every step-th event of x (ak.Array or array-like), before any flattening.'''
+    if isinstance(x, ak.Array):
+        return x[::step]
+    x = np.asarray(x)
+    return x[::step] if x.ndim else x
+
+
+def _count(x, flatten=True):
+    '''Entries of x that flattening would give (the n_seen of a call), without copying them.'''
+    if isinstance(x, ak.Array):
+        try:
+            return int(ak.count(x, axis=None)) if flatten else len(x)
+        except Exception:
+            return len(x)
+    return int(np.size(x))
+
+
+def _to_flat_numpy(x, flatten=True):
+    if flatten:
+        try:
+            x = ak.flatten(x, axis=None)
+        except Exception:
+            pass
+    try:
+        xv = ak.to_numpy(x)
+    except Exception:
+        xv = np.asarray(x)
+    return np.asarray(xv, dtype=float).ravel()
+
+
+class StatsSummary(dict):
+    '''
+    {title: {"n_seen", "n", "n_nonfinite", "mean", "m2", "min", "max"}}
+    n_seen counts all entries offered, n the finite sampled ones the moments are built from.
+    Supports `+` (Chan et al. parallel update) so it merges like any coffea accumulator.
+    '''
+
+    def __add__(self, other):
+        out = StatsSummary({k: dict(v) for k, v in self.items()})
+        out += other
+        return out
+
+    def __iadd__(self, other):
+        for title, b in other.items():
+            a = self.get(title)
+            if a is None:
+                self[title] = dict(b)
+                continue
+            n = a["n"] + b["n"]
+            if b["n"] > 0:
+                delta = b["mean"] - a["mean"]
+                a["m2"] += b["m2"] + delta * delta * a["n"] * b["n"] / n
+                a["mean"] += delta * b["n"] / n
+                a["min"] = min(a["min"], b["min"])
+                a["max"] = max(a["max"], b["max"])
+            a["n"] = n
+            a["n_seen"] += b["n_seen"]
+            a["n_nonfinite"] += b["n_nonfinite"]
+        return self
+
+    def report(self):
+        for title, r in self.items():
+            if r["n"] == 0:
+                print(f"[{title}] n_seen={r['n_seen']}  no finite values sampled")
+                continue
+            std = np.sqrt(r["m2"] / r["n"])
+            print(f"[{title}] n_seen={r['n_seen']}  n={r['n']}  min={r['min']:.4g}  mean={r['mean']:.4g}  "
+                  f"std={std:.4g}  max={r['max']:.4g}  nonfinite={r['n_nonfinite']}")
+
+    def to_json(self, path):
+        with open(path, "w") as f:
+            json.dump(self, f, indent=2)
+
+
+class Diagnostics:
+    '''
+    Callable used as `_stats(x, "title")` inside process().
+    - enabled=False: returns immediately; pass a lambda for derived quantities so they are not even computed.
+    - fraction: share of events looked at (strided over the outermost axis, no RNG); only the
+      sampled events are flattened and converted.
+    - verbose: also print the per-chunk line, as the old _stats did.
+    '''
+
+    def __init__(self, enabled=False, fraction=0.01, verbose=False):
+        self.enabled = enabled
+        self.fraction = min(max(float(fraction), 0.0), 1.0)
+        self.verbose = verbose
+        self.summary = StatsSummary()
+
+    def begin(self):
+        self.summary = StatsSummary()
+
+    def __call__(self, x, title="", *, flatten=True):
+        if not self.enabled or self.fraction <= 0.0:
+            return
+        if callable(x):
+            x = x()
+        n_seen = _count(x, flatten)
+        step = max(int(round(1.0 / self.fraction)), 1)
+        xv = _to_flat_numpy(_sample_events(x, step) if step > 1 else x, flatten)
+
+        finite = np.isfinite(xv)
+        xs = xv[finite]
+        rec = {"n_seen": n_seen, "n": int(xs.size), "n_nonfinite": int(xv.size - xs.size),
+               "mean": 0.0, "m2": 0.0, "min": np.inf, "max": -np.inf}
+        if xs.size:
+            rec["mean"] = float(xs.mean())
+            rec["m2"] = float(((xs - rec["mean"]) ** 2).sum())
+            rec["min"] = float(xs.min())
+            rec["max"] = float(xs.max())
+        self.summary += StatsSummary({title or "unnamed": rec})
+
+        if self.verbose:
+            StatsSummary({title or "unnamed": rec}).report()
+
+    def result(self):
+        return self.summary
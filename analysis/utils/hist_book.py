@@ -0,0 +1,70 @@
+# Histograms allocated on first use.
+# A booking registers how to build each histogram - the unbuilt `Hist.new...Weight` / `.Double`
+# (the axes, without storage) or a small prototype that is copied - and LazyOutput builds one the
+# first time a process call touches it, so the output (and the file, hadd, merges) holds only the
+# histograms that were filled. OutputDir gives a second copy of the booked set under a prefix.
+#
+#   self._histograms["pt_H"] = Hist.new.Reg(100, 0, 1000, name="pt").Weight    # note: not called
+#   output = LazyOutput(self._histograms)
+#   output["pt_H"].fill(pt=...)      # allocated here
+#   "pt_E" in output                 # True for every booked name; not allocated by the test
+#   qcd = OutputDir(output, "antiiso")
+#   qcd["pt_H"].fill(pt=...)         # stored as output["antiiso/pt_H"], built from the same booking
+
+#----------------------------------------------------------------------------------------------------------------------------------------------
+
+def build(booked):
+    '''A fresh histogram of a booking: call a factory, copy a prototype.'''
+    if callable(booked):
+        return booked()
+    return booked.copy() if hasattr(booked, "copy") else booked
+
+
+class LazyOutput(dict):
+    '''
+    Processor output over a booking {name: factory or prototype}; holds only the built entries.
+    Other keys (profile, diagnostics, trees) are set as in a plain dict. Pickles as a plain dict.
+    '''
+
+    def __init__(self, booking):
+        super().__init__()
+        self._booking = booking
+
+    def _booked(self, key):
+        # "dir/name" (OutputDir) is built from the booking of name
+        return key if key in self._booking else key.split("/", 1)[-1]
+
+    def __missing__(self, key):
+        if self._booked(key) not in self._booking:
+            raise KeyError(key)
+        self[key] = h = build(self._booking[self._booked(key)])
+        return h
+
+    def __contains__(self, key):
+        return dict.__contains__(self, key) or self._booked(key) in self._booking
+
+    def get(self, key, default=None):
+        return self[key] if key in self else default
+
+    def __reduce__(self):
+        return (dict, (dict(self),))
+
+
+class OutputDir:
+    '''The keys of `output` under "<name>/": a second set of the booked histograms in the same output.'''
+
+    def __init__(self, output, name):
+        self._output = output
+        self._prefix = f"{name}/"
+
+    def __getitem__(self, key):
+        return self._output[self._prefix + key]
+
+    def __setitem__(self, key, value):
+        self._output[self._prefix + key] = value
+
+    def __contains__(self, key):
+        return (self._prefix + key) in self._output
+
+    def get(self, key, default=None):
+        return self[key] if key in self else default
@@ -0,0 +1,182 @@
+import os
+import hist
+import inspect
+import numpy as np
+import uproot
+from uproot.writing import identify as upid
+
+from utils.provenance import write_record
+
+# Output writing shared by the drivers (run_analysis.py, run_dask.py): histograms as ROOT TH1/TH2
+# with Sumw2, in gen/ boosted/ resolved/ directories by name, plus the profile, the diagnostics
+# and the provenance record.
+
+# ------------------ Uproot THx writers with Sumw2 ------------------
+
+def _is_num_axis(ax):
+    return isinstance(ax, (hist.axis.Regular, hist.axis.Variable))
+
+#----------------------------------------------------------------------------------------------------------------------------------------------
+
+def _call_to_TH1x(name, title, data, fEntries, fTsumw, fTsumw2, fTsumwx, fTsumwx2, sumw2, xaxis, yaxis, zaxis):
+    """
+    Call identify.to_TH1x with the correct signature for the installed uproot version.
+    """
+    sig = inspect.signature(upid.to_TH1x)
+    params = list(sig.parameters.keys())
+    if len(params) > 0 and params[0] == "classname":
+        return upid.to_TH1x(
+            "TH1D", name, title, data, fEntries, fTsumw, fTsumw2, fTsumwx, fTsumwx2,
+            sumw2, xaxis, yaxis, zaxis
+        )
+    elif "classname" in sig.parameters:
+        return upid.to_TH1x(
+            name, title, data, fEntries, fTsumw, fTsumw2, fTsumwx, fTsumwx2,
+            sumw2, xaxis, yaxis, zaxis, classname="TH1D"
+        )
+    else:
+        return upid.to_TH1x(
+            name, title, data, fEntries, fTsumw, fTsumw2, fTsumwx, fTsumwx2,
+            sumw2, xaxis, yaxis, zaxis
+        )
+
+#----------------------------------------------------------------------------------------------------------------------------------------------
+
+def _call_to_TH2x(name, title, data, fEntries, fTsumw, fTsumw2, fTsumwx, fTsumwx2, fTsumwy, fTsumwy2, sumw2, xaxis, yaxis, zaxis):
+    sig = inspect.signature(upid.to_TH2x)
+    params = list(sig.parameters.keys())
+    if len(params) > 0 and params[0] == "classname":
+        return upid.to_TH2x(
+            "TH2D", name, title, data, fEntries, fTsumw, fTsumw2, fTsumwx, fTsumwx2,
+            fTsumwy, fTsumwy2, sumw2, xaxis, yaxis, zaxis
+        )
+    elif "classname" in sig.parameters:
+        return upid.to_TH2x(
+            name, title, data, fEntries, fTsumw, fTsumw2, fTsumwx, fTsumwx2,
+            fTsumwy, fTsumwy2, sumw2, xaxis, yaxis, zaxis, classname="TH2D"
+        )
+    else:
+        return upid.to_TH2x(
+            name, title, data, fEntries, fTsumw, fTsumw2, fTsumwx, fTsumwx2,
+            fTsumwy, fTsumwy2, sumw2, xaxis, yaxis, zaxis
+        )
+
+#----------------------------------------------------------------------------------------------------------------------------------------------
+
+def write_hist_uproot_sumw2(rootfile, fullpath, h):
+    """
+    Write 1D/2D numeric-axes boost-hist 'hist.Hist' to ROOT TH1/TH2 with Sumw2.
+    Falls back to plain numpy if uproot signature mismatches or axes are categorical.
+    """
+    try:
+        # Skip truly empty
+        if float(np.sum(h.values())) == 0.0:
+            return
+
+        # 1D numeric
+        if h.ndim == 1 and _is_num_axis(h.axes[0]):
+            counts, xedges = h.to_numpy()
+            vari = h.variances()
+            nb = len(xedges) - 1
+
+            data = np.zeros(nb + 2, dtype=np.float64); data[1:-1] = counts
+            sumw2 = np.zeros(nb + 2, dtype=np.float64); sumw2[1:-1] = (vari if vari is not None else counts)
+
+            xcent   = 0.5 * (xedges[:-1] + xedges[1:])
+            fEntries = float((counts**2).sum() / max(sumw2[1:-1].sum(), 1e-12))
+            fTsumw   = float(counts.sum())
+            fTsumw2  = float(sumw2[1:-1].sum())
+            fTsumwx  = float((counts * xcent).sum())
+            fTsumwx2 = float((counts * xcent * xcent).sum())
+
+            xaxis = upid.to_TAxis("xaxis", "xaxis", nb, float(xedges[0]), float(xedges[-1]), xedges.astype(np.float64))
+            yaxis = upid.to_TAxis("yaxis", "yaxis", 0, 0.0, 0.0, None)
+            zaxis = upid.to_TAxis("zaxis", "zaxis", 0, 0.0, 0.0, None)
+
+            th1 = _call_to_TH1x(fullpath, fullpath, data, fEntries, fTsumw, fTsumw2, fTsumwx, fTsumwx2, sumw2, xaxis, yaxis, zaxis)
+            rootfile[fullpath] = th1
+            return
+
+        if h.ndim == 2 and _is_num_axis(h.axes[0]) and _is_num_axis(h.axes[1]):
+            counts, xedges, yedges = h.to_numpy()
+            vari = h.variances()
+            nx, ny = counts.shape
+
+            data = np.zeros((nx + 2, ny + 2), dtype=np.float64); data[1:-1, 1:-1] = counts
+            sumw2 = np.zeros((nx + 2, ny + 2), dtype=np.float64); sumw2[1:-1, 1:-1] = (vari if vari is not None else counts)
+
+            xcent = 0.5 * (xedges[:-1] + xedges[1:])
+            ycent = 0.5 * (yedges[:-1] + yedges[1:])
+            fEntries = float((counts**2).sum() / max(sumw2[1:-1,1:-1].sum(), 1e-12))
+            fTsumw   = float(counts.sum())
+            fTsumw2  = float(sumw2[1:-1,1:-1].sum())
+            fTsumwx  = float((counts * xcent[:, None]).sum())
+            fTsumwx2 = float((counts * (xcent[:, None] ** 2)).sum())
+            fTsumwy  = float((counts * ycent[None, :]).sum())
+            fTsumwy2 = float((counts * (ycent[None, :] ** 2)).sum())
+
+            xaxis = upid.to_TAxis("xaxis", "xaxis", nx, float(xedges[0]), float(xedges[-1]), xedges.astype(np.float64))
+            yaxis = upid.to_TAxis("yaxis", "yaxis", ny, float(yedges[0]), float(yedges[-1]), yedges.astype(np.float64))
+            zaxis = upid.to_TAxis("zaxis", "zaxis", 0, 0.0, 0.0, None)
+
+            th2 = _call_to_TH2x(fullpath, fullpath, data, fEntries, fTsumw, fTsumw2, fTsumwx, fTsumwx2, fTsumwy, fTsumwy2, sumw2, xaxis, yaxis, zaxis)
+            rootfile[fullpath] = th2
+            return
+
+        # Fallback: categorical axes or anything unexpected → write plain numpy 
+        rootfile[fullpath] = h.to_numpy()
+
+    except Exception as e:
+        print(f"[WARN] TH writer failed for {fullpath}: {e} — writing plain numpy without sumw2")
+        rootfile[fullpath] = h.to_numpy()
+
+#----------------------------------------------------------------------------------------------------------------------------------------------
+
+def write_profile(rootfile, out_name, profile):
+    """
+    Store the per-stage profile as a one-entry 'profile' tree and as a JSON sidecar next to the output.
+    """
+    if not profile:
+        return
+    profile.report()
+    rootfile["profile"] = profile.to_tree()
+    profile.to_json(f"{os.path.splitext(out_name)[0]}.profile.json")
+
+#----------------------------------------------------------------------------------------------------------------------------------------------
+
+def hist_path(name):
+    '''Directory of a histogram in the output file, from its name ("antiiso/<name>": under antiiso/).'''
+    if "/" in name:
+        top, name = name.split("/", 1)
+        return f"{top}/{hist_path(name)}"
+    if "gen:" in name:
+        return f"gen/{name}"
+    if "_boosted" in name:
+        return f"boosted/{name}"
+    if "_resolved" in name:
+        return f"resolved/{name}"
+    return name
+
+
+def write_output(out_name, output, provenance=None, profile=False, diagnostics=False):
+    '''
+    Write the non-empty histograms of a processor output to `out_name`, with the profile
+    (`profile`), the provenance record and the diagnostics sidecar (`diagnostics`).
+    '''
+    with uproot.recreate(out_name) as rootfile:
+        for name, h in output.items():
+            if hasattr(h, "to_hist"):   # utils/cut_shapes.py CutShapes: dense only here
+                h = h.to_hist()
+            if not isinstance(h, hist.Hist):
+                continue
+            if np.sum(h.values()) == 0:
+                continue
+            write_hist_uproot_sumw2(rootfile, hist_path(name), h)
+
+        if profile:
+            write_profile(rootfile, out_name, output["profile"])
+        if provenance is not None:
+            write_record(rootfile, provenance)
+    if diagnostics:
+        output["diagnostics"].report()
+        output["diagnostics"].to_json(f"{os.path.splitext(out_name)[0]}.diagnostics.json")
@@ -0,0 +1,104 @@
+import numpy as np
+
+# Binned lookup tables (TH1/TH2/TH3-style scale factors and efficiencies) built once from their edges.
+# Binning keeps the edges of each axis: a uniform axis is located arithmetically (one multiply, then
+# an exact ±1 fix against the edges), other axes with np.searchsorted, and the per-axis bins are
+# fused into one flat C-order index. Every table on the same binning (data and MC efficiencies,
+# nominal/up/down) is then read with one take from that index. Values outside the edges (and NaN)
+# go to the first / last bin.
+#
+#   sf  = LookupTable.from_hist(f["EGamma_SF2D"], variations=True)       # (nominal, up, down)
+#   nom, up, down = sf(eta, pt)                                           # one index, three takes
+#   eff = LookupTable.from_hist(f["EGamma_EffData2D"], f["EGamma_EffMC2D"])
+#   idx = eff.index(eta, pt)                                              # reuse for several tables
+#   eff_data, eff_mc = eff.at(idx)
+#   flat = Binning([ABSETA_EDGES, PT_EDGES]).index(abseta, pt)            # e.g. for np.bincount
+
+#----------------------------------------------------------------------------------------------------------------------------------------------
+
+class Binning:
+    '''
+    The edges of N axes and the fused bin index of N flat input arrays.
+    shape = (n_bins axis 0, n_bins axis 1, ...); index(*x) in [0, size), C order (last axis fastest).
+    '''
+
+    def __init__(self, edges):
+        self.edges = [np.asarray(e, dtype=np.float64) for e in edges]
+        for e in self.edges:
+            if e.ndim != 1 or e.size < 2 or np.any(np.diff(e) <= 0):
+                raise ValueError(f"[LOOKUP] axis edges must be increasing, got {e}")
+        self.shape = tuple(e.size - 1 for e in self.edges)
+        self.ndim  = len(self.shape)
+        self.size  = int(np.prod(self.shape))
+        # uniform axes: (low edge, 1 / bin width); None -> searchsorted
+        self._uniform = []
+        for e in self.edges:
+            w = np.diff(e)
+            self._uniform.append((e[0], 1.0 / w[0]) if np.allclose(w, w[0], rtol=1e-9, atol=0) else None)
+
+    def axis_index(self, axis, x):
+        '''Bin of each x on one axis, clamped to [0, n - 1] (NaN -> last bin, as np.digitize).'''
+        e, n = self.edges[axis], self.shape[axis]
+        x = np.asarray(x, dtype=np.float64)
+        if self._uniform[axis] is None:
+            return np.clip(np.searchsorted(e, x, side="right") - 1, 0, n - 1)
+        lo, inv = self._uniform[axis]
+        i = np.clip(np.nan_to_num((x - lo) * inv, nan=n - 1), 0, n - 1).astype(np.int64)
+        # the product can be one bin off next to an edge: compare with the edges themselves
+        i -= (x < e[i]) & (i > 0)
+        i += (x >= e[i + 1]) & (i < n - 1)
+        return i
+
+    def index(self, *xs):
+        '''Fused flat bin index of one value per axis (flat arrays of the same length).'''
+        if len(xs) != self.ndim:
+            raise ValueError(f"[LOOKUP] {self.ndim} axes, got {len(xs)} inputs")
+        flat = self.axis_index(0, xs[0])
+        for k in range(1, self.ndim):
+            flat = flat * self.shape[k] + self.axis_index(k, xs[k])
+        return flat
+
+
+class LookupTable:
+    '''
+    One or more tables of values on the same Binning, evaluated on flat arrays.
+    values: shape binning.shape (one table), or (n_tables,) + binning.shape (batched: every
+    evaluation returns (n_tables, n)). The shape is checked once, here.
+    '''
+
+    def __init__(self, edges, values):
+        self.binning = edges if isinstance(edges, Binning) else Binning(edges)
+        values = np.asarray(values, dtype=np.float64)
+        nd = self.binning.ndim
+        if values.shape[values.ndim - nd:] != self.binning.shape or values.ndim > nd + 1:
+            raise ValueError(f"[LOOKUP] table shape {values.shape} does not match the bins {self.binning.shape}")
+        self.batched = values.ndim == nd + 1
+        self._flat   = np.ascontiguousarray(values.reshape(-1, self.binning.size))
+
+    @classmethod
+    def from_hist(cls, *hists, variations=False):
+        '''
+        Table(s) of uproot / hist histograms with the same binning, axes in histogram order (x, y, ...).
+        Several histograms are batched in the given order; variations=True adds value ± error of each
+        (nominal, up, down per histogram).
+        '''
+        edges = [np.asarray(ax.edges() if callable(ax.edges) else ax.edges) for ax in hists[0].axes]
+        tables = []
+        for h in hists:
+            vals = np.asarray(h.values(), dtype=np.float64)
+            tables.append(vals)
+            if variations:
+                err = np.sqrt(np.asarray(h.variances(), dtype=np.float64))
+                tables += [vals + err, vals - err]
+        return cls(edges, tables[0] if len(tables) == 1 else np.stack(tables))
+
+    def index(self, *xs):
+        return self.binning.index(*xs)
+
+    def at(self, flat):
+        '''Values at fused indices from index() (n,), or (n_tables, n) for a batched table.'''
+        out = self._flat[:, flat]
+        return out if self.batched else out[0]
+
+    def __call__(self, *xs):
+        return self.at(self.index(*xs))
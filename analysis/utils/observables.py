@@ -0,0 +1,123 @@
+import numpy as np
+import awkward as ak
+
+from utils.views import View
+from utils.p4cache import P4
+
+# Per-event observables as a small dependency graph over the Cutflow steps.
+# Observables registers each quantity shared by the step3 and step4 slices (lead lepton and MET
+# vectors, W candidate, mTW, HT, min Δφ(jet, lepton), the 2+2 b-jet pairing) once, with the
+# quantities it depends on, and evaluates it lazily: the first request computes it on the events
+# of that step that do not have it yet, stores the result in a full-chunk buffer, and every later
+# request (the same or a nested step) only gathers its rows. Dependencies are resolved the same
+# way, on the events being computed.
+#
+#   obs = Observables(flow)                     # one per chunk, after flow.register(...)
+#   obs.define("lead_l", lambda s: p4.of(s.take("leptons")[:, 0]))
+#   obs.define("met",    lambda s: p4.of(s.take("PuppiMETCorr"), kind="met"))
+#   obs.define("mTW",    lambda s, l, met: trans_massW(l, met), deps=("lead_l", "met"))
+#   mTW_3a = obs("step3a", "mTW")               # computed on the step3a events
+#   mTW_4a, W_4a = obs("step4a", "mTW", "W")    # step4a is inside step3a: mTW is only gathered
+#
+# A node returns a 1-D array (numpy or awkward, kept as numpy), a utils.p4cache.P4, or a tuple of these.
+
+#----------------------------------------------------------------------------------------------------------------------------------------------
+
+def _layout(value):
+    if isinstance(value, P4):
+        return "p4"
+    if isinstance(value, tuple):
+        return tuple(_layout(v) for v in value)
+    return "array"
+
+
+def _flatten(value):
+    '''The flat per-event arrays of a node value.'''
+    if isinstance(value, P4):
+        return [value.px, value.py, value.pz, value.E]
+    if isinstance(value, tuple):
+        return [x for v in value for x in _flatten(v)]
+    if isinstance(value, ak.Array):
+        return [ak.to_numpy(ak.fill_none(value, np.nan))]
+    return [np.asarray(value)]
+
+
+def _unflatten(layout, arrays):
+    '''Node value of `layout` from the arrays of _flatten, consumed from the front of `arrays`.'''
+    if layout == "p4":
+        return P4(*(arrays.pop(0) for _ in range(4)))
+    if isinstance(layout, tuple):
+        return tuple(_unflatten(l, arrays) for l in layout)
+    return arrays.pop(0)
+
+
+class Subset:
+    '''The events a node is evaluated on: `idx` (chunk indices) and Views of the registered collections.'''
+
+    def __init__(self, flow, idx):
+        self.flow = flow
+        self.idx  = idx
+
+    def __len__(self):
+        return len(self.idx)
+
+    def take(self, *collections):
+        out = tuple(View(self.flow.collection(c), self.idx) for c in collections)
+        return out[0] if len(out) == 1 else out
+
+
+class _Node:
+    __slots__ = ("fn", "deps", "layout", "buffers", "have")
+
+    def __init__(self, fn, deps):
+        self.fn, self.deps = fn, tuple(deps)
+        self.layout, self.buffers, self.have = None, None, None
+
+
+class Observables:
+    '''
+    Lazily evaluated, memoized per-event observables on the steps of a Cutflow (see module comment).
+    fn(subset, *deps) gets a Subset and the values of `deps` on the same events, in order.
+    '''
+
+    def __init__(self, flow):
+        self.flow     = flow
+        self._nodes   = {}
+        self.computed = {}   # name -> number of events it was computed on (the rest was gathered)
+
+    def define(self, name, fn, deps=()):
+        missing = [d for d in deps if d not in self._nodes]
+        if missing:
+            raise KeyError(f"[OBSERVABLES] '{name}' depends on undefined {missing}")
+        self._nodes[name] = _Node(fn, deps)
+        self.computed[name] = 0
+
+    def __contains__(self, name):
+        return name in self._nodes
+
+    def __call__(self, step, *names):
+        '''Values of `names` on the survivors of `step` (one value, or a tuple for several names).'''
+        idx = self.flow[step]
+        out = tuple(self._eval(name, idx) for name in names)
+        return out[0] if len(out) == 1 else out
+
+    def _eval(self, name, idx):
+        node = self._nodes[name]
+        todo = idx if node.have is None else idx[~node.have[idx]]
+        if todo.size or node.layout is None:
+            args = [self._eval(d, todo) for d in node.deps]
+            self._store(node, todo, node.fn(Subset(self.flow, todo), *args))
+            self.computed[name] += todo.size
+        return _unflatten(node.layout, [b[idx] for b in node.buffers])
+
+    def _store(self, node, idx, value):
+        arrays = _flatten(value)
+        if node.layout is None:
+            node.layout  = _layout(value)
+            node.buffers = [np.empty(self.flow.n, dtype=a.dtype) for a in arrays]
+            node.have    = np.zeros(self.flow.n, dtype=bool)
+        for buf, a in zip(node.buffers, arrays):
+            if a.shape != idx.shape:
+                raise ValueError(f"[OBSERVABLES] a node returned shape {a.shape} for {idx.size} events")
+            buf[idx] = a
+        node.have[idx] = True
@@ -0,0 +1,138 @@
+import os
+import json
+import time
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import uproot
+except ImportError:
+    uproot = None
+
+# Shared output indexer for the resubmission scripts (production, skimming, analysis).
+# Every target directory is listed once, concurrently, and the listing is cached on disk
+# so that repeated resubmission passes do not hammer EOS with one `xrdfs ls` per dataset.
+# The cache is kept for back-to-back passes only (DEFAULT_MAX_AGE): an older listing misses the
+# outputs written since, and the scripts would resubmit jobs that have finished.
+
+DEFAULT_CACHE = ".output_index_cache.json"
+DEFAULT_WORKERS = 16
+DEFAULT_MAX_AGE = 60   # seconds
+
+
+def _list_one(path, server=None, timeout=120):
+    '''List basenames in a local or remote (xrootd) directory. Returns None if unreachable.'''
+    if server is None:
+        try:
+            return sorted(os.listdir(path))
+        except OSError:
+            return None
+    try:
+        result = subprocess.run(
+            ["xrdfs", server, "ls", path],
+            capture_output=True, text=True, check=True, timeout=timeout
+        )
+    except (subprocess.CalledProcessError, subprocess.TimeoutExpired):
+        return None
+    return sorted(os.path.basename(f) for f in result.stdout.split("\n") if f.strip())
+
+
+def _load_cache(cache_file):
+    if not cache_file or not os.path.exists(cache_file):
+        return {}
+    try:
+        with open(cache_file) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        print(f"[WARNING] Ignoring unreadable index cache {cache_file}")
+        return {}
+
+
+def _save_cache(cache_file, cache):
+    if not cache_file:
+        return
+    tmp = cache_file + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(cache, f)
+    os.replace(tmp, cache_file)
+
+
+def index_dirs(paths, server=None, max_workers=DEFAULT_WORKERS,
+               cache_file=DEFAULT_CACHE, max_age=DEFAULT_MAX_AGE, refresh=False):
+    '''
+    List all directories in `paths` concurrently.
+    Returns {path: set(basenames)}, or {path: None} for directories that could not be listed.
+    Listings younger than `max_age` seconds are taken from `cache_file`.
+    '''
+    paths = list(dict.fromkeys(paths))
+    cache = _load_cache(cache_file)
+    now = time.time()
+    key = lambda p: f"{server or 'local'}:{p}"
+
+    index = {}
+    todo = []
+    for p in paths:
+        entry = cache.get(key(p))
+        if not refresh and entry is not None and now - entry["time"] < max_age:
+            index[p] = set(entry["files"])
+        else:
+            todo.append(p)
+
+    if todo:
+        print(f"[INDEX] Listing {len(todo)} directories ({len(paths) - len(todo)} cached) with {max_workers} workers")
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            listings = pool.map(lambda p: _list_one(p, server), todo)
+            for p, files in zip(todo, listings):
+                if files is None:
+                    print(f"[WARNING] Could not list {p}")
+                    index[p] = None
+                    continue
+                index[p] = set(files)
+                cache[key(p)] = {"time": now, "files": files}
+        _save_cache(cache_file, cache)
+
+    return index
+
+
+def read_nevents(url, tree="Meta", branch="nEvents"):
+    '''
+    Read the event-count header of an output file.
+    With `branch` set, returns the sum of tree[branch] (skim Meta/nEvents);
+    with `branch=None`, returns tree.num_entries; with `tree=None`, only checks that the file opens.
+    Parquet skims are checked through their footer (nEvents in the key-value metadata).
+    Returns None for truncated/unreadable files.
+    '''
+    if str(url).endswith(".parquet"):
+        try:
+            from utils.skim_io import read_meta_parquet
+            meta = read_meta_parquet(url)
+            return int(meta["nEvents"] if branch == "nEvents" else meta["entries"])
+        except Exception as e:
+            print(f"[WARNING] Invalid output {url}: {e}")
+            return None
+    if uproot is None:
+        raise ImportError("uproot is required to validate outputs")
+    try:
+        with uproot.open(url) as f:
+            if tree is None:
+                return len(f.keys())
+            if branch is None:
+                return int(f[tree].num_entries)
+            return int(f[tree][branch].array(library="np").sum())
+    except Exception as e:
+        print(f"[WARNING] Invalid output {url}: {e}")
+        return None
+
+
+def validate_files(urls, tree="Meta", branch="nEvents", max_workers=DEFAULT_WORKERS):
+    '''Read headers of all `urls` concurrently. Returns {url: nevents or None}.'''
+    urls = list(urls)
+    if not urls:
+        return {}
+    print(f"[INDEX] Validating {len(urls)} files ({tree}/{branch})")
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        return dict(zip(urls, pool.map(lambda u: read_nevents(u, tree, branch), urls)))
+
+
+def to_url(path, name, server=None):
+    return f"{server}/{path}/{name}" if server else os.path.join(path, name)
@@ -0,0 +1,128 @@
+import numpy as np
+import awkward as ak
+
+from utils.views import View
+
+# Cartesian four-momentum components cached per collection.
+# make_vector / make_vector_met zip a new PtEtaPhiM record for every step and every vector
+# operation converts it to px/py/pz/E again. P4Cache computes px, py, pz, E once per chunk for
+# a (collection, element) pair - e.g. the leading lepton or the MET - on all events; each step
+# then only gathers its rows with the View's index. P4 is the plain-numpy object served to the
+# steps: sums, pt/eta/phi/mass, delta_phi and delta_r all work on the cached components.
+
+
+def _as_np(x):
+    return np.asarray(ak.to_numpy(x), dtype=np.float64)
+
+
+class P4:
+    '''
+    One four-vector per event as flat float64 px, py, pz, E.
+    Supports `a + b`, `a[mask]`, .pt/.eta/.phi/.mass (computed once, cached), .delta_phi, .delta_r
+    and the x/y/z/t/energy aliases of the coffea vector behaviour.
+    '''
+
+    __slots__ = ("px", "py", "pz", "E", "_derived")
+
+    def __init__(self, px, py, pz, E):
+        self.px, self.py, self.pz, self.E = px, py, pz, E
+        self._derived = {}
+
+    @classmethod
+    def from_ptetaphim(cls, pt, eta, phi, mass):
+        pt, eta, phi, mass = (_as_np(x) for x in (pt, eta, phi, mass))
+        px, py, pz = pt * np.cos(phi), pt * np.sin(phi), pt * np.sinh(eta)
+        return cls(px, py, pz, np.sqrt(px * px + py * py + pz * pz + mass * mass))
+
+    def __len__(self):
+        return len(self.px)
+
+    def __add__(self, other):
+        return P4(self.px + other.px, self.py + other.py, self.pz + other.pz, self.E + other.E)
+
+    def __getitem__(self, sel):
+        if isinstance(sel, ak.Array):
+            sel = ak.to_numpy(sel)
+        out = P4(self.px[sel], self.py[sel], self.pz[sel], self.E[sel])
+        out._derived = {k: v[sel] for k, v in self._derived.items()}
+        return out
+
+    def _get(self, name, fn):
+        x = self._derived.get(name)
+        if x is None:
+            x = self._derived[name] = fn()
+        return x
+
+    @property
+    def pt(self):
+        return self._get("pt", lambda: np.hypot(self.px, self.py))
+
+    @property
+    def phi(self):
+        return self._get("phi", lambda: np.arctan2(self.py, self.px))
+
+    @property
+    def eta(self):
+        pt = self.pt
+        return self._get("eta", lambda: np.arcsinh(np.divide(self.pz, pt, out=np.zeros_like(pt), where=pt > 0)))
+
+    @property
+    def mass(self):
+        def m():
+            m2 = self.E * self.E - self.px * self.px - self.py * self.py - self.pz * self.pz
+            return np.sqrt(np.maximum(m2, 0.0))
+        return self._get("mass", m)
+
+    x = property(lambda self: self.px)
+    y = property(lambda self: self.py)
+    z = property(lambda self: self.pz)
+    t = property(lambda self: self.E)
+    energy = t
+
+    def delta_phi(self, other):
+        return (self.phi - other.phi + np.pi) % (2 * np.pi) - np.pi
+
+    def delta_r(self, other):
+        return np.hypot(self.eta - other.eta, self.delta_phi(other))
+
+
+class P4Cache:
+    '''
+    p4 = P4Cache()                                # one per chunk, next to the Cutflow
+    vec_lead_l = p4.of(flow.take("step3a", "leptons")[:, 0])
+    vec_met    = p4.of(flow.take("step3a", "PuppiMETCorr"), kind="met")
+    # later steps reuse the same full-chunk components and only gather their rows
+
+    kind: "p4" (pt, eta, phi, mass), "met" (pt, phi; eta = mass = 0), "regressed" (pt_regressed).
+    Views are cached by (collection, element); anything else is converted without caching.
+    '''
+
+    def __init__(self):
+        self._full = {}
+
+    def _components(self, coll, item, kind):
+        def col(name):
+            x = coll[name]
+            if item is not None:
+                x = ak.pad_none(x, item + 1, axis=1)[:, item]
+            return _as_np(ak.fill_none(x, np.nan))
+
+        pt, phi = col("pt_regressed" if kind == "regressed" else "pt"), col("phi")
+        if kind == "met":
+            zero = np.zeros_like(pt)
+            return P4(pt * np.cos(phi), pt * np.sin(phi), zero, np.abs(pt))
+        return P4.from_ptetaphim(pt, col("eta"), phi, col("mass"))
+
+    def of(self, obj, kind="p4"):
+        if not isinstance(obj, View):
+            if kind == "met":
+                pt, phi = _as_np(obj.pt), _as_np(obj.phi)
+                return P4(pt * np.cos(phi), pt * np.sin(phi), np.zeros_like(pt), np.abs(pt))
+            return P4.from_ptetaphim(obj.pt_regressed if kind == "regressed" else obj.pt, obj.eta, obj.phi, obj.mass)
+
+        coll, item = obj.base
+        key = (id(coll), item, kind)
+        hit = self._full.get(key)
+        if hit is None:
+            hit = self._full[key] = (coll, self._components(coll, item, kind))
+        return hit[1][obj.index]
@@ -0,0 +1,224 @@
+import numpy as np
+import awkward as ak
+
+# 2+2 b-jet pairing of the resolved regime, computed once per chunk on flat numpy buffers:
+# dm_4b_min, dr_bb_ave, mbbj and the Higgs candidate of min_dm_bb_bb, dr_bb_bb_avg, m_bbj and
+# higgs_kin (utils/variables_def.py), with the same case rules.
+
+# the six pairs of four slots, and the 2+2 candidates as pairs of pair indices
+_PAIRS      = np.array([(0, 1), (0, 2), (0, 3), (1, 2), (1, 3), (2, 3)])
+_PAIRINGS_4 = np.array([(0, 5), (1, 4), (2, 3)])   # (01|23) (02|13) (03|12)
+_PAIRINGS_3 = np.array([(0, 1), (0, 3), (1, 3)])   # 3 b-jets, no 4th jet: (01|02) (01|12) (02|12)
+
+
+def _flat(x):
+    return np.asarray(ak.to_numpy(ak.flatten(x, axis=None)), dtype=np.float64)
+
+def _p4(coll):
+    '''Flat (N, 4) px, py, pz, E plus flat eta, phi of a jagged pt/eta/phi/mass collection.'''
+    pt, eta, phi, m = (_flat(getattr(coll, k)) for k in ("pt", "eta", "phi", "mass"))
+    p4 = np.empty((pt.size, 4))
+    p4[:, 0] = pt * np.cos(phi)
+    p4[:, 1] = pt * np.sin(phi)
+    p4[:, 2] = pt * np.sinh(eta)
+    p4[:, 3] = np.sqrt(p4[:, 0]**2 + p4[:, 1]**2 + p4[:, 2]**2 + m * m)
+    return p4, eta, phi
+
+def _mass(p4):
+    m2 = p4[..., 3]**2 - p4[..., 0]**2 - p4[..., 1]**2 - p4[..., 2]**2
+    return np.sqrt(np.maximum(m2, 0.0))
+
+def _dr(eta1, phi1, eta2, phi2):
+    dphi = np.abs(phi1 - phi2)
+    dphi = np.where(dphi > np.pi, 2 * np.pi - dphi, dphi)
+    return np.sqrt((eta1 - eta2)**2 + dphi**2)
+
+def _score(coll, name):
+    '''Field `name` of coll, None if it has no such field (e.g. make_vector records).'''
+    if not name:
+        return None
+    try:
+        return getattr(coll, name)
+    except (AttributeError, ak.errors.FieldNotFoundError):
+        return None
+
+def _first_max(x, counts):
+    '''Per event: local index of the first maximum of jagged x (0 for empty events).'''
+    best = ak.argmax(x, axis=1, keepdims=False)
+    return np.where(counts > 0, np.asarray(ak.to_numpy(ak.fill_none(best, 0)), dtype=np.int64), 0)
+
+
+class BBPairing:
+    '''
+    pairing = BBPairing(single_bjets, single_jets)
+    pairing.dm_min       # dm_4b_min : min |m(bb) - m(bb)| over the 2+2 candidates
+    pairing.dr_ave       # dr_bb_ave : min 0.5 * (ΔR(bb) + ΔR(bb)) over the same candidates
+    pairing.mbbj         # m(bb + j), bb = min-ΔR pair among all b-jets
+    pairing.higgs        # (mass, pt, phi, eta) of the Higgs candidate
+
+    Slots: the leading four b-jets; with exactly three b-jets the 4th slot is the jet of all_jets
+    with the highest `btag` score, or its first jet when `btag` is None or not a field of all_jets.
+    all_jets is not cleaned of the b-jets, so the 4th slot can repeat a b-jet (the single-b
+    processors pass btag-ordered jets, whose first jet is the leading b-jet). With three b-jets
+    and an empty all_jets the candidates are the three pairs-of-pairs sharing one b-jet. Fewer
+    than three b-jets: NaN.
+
+    mbbj: 3 b-jets and 3 jets: m(bbb); else min-ΔR b pair + the leading-pt jet of all_jets; with
+    no jet at all, the min-ΔR pair + the other b-jet with the lowest `btag` (≥4 b-jets), or the
+    three leading-pt b-jets.
+
+    Per-event results: slots (n, 4) flat jet indices (-1 = empty), pair_p4 (n, 6, 4) and
+    best_dm / best_dr, the chosen candidate (row of `pairings`, -1 if none) for each criterion.
+    Inputs only need pt/eta/phi/mass (ak.Array, vectors or utils.views.View).
+    '''
+
+    def __init__(self, bjets, all_jets=None, btag=None):
+        all_jets = bjets if all_jets is None else all_jets
+        nb = np.asarray(ak.to_numpy(ak.num(bjets.pt, axis=1)), dtype=np.int64)
+        nj = np.asarray(ak.to_numpy(ak.num(all_jets.pt, axis=1)), dtype=np.int64)
+        n  = nb.size
+        self.nb, self.nj = nb, nj
+
+        p4_b, eta_b, phi_b = _p4(bjets)
+        p4_j, eta_j, phi_j = _p4(all_jets)
+        off_b = np.cumsum(nb) - nb
+        off_j = np.cumsum(nj) - nj
+        has_j = nj > 0
+
+        score = _score(all_jets, btag)
+        best_j = _first_max(score, nj) if score is not None else np.zeros(n, dtype=np.int64)
+
+        # combined table: b-jets first, all_jets after; slots index into it
+        p4  = np.concatenate([p4_b, p4_j])
+        eta = np.concatenate([eta_b, eta_j])
+        phi = np.concatenate([phi_b, phi_j])
+        s   = np.arange(4)
+        slots = np.where(s < np.minimum(nb, 4)[:, None], off_b[:, None] + s, -1)
+        fourth = (nb == 3) & has_j
+        slots[fourth, 3] = p4_b.shape[0] + off_j[fourth] + best_j[fourth]
+        self.slots = slots
+
+        filled = slots >= 0
+        safe   = np.where(filled, slots, 0)
+        sp4    = np.where(filled[..., None], p4[safe], np.nan)
+        seta   = np.where(filled, eta[safe], np.nan)
+        sphi   = np.where(filled, phi[safe], np.nan)
+
+        a, b = _PAIRS[:, 0], _PAIRS[:, 1]
+        self.pair_p4   = sp4[:, a] + sp4[:, b]
+        self.pair_mass = _mass(self.pair_p4)
+        self.pair_dr   = _dr(seta[:, a], sphi[:, a], seta[:, b], sphi[:, b])
+
+        # 2+2 candidates
+        case4 = (nb >= 4) | fourth
+        valid = case4 | (nb == 3)
+        self.valid    = valid
+        self.pairings = np.where(case4[:, None, None], _PAIRINGS_4, _PAIRINGS_3)
+        rows = np.arange(n)[:, None]
+        pa, pb = self.pairings[..., 0], self.pairings[..., 1]
+        dm = np.abs(self.pair_mass[rows, pa] - self.pair_mass[rows, pb])
+        dr = 0.5 * (self.pair_dr[rows, pa] + self.pair_dr[rows, pb])
+        dm[~valid], dr[~valid] = np.inf, np.inf
+        self.best_dm = np.where(valid, np.argmin(dm, axis=1), -1)
+        self.best_dr = np.where(valid, np.argmin(dr, axis=1), -1)
+        self._dm_min = np.where(valid, dm.min(axis=1), np.nan)
+        self._dr_ave = np.where(valid, dr.min(axis=1), np.nan)
+
+        self._mbbj  = self._solve_mbbj(bjets, all_jets, p4_b, eta_b, phi_b, p4_j, off_b, off_j, btag)
+        self._higgs = self._solve_higgs(p4, p4_j, off_j)
+
+    def _solve_mbbj(self, bjets, all_jets, p4_b, eta_b, phi_b, p4_j, off_b, off_j, btag):
+        nb, nj = self.nb, self.nj
+        n   = nb.size
+        out = np.full(n, np.nan)
+        if p4_b.shape[0] == 0:
+            return out
+
+        # min-ΔR pair among all b-jets (first minimum, in itertools.combinations order)
+        pairs = ak.argcombinations(bjets.pt, 2, axis=1)
+        i = _flat(pairs["0"] + off_b).astype(np.int64)
+        j = _flat(pairs["1"] + off_b).astype(np.int64)
+        k = _first_max(ak.unflatten(-_dr(eta_b[i], phi_b[i], eta_b[j], phi_b[j]), nb * (nb - 1) // 2), nb)
+        first = np.cumsum(nb * (nb - 1) // 2) - nb * (nb - 1) // 2
+        two = nb >= 2
+        bi, bj = np.zeros(n, dtype=np.int64), np.zeros(n, dtype=np.int64)
+        bi[two], bj[two] = i[first[two] + k[two]], j[first[two] + k[two]]
+        bb = p4_b[bi] + p4_b[bj]
+
+        # no jet at all: the three leading-pt b-jets ...
+        top3 = (nb >= 3) & (nj == 0)
+        if top3.any():
+            order = ak.argsort(bjets.pt, axis=1, ascending=False, stable=True)[:, :3]
+            sel   = _flat(order[top3] + off_b[top3]).astype(np.int64).reshape(-1, 3)
+            out[top3] = _mass(p4_b[sel].sum(axis=1))
+
+        # ... or, with ≥4 b-jets, bb + the other b-jet with the lowest btag score (the first without scores)
+        c3 = (nb >= 4) & (nj == 0)
+        if c3.any():
+            score = _score(bjets, btag)
+            score = _flat(score) if score is not None else np.zeros(p4_b.shape[0])
+            for e in np.flatnonzero(c3):
+                rest  = [x for x in range(off_b[e], off_b[e] + nb[e]) if x not in (bi[e], bj[e])]
+                third = min(rest, key=lambda x: score[x])
+                out[e] = _mass(bb[e] + p4_b[third])
+
+        # any jet: bb + the leading-pt jet of all_jets
+        c2   = (nj > 0) & two
+        lead = off_j + _first_max(all_jets.pt, nj)
+        out[c2] = _mass(bb[c2] + p4_j[lead[c2]])
+
+        c1 = (nb == 3) & (nj == 3)
+        out[c1] = _mass(p4_b[off_b[c1, None] + np.arange(3)].sum(axis=1))
+        return out
+
+    def _solve_higgs(self, p4, p4_j, off_j):
+        '''3 b + 3 jets: sum of the b-jets; ≥4 jets: sum of the four leading-pt jets; else zeros.'''
+        nb, nj = self.nb, self.nj
+        n  = nb.size
+        h  = np.zeros((n, 4))
+
+        c1 = (nb == 3) & (nj == 3)
+        h[c1] = p4[self.slots[c1, :3]].sum(axis=1)
+
+        c2 = nj >= 4
+        if c2.any():
+            pt_j  = np.hypot(p4_j[:, 0], p4_j[:, 1])
+            order = ak.argsort(ak.unflatten(pt_j, nj), axis=1, ascending=False, stable=True)[:, :4]
+            top   = _flat(order).astype(np.int64) + np.repeat(off_j, np.minimum(nj, 4))
+            evt   = np.repeat(np.arange(n), np.minimum(nj, 4))
+            for c in range(4):
+                h[c2, c] = np.bincount(evt, weights=p4_j[top, c], minlength=n)[c2]
+
+        pt  = np.hypot(h[:, 0], h[:, 1])
+        phi = np.arctan2(h[:, 1], h[:, 0])
+        eta = np.arcsinh(np.divide(h[:, 2], pt, out=np.zeros(n), where=pt > 0))
+        return _mass(h), pt, phi, eta
+
+    #------------------------------------------------------------------------------------------------------------------------------------------
+
+    @property
+    def dm_min(self):
+        return ak.Array(self._dm_min)
+
+    @property
+    def dr_ave(self):
+        return ak.Array(self._dr_ave)
+
+    @property
+    def mbbj(self):
+        return ak.Array(self._mbbj)
+
+    @property
+    def higgs(self):
+        '''(mass, pt, phi, eta), as returned by the former higgs_kin.'''
+        return tuple(ak.Array(x) for x in self._higgs)
+
+    def chosen(self, by="dm"):
+        '''Chosen 2+2 pairing: (pair indices (n, 2) into _PAIRS, pair four-vectors (n, 2, 4) px/py/pz/E).'''
+        best = self.best_dm if by == "dm" else self.best_dr
+        rows = np.arange(best.size)
+        idx  = self.pairings[rows, np.maximum(best, 0)]
+        idx[best < 0] = -1
+        p4   = self.pair_p4[rows[:, None], np.maximum(idx, 0)]
+        p4[best < 0] = np.nan
+        return idx, p4
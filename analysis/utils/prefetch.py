@@ -0,0 +1,127 @@
+import time
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from utils.profiling import StageProfile
+
+# Read-ahead of skim chunks while the processor runs.
+# A file is read in chunks of entries; a background thread keeps the next `depth` chunks
+# downloading and decompressing (uproot and pyarrow release the GIL there) while
+# `Wh_Processor.process` works on the current one. A new read starts only while the chunks held in
+# memory - finished and unconsumed, plus the ones in flight estimated at the size of the last
+# chunk - stay under `max_mb`; one read is always allowed, so a chunk larger than the cap still
+# goes through. The time the processor waits for data is the "io_wait" stage of the profile.
+#
+#   loader = Prefetcher(lambda a, b: load_root(url, is_mc, name, a, b), chunk_ranges(n, 200000), depth=2)
+#   for events in loader:
+#       output = accumulate(output, proc.process(events))
+#   loader.report()
+
+CHUNK_SIZE = 200_000   # entries per chunk
+DEPTH      = 1         # chunks read ahead
+MAX_MB     = 500       # memory cap of the chunks held ahead (jobs get 3000 MB)
+
+#----------------------------------------------------------------------------------------------------------------------------------------------
+
+def chunk_ranges(n_entries, chunk_size=CHUNK_SIZE, entry_start=None, entry_stop=None):
+    '''
+    [(start, stop)] covering [entry_start, entry_stop) of a file with `n_entries` (chunk_size <= 0: one
+    chunk). An empty range still gives one empty chunk, so the job writes its (empty) output.
+    '''
+    start = entry_start or 0
+    stop  = n_entries if entry_stop is None else min(entry_stop, n_entries)
+    if stop <= start:
+        return [(start, start)]
+    if not chunk_size or chunk_size <= 0:
+        return [(start, stop)]
+    return [(a, min(a + chunk_size, stop)) for a in range(start, stop, chunk_size)]
+
+
+def accumulate(total, output):
+    '''
+    Merge the output of one chunk into `total`: histograms, profile and diagnostics are added;
+    "trees" are collected by the processor itself across calls, so the latest reference is kept.
+    '''
+    if total is None:
+        return dict(output)
+    for key, val in output.items():
+        if key == "trees" or key not in total or total[key] is None:
+            total[key] = val
+        elif val is not None:
+            total[key] = total[key] + val
+    return total
+
+#----------------------------------------------------------------------------------------------------------------------------------------------
+
+class Prefetcher:
+    '''
+    Iterate over `read(start, stop)` of `ranges`, with up to `depth` chunks read ahead on a
+    background thread and at most `max_mb` of them held in memory (see module comment).
+    `nbytes(chunk)` gives the memory of a chunk (default: its .nbytes).
+    '''
+
+    def __init__(self, read, ranges, depth=DEPTH, max_mb=MAX_MB, nbytes=None):
+        self.read      = read
+        self.ranges    = list(ranges)
+        self.depth     = max(0, int(depth))
+        self.max_bytes = max_mb * 2**20
+        self.nbytes    = nbytes or (lambda chunk: getattr(chunk, "nbytes", 0))
+        self.io_wait   = 0.0    # s the consumer waited for a chunk
+        self.read_time = 0.0    # s spent reading, on the background thread
+        self.n_events  = 0
+        self.n_chunks  = 0
+        self.peak_mb   = 0.0    # largest memory held ahead
+        self._last     = 0      # bytes of the last chunk read, estimate for chunks in flight
+        self._lock     = threading.Lock()
+
+    def _read(self, start, stop):
+        t0 = time.perf_counter()
+        chunk = self.read(start, stop)
+        size = self.nbytes(chunk)
+        with self._lock:
+            self.read_time += time.perf_counter() - t0
+            self._last = size
+        return chunk, size
+
+    def _held(self, pending):
+        return sum(f.result()[1] if f.done() and not f.exception() else self._last for f in pending)
+
+    def __len__(self):
+        return len(self.ranges)
+
+    def __iter__(self):
+        pending, todo = deque(), deque(self.ranges)
+        with ThreadPoolExecutor(max_workers=1, thread_name_prefix="prefetch") as pool:
+            def fill(ahead):
+                # `ahead`: chunks allowed in the queue (the one being waited for counts)
+                while todo and len(pending) < ahead:
+                    held = self._held(pending)
+                    if pending and held + self._last > self.max_bytes:
+                        break
+                    pending.append(pool.submit(self._read, *todo.popleft()))
+                    self.peak_mb = max(self.peak_mb, (held + self._last) / 2**20)
+
+            try:
+                while todo or pending:
+                    fill(1 + self.depth)
+                    t0 = time.perf_counter()
+                    chunk, _ = pending.popleft().result()
+                    self.io_wait += time.perf_counter() - t0
+                    self.n_chunks += 1
+                    self.n_events += len(chunk)
+                    fill(self.depth)
+                    yield chunk
+                    del chunk
+            finally:
+                for f in pending:
+                    f.cancel()
+
+    def profile(self):
+        '''The I/O wait as a StageProfile row, to be added to the processor's profile.'''
+        return StageProfile({"io_wait": {"calls": self.n_chunks, "wall": self.io_wait, "cpu": 0.0, "rss_delta": 0.0,
+                                         "rss_peak": 0.0, "n_in": self.n_events, "n_out": self.n_events}})
+
+    def report(self):
+        print(f"[PREFETCH] {self.n_chunks} chunks, {self.n_events} events: read {self.read_time:.1f} s in the background, "
+              f"I/O wait {self.io_wait:.1f} s (depth {self.depth}, up to {self.peak_mb:.0f} MB held ahead)")
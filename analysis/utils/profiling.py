@@ -0,0 +1,161 @@
+import os
+import time
+import json
+import threading
+import resource
+import numpy as np
+
+# Lightweight stage profiler for processor.process.
+# The processors are long, sequential scripts, so stages are delimited by marks
+# (`prof.mark("jec_jer", n)` closes the running stage and opens the next one) rather
+# than by re-indenting every STEP block under a context manager.
+# `prof.result()` is a StageProfile, an addable accumulator that merges across chunks/files.
+
+_PAGE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+_FIELDS = ("calls", "wall", "cpu", "rss_delta", "rss_peak", "n_in", "n_out")
+
+
+def rss_mb():
+    '''Current resident set size in MB (Linux /proc, falls back to ru_maxrss).'''
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * _PAGE / 1024**2
+    except (OSError, ValueError, IndexError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.
+
+
+class _RSSSampler(threading.Thread):
+    '''Background thread polling RSS so that the peak inside a stage is seen, not only its end.'''
+
+    def __init__(self, interval=0.005):
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.peak = rss_mb()
+        self._halt = threading.Event()
+
+    def reset(self):
+        cur = rss_mb()
+        self.peak = cur
+        return cur
+
+    def run(self):
+        while not self._halt.wait(self.interval):
+            cur = rss_mb()
+            if cur > self.peak:
+                self.peak = cur
+
+    def halt(self):
+        self._halt.set()
+
+#----------------------------------------------------------------------------------------------------------------------------------------------
+
+class StageProfile(dict):
+    '''
+    {stage: {"calls", "wall", "cpu", "rss_delta", "rss_peak", "n_in", "n_out"}}
+    Times in seconds, memory in MB. Supports `+` so coffea's accumulate() merges it
+    across chunks; everything is summed except rss_peak, which is maxed.
+    '''
+
+    def __add__(self, other):
+        out = StageProfile({k: dict(v) for k, v in self.items()})
+        out += other
+        return out
+
+    def __iadd__(self, other):
+        for name, rec in other.items():
+            mine = self.setdefault(name, {f: 0 for f in _FIELDS})
+            for f in _FIELDS:
+                mine[f] = max(mine[f], rec[f]) if f == "rss_peak" else mine[f] + rec[f]
+        return self
+
+    def report(self):
+        total = sum(r["wall"] for r in self.values()) or 1e-12
+        print(f"\n{'stage':<14}{'calls':>6}{'wall[s]':>10}{'cpu[s]':>10}{'frac':>8}{'ev/s':>12}"
+              f"{'dRSS[MB]':>10}{'peak[MB]':>10}{'n_in':>11}{'n_out':>11}")
+        for name, r in self.items():
+            evs = f"{r['n_in'] / r['wall']:.4g}" if r["n_in"] and r["wall"] > 0 else "-"
+            print(f"{name:<14}{r['calls']:>6}{r['wall']:>10.3f}{r['cpu']:>10.3f}{r['wall'] / total:>8.1%}{evs:>12}"
+                  f"{r['rss_delta']:>10.1f}{r['rss_peak']:>10.1f}{int(r['n_in']):>11}{int(r['n_out']):>11}")
+
+    def to_json(self, path):
+        with open(path, "w") as f:
+            json.dump(self, f, indent=2)
+
+    @classmethod
+    def from_json(cls, path):
+        with open(path) as f:
+            return cls(json.load(f))
+
+    def to_tree(self):
+        '''Flat one-entry branch dict ({stage}_{field}) for writing with uproot.'''
+        return {f"{name}_{f}": np.array([rec[f]], dtype=np.float64) for name, rec in self.items() for f in _FIELDS}
+
+#----------------------------------------------------------------------------------------------------------------------------------------------
+
+class StageProfiler:
+    '''
+    Sequential stage timer. Call begin() at the top of process(), mark(name, n) at the start
+    of every STEP block (n = events entering it) and result() at the end. A stage's n_out
+    defaults to its n_in; selection stages pass it explicitly via mark(..., n_out=) / result(n_out).
+    With sample_rss=True a polling thread tracks the per-stage peak RSS.
+    '''
+
+    def __init__(self, enabled=True, sample_rss=False):
+        self.enabled = enabled
+        self.records = StageProfile()
+        self._current = None
+        self._sampler = None
+        if enabled and sample_rss:
+            self._sampler = _RSSSampler()
+            self._sampler.start()
+
+    def begin(self):
+        self._current = None
+        self.records = StageProfile()
+
+    def mark(self, name, n=None, n_out=None):
+        if not self.enabled:
+            return
+        self.stop(n_out)
+        self._current = name
+        self._n_in = 0 if n is None else int(n)
+        self._rss0 = self._sampler.reset() if self._sampler is not None else rss_mb()
+        self._cpu0 = time.process_time()
+        self._t0 = time.perf_counter()
+
+    def stop(self, n_out=None):
+        if not self.enabled or self._current is None:
+            return
+        wall = time.perf_counter() - self._t0
+        cpu = time.process_time() - self._cpu0
+        rss = rss_mb()
+        peak = max(self._sampler.peak, rss) if self._sampler is not None else max(self._rss0, rss)
+        rec = self.records.setdefault(self._current, {f: 0 for f in _FIELDS})
+        rec["calls"] += 1
+        rec["wall"] += wall
+        rec["cpu"] += cpu
+        rec["rss_delta"] += rss - self._rss0
+        rec["rss_peak"] = max(rec["rss_peak"], peak)
+        rec["n_in"] += self._n_in
+        rec["n_out"] += self._n_in if n_out is None else int(n_out)
+        self._current = None
+
+    def result(self, n_out=None):
+        '''Close the running stage and return this call's profile (empty if disabled).'''
+        self.stop(n_out)
+        return self.records
+
+    def close(self):
+        self.stop()
+        if self._sampler is not None:
+            self._sampler.halt()
+            self._sampler = None
+
+
+def merge_profiles(paths):
+    '''Sum the JSON sidecars of many jobs into one StageProfile.'''
+    total = StageProfile()
+    for p in paths:
+        total += StageProfile.from_json(p)
+    return total
@@ -0,0 +1,231 @@
+import os
+import io
+import gzip
+import json
+import glob
+import fnmatch
+import hashlib
+import tarfile
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import uproot
+except ImportError:
+    uproot = None
+
+# Provenance records for incremental re-processing.
+# Every analysis output carries a small JSON record (TObjString "provenance") with what went
+# into it: the input file (URL, size, mtime), the dataset metadata (xsec, nevents, ...), the code
+# (processor, driver, utils), the correction files and the BDT models, each as a sha1 per file. The submitter builds the record each job
+# would get now and only submits the (dataset, file) jobs whose stored record differs or is absent.
+# utils/ and xgb_model/ are hashed from their directories (the job unpacks its tarballs into the
+# same directories), and the submitters pack utils.tar.gz from utils/ (pack_dir) before each
+# submission, so the record describes the code the jobs run.
+
+RECORD_VERSION = 1
+RECORD_NAME    = "provenance"
+SECTIONS       = ("dataset", "code", "corrections", "models")
+
+#----------------------------------------------------------------------------------------------------------------------------------------------
+
+def sha1_bytes(data):
+    return hashlib.sha1(data).hexdigest()
+
+def sha1_file(path):
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+def _dir_files(directory, patterns):
+    '''Regular files of `directory` (recursive, no __pycache__) whose basename matches `patterns`.'''
+    match = lambda name: any(fnmatch.fnmatch(name, p) for p in patterns)
+    return [path for path in sorted(glob.glob(os.path.join(directory, "**", "*"), recursive=True))
+            if os.path.isfile(path) and match(os.path.basename(path)) and "__pycache__" not in path]
+
+def file_hashes(directory, tarball=None, patterns=("*",)):
+    '''
+    {basename: sha1} of the regular files of `directory` matching `patterns`, read from `tarball`
+    only when the directory does not exist (members are matched by basename, so both give the same keys).
+    '''
+    out = {}
+    if directory and os.path.isdir(directory):
+        for path in _dir_files(directory, patterns):
+            out[os.path.basename(path)] = sha1_file(path)
+    elif tarball and os.path.exists(tarball):
+        with tarfile.open(tarball) as tar:
+            for m in tar.getmembers():
+                name = os.path.basename(m.name)
+                if m.isfile() and any(fnmatch.fnmatch(name, p) for p in patterns) and "__pycache__" not in m.name:
+                    out[name] = sha1_bytes(tar.extractfile(m).read())
+    return dict(sorted(out.items()))
+
+def pack_dir(directory, tarball, patterns=("*",)):
+    '''
+    Write `tarball` (.tar.gz) with the files of `directory` that file_hashes hashes, under the
+    directory's name. Members are sorted and carry no timestamps or owners, so the same files
+    always give the same archive.
+    '''
+    files = _dir_files(directory, patterns)
+    base  = os.path.dirname(os.path.abspath(directory))
+    buf   = io.BytesIO()
+    with tarfile.open(fileobj=buf, mode="w") as tar:
+        for path in files:
+            info = tar.gettarinfo(path, arcname=os.path.relpath(os.path.abspath(path), base))
+            info.mtime, info.uid, info.gid, info.uname, info.gname = 0, 0, 0, "", ""
+            with open(path, "rb") as f:
+                tar.addfile(info, f)
+    with open(tarball, "wb") as out, gzip.GzipFile(fileobj=out, mode="wb", mtime=0) as gz:
+        gz.write(buf.getvalue())
+    print(f"[PROVENANCE] Packed {len(files)} file(s) of {directory} into {tarball}")
+
+def tree_hash(hashes):
+    '''One digest for a {name: sha1} map.'''
+    return sha1_bytes(json.dumps(hashes, sort_keys=True).encode())
+
+#----------------------------------------------------------------------------------------------------------------------------------------------
+
+def _split_xrootd(url):
+    '''root://host//path -> ("root://host", "/path"); None for local paths.'''
+    if not url.startswith("root://"):
+        return None
+    host, _, path = url[len("root://"):].partition("/")
+    return f"root://{host}", "/" + path.lstrip("/")
+
+def input_fingerprint(url, timeout=60):
+    '''
+    {"url", "size", "mtime"} of an input file: os.stat locally, `xrdfs stat` for root:// URLs.
+    size/mtime are None when they cannot be obtained (the record then only pins the URL).
+    '''
+    fp = {"url": url, "size": None, "mtime": None}
+    remote = _split_xrootd(url)
+    if remote is None:
+        try:
+            st = os.stat(url)
+            fp["size"], fp["mtime"] = int(st.st_size), int(st.st_mtime)
+        except OSError:
+            pass
+        return fp
+    try:
+        res = subprocess.run(["xrdfs", remote[0], "stat", remote[1]],
+                             capture_output=True, text=True, check=True, timeout=timeout)
+    except (OSError, subprocess.CalledProcessError, subprocess.TimeoutExpired):
+        return fp
+    for line in res.stdout.splitlines():
+        key, _, val = line.partition(":")
+        if key.strip() == "Size":
+            fp["size"] = int(val.strip())
+        elif key.strip() == "MTime":
+            fp["mtime"] = val.strip()
+    return fp
+
+def input_fingerprints(urls, max_workers=16):
+    '''{url: input_fingerprint(url)} for many inputs, concurrently.'''
+    urls = list(dict.fromkeys(urls))
+    print(f"[PROV] Fingerprinting {len(urls)} input files")
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        return dict(zip(urls, pool.map(input_fingerprint, urls)))
+
+#----------------------------------------------------------------------------------------------------------------------------------------------
+
+class Provenance:
+    '''
+    prov = Provenance(processor="Wh_processor.py", driver="run_analysis.py")   # hashes computed once
+    record = prov.record(file_url, key, meta, job_index=i)                     # + input and dataset
+    write_record(rootfile, record)                                             # in the job
+    stale_jobs({(key, i): ([output candidates], record), ...})                 # in the submitter
+    '''
+
+    def __init__(self, processor, driver=None, here=None, corr_dir=None, model_dir=None):
+        here      = here or os.getcwd()
+        corr_dir  = corr_dir or os.environ.get("CORR_DIR", os.path.join(here, "corrections"))
+        model_dir = model_dir or os.path.join(here, "xgb_model")
+
+        utils = file_hashes(os.path.join(here, "utils"), os.path.join(here, "utils.tar.gz"), patterns=("*.py",))
+        code  = {"processor": {os.path.basename(processor): sha1_file(processor)}, "utils": tree_hash(utils)}
+        if driver:
+            code["driver"] = {os.path.basename(driver): sha1_file(driver)}
+
+        self.static = {
+            "code":        code,
+            "corrections": file_hashes(corr_dir),
+            "models":      file_hashes(model_dir, os.path.join(here, "xgb_model.tar.gz"), patterns=("*.json",)),
+        }
+
+    def record(self, input_url, dataset, metadata, fingerprint=None, **extra):
+        rec = {
+            "version": RECORD_VERSION,
+            "input":   fingerprint or input_fingerprint(input_url),
+            "dataset": {"key": dataset, "metadata": tree_hash(metadata)},
+        }
+        rec.update(self.static)
+        rec.update(extra)
+        return rec
+
+#----------------------------------------------------------------------------------------------------------------------------------------------
+
+def write_record(rootfile, record, name=RECORD_NAME):
+    '''Store the record as a TObjString in an open uproot output file.'''
+    rootfile[name] = json.dumps(record, sort_keys=True)
+
+def read_record(url, name=RECORD_NAME):
+    '''The record of an output file, or None if the file or the record is missing/unreadable.'''
+    if uproot is None:
+        raise ImportError("uproot is required to read provenance records")
+    try:
+        with uproot.open(url) as f:
+            if name not in f:
+                return None
+            return json.loads(str(f[name]))
+    except Exception as e:
+        print(f"[WARNING] No provenance in {url}: {e}")
+        return None
+
+def diff(stored, expected):
+    '''Reasons why `stored` is stale w.r.t. `expected` (empty list: up to date).'''
+    if stored is None:
+        return ["no provenance"]
+    if stored.get("version") != expected.get("version"):
+        return ["record version"]
+
+    reasons = []
+    a, b = stored.get("input", {}), expected.get("input", {})
+    if a.get("url") != b.get("url"):
+        reasons.append("input url")
+    for k in ("size", "mtime"):
+        if a.get(k) is not None and b.get(k) is not None and a[k] != b[k]:
+            reasons.append(f"input {k}")
+    for section in SECTIONS:
+        sa, sb = stored.get(section, {}), expected.get(section, {})
+        for k in sorted(set(sa) | set(sb)):
+            if sa.get(k) != sb.get(k):
+                reasons.append(f"{section}:{k}")
+    return reasons
+
+def stale_jobs(jobs, max_workers=16):
+    '''
+    jobs: {job_key: (output candidates (paths/URLs that exist), expected record)}.
+    Returns {job_key: reasons} for every job to (re)submit; a job with no output is "missing".
+    Records are read concurrently, one per job (first candidate).
+    '''
+    todo = {k: outs[0] for k, (outs, _) in jobs.items() if outs}
+    out  = {k: ["missing"] for k, (outs, _) in jobs.items() if not outs}
+    if todo:
+        print(f"[PROV] Reading provenance of {len(todo)} outputs")
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            stored = dict(zip(todo, pool.map(read_record, todo.values())))
+        for k, rec in stored.items():
+            reasons = diff(rec, jobs[k][1])
+            if reasons:
+                out[k] = reasons
+    return out
+
+def summarize(stale):
+    '''Count of stale jobs per reason, for the submitter printout.'''
+    counts = {}
+    for reasons in stale.values():
+        for r in reasons:
+            counts[r] = counts.get(r, 0) + 1
+    return dict(sorted(counts.items(), key=lambda kv: -kv[1]))
@@ -0,0 +1,251 @@
+import os
+import sys
+import time
+import random
+import argparse
+import tempfile
+import subprocess
+
+try:
+    import uproot
+    from uproot.source.file import MultithreadedFileSource
+    from uproot.deserialization import DeserializationError
+except ImportError:
+    uproot = None
+    MultithreadedFileSource = object
+    DeserializationError = OSError
+
+from utils.provenance import _split_xrootd
+
+# Robust remote reads for the skimmer and the analysis. Every open and read goes through RemoteReader:
+#   - an attempt is retried with jittered exponential backoff (Backoff: sleep drawn from
+#     [0, min(cap, base * 2**k)], "full jitter", so the jobs of a cluster do not retry in step);
+#   - a read is a chunk of entries (utils/prefetch.py); after a failure the handle is closed, the
+#     file reopened and only that chunk read again, so the chunks already processed are kept;
+#   - after `per_source` failed attempts on one source the reader fails over to the next: the
+#     same path behind alternate XRootD redirectors (XRD_MIRRORS, MIRRORS for /store/ paths), then
+#     optionally a local copy made with xrdcp (LOCAL_COPY=1), and stays there for later chunks.
+# FlakySource is a fault-injecting uproot source for local files, so the whole chain can be
+# exercised offline:
+#
+#   python -m utils.remote test skim.root --fail-rate 0.3 --mirror /nonexistent/skim.root
+#
+#   reader = RemoteReader(url, open_fn=lambda u: uproot.open(u, timeout=300),
+#                         read_fn=lambda f, a, b: load_root(f["Events"], ...))
+#   skim = reader.open()                   # first source that opens
+#   events = reader.read(0, 200000)        # retried / failed over as needed
+
+# Failures worth another attempt (network, timeouts, truncated baskets); anything else is raised at once
+IO_ERRORS = (OSError, TimeoutError, DeserializationError)
+
+# Redirectors tried for a CMS /store/ path when the one in the URL fails (NanoAOD inputs)
+MIRRORS = ["root://cms-xrd-global.cern.ch", "root://xrootd-cms.infn.it", "root://cmsxrootd.fnal.gov"]
+
+#----------------------------------------------------------------------------------------------------------------------------------------------
+
+class Backoff:
+    '''
+    policy = Backoff(retries=4, base=2.0, cap=60.0)
+    policy.delay(k)     # seconds to sleep before retry k (k = 0, 1, ...), jittered
+    '''
+
+    def __init__(self, retries=4, base=2.0, cap=60.0, seed=None):
+        self.retries = retries
+        self.base    = base
+        self.cap     = cap
+        self._rng    = random.Random(seed)
+
+    @classmethod
+    def from_env(cls):
+        return cls(retries=int(os.environ.get("READ_RETRIES", 4)),
+                   base=float(os.environ.get("READ_BACKOFF", 2.0)),
+                   cap=float(os.environ.get("READ_BACKOFF_CAP", 60.0)))
+
+    def delay(self, k):
+        return self._rng.uniform(0.0, min(self.cap, self.base * 2 ** k))
+
+
+def alternates(url, mirrors=None):
+    '''
+    `url` followed by the same path behind the other redirectors: `mirrors` if given, else
+    XRD_MIRRORS (comma separated), else MIRRORS for /store/ paths. Local paths have none.
+    '''
+    remote = _split_xrootd(url)
+    if remote is None:
+        return [url]
+    if mirrors is None:
+        env = os.environ.get("XRD_MIRRORS")
+        mirrors = [m for m in env.split(",") if m] if env else (MIRRORS if remote[1].startswith("/store/") else [])
+    return [url] + [f"{m.rstrip('/')}/{remote[1]}" for m in mirrors if m.rstrip("/") != remote[0]]
+
+
+def local_copy(url, dest_dir=None, timeout=3600):
+    '''xrdcp `url` into `dest_dir` (default: a temporary directory); returns the local path.'''
+    dest_dir = dest_dir or tempfile.mkdtemp(prefix="remote_")
+    dest = os.path.join(dest_dir, os.path.basename(url))
+    print(f"[REMOTE] Copying {url} to {dest}")
+    subprocess.run(["xrdcp", "-f", url, dest], check=True, timeout=timeout)
+    return dest
+
+#----------------------------------------------------------------------------------------------------------------------------------------------
+
+class RemoteReader:
+    '''
+    Reads of one input through a list of sources (see module comment).
+    open_fn(url) -> handle; read_fn(handle, start, stop) -> chunk.
+    Sources: `url`, its alternates (`mirrors`), then a local xrdcp copy if `local` is set.
+    Only `retry_on` exceptions are retried; OSError is raised once every source has failed
+    `per_source` times for the same read.
+    '''
+
+    def __init__(self, url, open_fn, read_fn, mirrors=None, local=None, policy=None, per_source=None, retry_on=IO_ERRORS):
+        self.url        = url
+        self.open_fn    = open_fn
+        self.read_fn    = read_fn
+        self.sources    = alternates(url, mirrors)
+        self.local      = os.environ.get("LOCAL_COPY", "0") == "1" if local is None else local
+        self.policy     = policy or Backoff.from_env()
+        self.per_source = per_source or self.policy.retries + 1
+        self.retry_on   = retry_on
+        self.failures   = 0        # failed attempts, all reads
+        self.failovers  = 0
+        self._idx       = 0
+        self._handle    = None
+
+    @property
+    def current(self):
+        return self.sources[self._idx]
+
+    def _next_source(self):
+        '''Move to the next source (adding the local copy at the end); False when none is left.'''
+        if self._idx + 1 >= len(self.sources) and self.local and _split_xrootd(self.url):
+            try:
+                self.sources.append(local_copy(self.url))
+            except (OSError, subprocess.SubprocessError) as e:
+                print(f"[REMOTE] Local copy failed: {e}")
+            self.local = False
+        if self._idx + 1 >= len(self.sources):
+            return False
+        self._idx += 1
+        self.failovers += 1
+        print(f"[REMOTE] Failing over to {self.current}")
+        return True
+
+    def _close(self):
+        '''Drop the current handle, closing it (a failed handle may hold a connection or a file).'''
+        handle, self._handle = self._handle, None
+        if handle is not None and hasattr(handle, "close"):
+            try:
+                handle.close()
+            except Exception as e:
+                print(f"[REMOTE] Closing the handle of {self.current} failed: {e}")
+
+    def _attempt(self, what, fn):
+        '''Run fn(handle) with retries and failover; the handle is (re)opened as needed.'''
+        while True:
+            for k in range(self.per_source):
+                try:
+                    if self._handle is None:
+                        self._handle = self.open_fn(self.current)
+                    return fn(self._handle)
+                except self.retry_on as e:
+                    self.failures += 1
+                    self._close()
+                    e = (str(e).strip().splitlines() or [type(e).__name__])[0]
+                    if k + 1 < self.per_source:
+                        wait = self.policy.delay(k)
+                        print(f"[REMOTE] {what} failed on {self.current} (attempt {k + 1}/{self.per_source}): {e}; "
+                              f"retrying in {wait:.1f} s")
+                        time.sleep(wait)
+                    else:
+                        print(f"[REMOTE] {what} failed on {self.current} (attempt {k + 1}/{self.per_source}): {e}")
+            if not self._next_source():
+                raise OSError(f"[REMOTE] {what} failed on every source of {self.url}")
+
+    def open(self):
+        '''Handle of the first source that opens.'''
+        return self._attempt("open", lambda handle: handle)
+
+    def read(self, start, stop):
+        return self._attempt(f"read [{start}, {stop})", lambda handle: self.read_fn(handle, start, stop))
+
+    def report(self):
+        if self.failures:
+            print(f"[REMOTE] {self.failures} failed attempts, {self.failovers} failovers, finished on {self.current}")
+
+#----------------------------------------------------------------------------------------------------------------------------------------------
+
+class FlakySource(MultithreadedFileSource):
+    '''
+    Local-file uproot source that fails a byte-range request with probability `fail_rate`
+    (and always for the first `fail_first` requests), like a flaky XRootD server:
+        uproot.open(path, handler=FlakySource.configure(fail_rate=0.2, seed=1))
+    The file header is always read, so that failures hit the basket reads.
+    '''
+
+    fail_rate  = 0.0
+    fail_first = 0
+    rng        = random.Random(0)
+    requests   = 0
+
+    @classmethod
+    def configure(cls, fail_rate=0.0, fail_first=0, seed=0):
+        return type("FlakySource", (cls,), {"fail_rate": fail_rate, "fail_first": fail_first,
+                                            "rng": random.Random(seed), "requests": 0})
+
+    def _maybe_fail(self, what):
+        cls = type(self)
+        cls.requests += 1
+        if cls.requests <= cls.fail_first or cls.rng.random() < cls.fail_rate:
+            raise OSError(f"injected fault in {what}")
+
+    def chunk(self, start, stop):
+        if start > 0:
+            self._maybe_fail(f"chunk [{start}, {stop})")
+        return super().chunk(start, stop)
+
+    def chunks(self, ranges, notifications):
+        self._maybe_fail(f"{len(ranges)} byte ranges")
+        return super().chunks(ranges, notifications)
+
+#----------------------------------------------------------------------------------------------------------------------------------------------
+
+def main():
+    '''Offline check: read a local ROOT file through FlakySource and compare with a clean read.'''
+    import numpy as np
+    from utils.prefetch import chunk_ranges
+
+    parser = argparse.ArgumentParser(description="Fault-injected read of a local ROOT file")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    p = sub.add_parser("test")
+    p.add_argument("path")
+    p.add_argument("--tree", default="Events")
+    p.add_argument("--fail-rate", type=float, default=0.2)
+    p.add_argument("--chunk-size", type=int, default=10000)
+    p.add_argument("--mirror", action="append", default=[], help="alternate paths tried first (e.g. a missing one)")
+    p.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    handler = FlakySource.configure(fail_rate=args.fail_rate, seed=args.seed)
+    reader = RemoteReader(args.path,
+                          open_fn=lambda u: uproot.open(u, handler=handler),
+                          read_fn=lambda f, a, b: f[args.tree].arrays(library="np", entry_start=a, entry_stop=b),
+                          policy=Backoff(retries=8, base=0.01, cap=0.1, seed=args.seed))
+    reader.sources = args.mirror + reader.sources   # failover test: broken mirrors first
+
+    n = reader.open()[args.tree].num_entries
+    with uproot.open(args.path) as f:
+        clean = f[args.tree].arrays(library="np")
+    ok = True
+    for a, b in chunk_ranges(n, args.chunk_size):
+        chunk = reader.read(a, b)
+        for k, v in chunk.items():
+            same = all(np.array_equal(x, y) for x, y in zip(v, clean[k][a:b])) if v.dtype == object else np.array_equal(v, clean[k][a:b])
+            ok = ok and same
+    reader.report()
+    print(f"[REMOTE] {handler.requests} byte-range requests, {n} entries: {'identical' if ok else 'DIFFERENT'} to the clean read")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+import zlib
+import numpy as np
+import awkward as ak
+
+# Counter-based random numbers for the smearing corrections.
+# Every draw is a pure function of (seed, purpose, run, luminosityBlock, event, object index),
+# so a given electron/jet gets the same number whatever the chunking, file splitting,
+# event ordering or number of workers. All draws of a collection are made in one vectorized
+# pass; the 64-bit mixing is done in place on two uint64 buffers.
+
+_GOLDEN = np.uint64(0x9E3779B97F4A7C15)
+_M1     = np.uint64(0xBF58476D1CE4E5B9)
+_M2     = np.uint64(0x94D049BB133111EB)
+_S30, _S27, _S31, _S11 = np.uint64(30), np.uint64(27), np.uint64(31), np.uint64(11)
+_INV_2_53 = 1.0 / float(1 << 53)
+
+
+def _mix_(z):
+    '''splitmix64 finalizer, in place on a uint64 array (uint64 arithmetic wraps mod 2^64).'''
+    with np.errstate(over="ignore"):
+        z += _GOLDEN
+        z ^= z >> _S30
+        z *= _M1
+        z ^= z >> _S27
+        z *= _M2
+        z ^= z >> _S31
+    return z
+
+
+def _as_u64(x, n):
+    if x is None:
+        return np.zeros(n, dtype=np.uint64)
+    return np.asarray(ak.to_numpy(x)).astype(np.uint64, copy=False)
+
+
+class CounterRNG:
+    '''
+    rng = CounterRNG(seed=12345)
+    n   = rng.normal(events, events.Electron, "egm_smear")   # jagged N(0,1), one per electron
+    '''
+
+    def __init__(self, seed=12345):
+        self.seed = int(seed)
+
+    def _purpose_key(self, purpose):
+        k = np.array([self.seed ^ (zlib.crc32(purpose.encode()) << 32)], dtype=np.uint64)
+        return _mix_(k)[0]
+
+    def _event_keys(self, events, purpose):
+        '''One 64-bit key per event from (seed, purpose, run, lumi, event).'''
+        n   = len(events)
+        evt = _as_u64(events.event, n)
+        h   = np.full(n, self._purpose_key(purpose), dtype=np.uint64)
+        h  ^= _as_u64(getattr(events, "run", None), n)
+        _mix_(h)
+        h  ^= _as_u64(getattr(events, "luminosityBlock", None), n)
+        _mix_(h)
+        h  ^= evt
+        return _mix_(h)
+
+    def normal_flat(self, events, objs, purpose):
+        '''Flat float64 N(0,1) array aligned with ak.flatten(objs.pt).'''
+        counts = np.asarray(ak.to_numpy(ak.num(objs.pt, axis=1)), dtype=np.int64)
+        n_tot  = int(counts.sum())
+        if n_tot == 0:
+            return np.zeros(0, dtype=np.float64)
+
+        # object index inside its event: arange minus the event offset, repeated per object
+        starts = np.repeat(np.cumsum(counts) - counts, counts)
+        h1  = np.repeat(self._event_keys(events, purpose), counts)
+        h1 ^= (np.arange(n_tot, dtype=np.int64) - starts).astype(np.uint64)
+        _mix_(h1)
+        h2  = h1 ^ _GOLDEN
+        _mix_(h2)
+
+        # Box–Muller; u1 in (0, 1] so the log is always finite
+        u1 = ((h1 >> _S11) + np.uint64(1)).astype(np.float64)
+        u1 *= _INV_2_53
+        np.log(u1, out=u1)
+        u1 *= -2.0
+        np.sqrt(u1, out=u1)
+        u2 = (h2 >> _S11).astype(np.float64)
+        u2 *= 2.0 * np.pi * _INV_2_53
+        np.cos(u2, out=u2)
+        u1 *= u2
+        return u1
+
+    def normal(self, events, objs, purpose):
+        '''Jagged N(0,1) with the layout of objs.pt.'''
+        return ak.unflatten(self.normal_flat(events, objs, purpose), ak.num(objs.pt, axis=1))
@@ -0,0 +1,168 @@
+import os
+import json
+import numpy as np
+import awkward as ak
+
+# Reading and writing skims as the event records the processors use.
+# ROOT skims are flat branches (Muon_pt, Jet_pt, ...): load_root reads the ones the analysis uses
+# and zips them into records (rebuild_root). Parquet skims (run_skim.py --format parquet) store
+# the collections as nested lists of records, one row group per chunk of --row-group-size events,
+# with the Meta numbers in the file's key-value metadata; load_parquet reads only the projected columns straight into the
+# same records with ak.from_parquet, with no zip step. An entry range is served from the row
+# groups covering it. Files are opened through fsspec, so root:// URLs need fsspec-xrootd.
+
+# Collections and fields the analysis reads (run_analysis.py builds exactly these from ROOT skims)
+COLLECTIONS = {
+    "Muon":     ["pt", "eta", "phi", "charge", "tightId", "looseId", "mass", "pfRelIso04_all"],
+    "Electron": ["pt", "eta", "phi", "charge", "cutBased", "mass", "pfRelIso03_all",
+                 "seedGain", "r9", "superclusterEta", "mvaIso_WP90"],
+    "Jet":      ["pt", "eta", "phi", "mass", "rawFactor", "area", "pt_genMatched",
+                 "btagUParTAK4probbb", "btagUParTAK4B", "passJetIdTightLepVeto", "pt_regressed"],
+    "PuppiMET": ["pt", "phi"],
+    "Pileup":   ["nPU", "nTrueInt"],
+    "PV":       ["npvsGood", "npvs"],
+}
+MC_FIELDS       = {"Jet": ["hadronFlavour", "partonFlavour"]}
+MC_ONLY         = ("Pileup",)
+# Read when present: skim-time corrections (utils/corrections.py SKIM_BRANCHES)
+OPTIONAL_FIELDS = {"Electron": ["pt_corr"], "Jet": ["pt_corr", "mass_corr"], "PuppiMET": ["pt_corr", "phi_corr"]}
+SCALARS         = ["run", "luminosityBlock", "event", "has_trigger", "trigger_type",
+                   "fixedGridRhoFastjetAll", "genWeight", "genTtbarId"]
+
+META_KEY = b"skim_meta"
+ROW_GROUP_SIZE = 100_000
+
+#----------------------------------------------------------------------------------------------------------------------------------------------
+
+def is_parquet(path):
+    return str(path).endswith(".parquet")
+
+
+def _wanted(is_mc, dataset_name):
+    '''{collection: (required fields, optional fields)} for a sample.'''
+    out = {}
+    for coll, fields in COLLECTIONS.items():
+        if coll in MC_ONLY and not is_mc:
+            continue
+        if coll == "PV" and dataset_name.startswith("QCD"):
+            continue
+        out[coll] = (fields + (MC_FIELDS.get(coll, []) if is_mc else []), OPTIONAL_FIELDS.get(coll, []))
+    return out
+
+
+def rebuild_root(events, is_mc, dataset_name):
+    '''Zip the flat branches of a ROOT skim (BaseSchema events) into the analysis collections, in place.'''
+    present = set(events.fields)
+    for coll, (required, optional) in _wanted(is_mc, dataset_name).items():
+        fields = required + [f for f in optional if f"{coll}_{f}" in present]
+        events[coll] = ak.zip({f: events[f"{coll}_{f}"] for f in fields})
+    return events
+
+
+def root_branches(keys, is_mc, dataset_name):
+    '''Branches of a ROOT skim (Events `keys`) the analysis reads: SCALARS and <coll>_<field>.'''
+    keys = set(keys)
+    names = [s for s in SCALARS if s in keys]
+    for coll, (required, optional) in _wanted(is_mc, dataset_name).items():
+        names += [f"{coll}_{f}" for f in required] + [f"{coll}_{f}" for f in optional if f"{coll}_{f}" in keys]
+    return names
+
+
+def load_root(tree, is_mc, dataset_name, entry_start=None, entry_stop=None, branches=None):
+    '''
+    Events [entry_start, entry_stop) of an open ROOT skim tree, read eagerly (only `branches`,
+    default root_branches) and zipped into the analysis collections.
+    '''
+    branches = branches or root_branches(tree.keys(), is_mc, dataset_name)
+    events = tree.arrays(branches, entry_start=entry_start, entry_stop=entry_stop)
+    return rebuild_root(events, is_mc, dataset_name)
+
+
+def num_entries(path):
+    '''Events entries of a ROOT or Parquet skim (headers / footer only).'''
+    if is_parquet(path):
+        return read_meta_parquet(path)["entries"]
+    import uproot
+
+    with uproot.open(path, timeout=300) as f:
+        return f["Events"].num_entries
+
+#----------------------------------------------------------------------------------------------------------------------------------------------
+
+def parquet_columns(path, is_mc, dataset_name):
+    '''Column projection ("Jet.pt", ..., "run") of a Parquet skim; raises if a required field is missing.'''
+    available = set(ak.metadata_from_parquet(path)["form"].columns())
+    cols, missing = [c for c in SCALARS if c in available], []
+    for coll, (required, optional) in _wanted(is_mc, dataset_name).items():
+        missing += [f"{coll}.{f}" for f in required if f"{coll}.{f}" not in available]
+        cols += [f"{coll}.{f}" for f in required + optional if f"{coll}.{f}" in available]
+    if missing:
+        raise KeyError(f"[SKIM-IO] {path} lacks {missing}")
+    return cols
+
+
+def _unmask(layout):
+    '''Drop the UnmaskedArray (no missing values) awkward wraps around a struct read with a column subset; zero-copy.'''
+    if isinstance(layout, ak.contents.UnmaskedArray):
+        return _unmask(layout.content)
+    if isinstance(layout, ak.contents.ListOffsetArray):
+        return ak.contents.ListOffsetArray(layout.offsets, _unmask(layout.content), parameters=layout.parameters)
+    if isinstance(layout, ak.contents.RecordArray):
+        return ak.contents.RecordArray([_unmask(c) for c in layout.contents], layout.fields,
+                                       length=None if layout.contents else layout.length, parameters=layout.parameters)
+    return layout
+
+
+def unmask(events):
+    '''Events read with a column subset, without the UnmaskedArray wrappers (also on dask-awkward typetracers).'''
+    return ak.Array(_unmask(events.layout))
+
+
+def load_parquet(path, is_mc, dataset_name, entry_start=None, entry_stop=None, columns=None):
+    '''Events of a Parquet skim as records (entries [entry_start, entry_stop) if given).'''
+    columns = columns or parquet_columns(path, is_mc, dataset_name)
+    if entry_start is None and entry_stop is None:
+        return unmask(ak.from_parquet(path, columns=columns))
+
+    counts = np.asarray(ak.metadata_from_parquet(path)["col_counts"], dtype=np.int64)
+    edges  = np.concatenate([[0], np.cumsum(counts)])
+    start  = 0 if entry_start is None else entry_start
+    stop   = int(edges[-1]) if entry_stop is None else min(entry_stop, int(edges[-1]))
+    groups = [g for g in range(len(counts)) if edges[g] < stop and edges[g + 1] > start]
+    if not groups:
+        return ak.from_parquet(path, columns=columns)[0:0]
+    events = unmask(ak.from_parquet(path, columns=columns, row_groups=groups))
+    offset = int(edges[groups[0]])
+    return events[start - offset:stop - offset]
+
+
+def read_meta_parquet(path):
+    '''{"nEvents", "sumGenWeight", "corrVersion", "entries", "size"} of a Parquet skim (footer only).'''
+    import fsspec
+    import pyarrow.parquet as pq
+
+    fs, fpath = fsspec.core.url_to_fs(path)
+    with fs.open(fpath, "rb") as f:
+        md = pq.read_metadata(f)
+    meta = json.loads((md.metadata or {}).get(META_KEY, b"{}"))
+    meta["entries"] = md.num_rows
+    meta["size"] = int(fs.size(fpath))
+    return meta
+
+
+def write_parquet(out, path, meta, row_group_size=ROW_GROUP_SIZE, compression="zstd"):
+    '''
+    Write a skim dict ({"run": array, "Jet": record array, ...}) as one record per event,
+    row groups of `row_group_size` events, and `meta` (nEvents, sumGenWeight, corrVersion) in the
+    key-value metadata.
+    '''
+    import pyarrow.parquet as pq
+
+    events = ak.zip(dict(out), depth_limit=1)
+    # plain Arrow types (no awkward extension types), so that a column subset can be read back
+    table  = ak.to_arrow_table(events, extensionarray=False)
+    table  = table.replace_schema_metadata({**(table.schema.metadata or {}), META_KEY: json.dumps(meta).encode()})
+    # no dictionary encoding: physics floats hardly repeat, it costs a third more space
+    pq.write_table(table, path, row_group_size=row_group_size, compression=compression, use_dictionary=False)
+    print(f"[SKIM-IO] Wrote {len(events)} events to {path} ({os.path.getsize(path) / 2**20:.1f} MB, "
+          f"{table.num_rows and -(-table.num_rows // row_group_size)} row groups)")
@@ -0,0 +1,245 @@
+import os
+import re
+import json
+import math
+import argparse
+
+# Cost-model job splitting for the submitters.
+# One job per file gives jobs of seconds (small QCD skims) next to jobs hitting the `workday`
+# limit (large TTbar files). Instead every dataset is cut into units - a whole file, or an entry
+# range of a file with more events than one job should process - and the units are packed
+# (first-fit decreasing) into jobs of about `target` seconds, with
+#   cost(job) = JOB_OVERHEAD + sum over units (UNIT_OVERHEAD + events / rate).
+# Events per file come from the catalogue (`count` / `scan`), else nevents / nfiles of the dataset
+# (files with an estimated count are packed whole, never cut into ranges). Rates (events/s) are
+# kept per stage and per process JSON ("dataset type") in throughput.json and measured from the
+# --profile sidecars of earlier jobs:
+#
+#   python -m utils.splitting measure --stage analysis outputs/*.profile.json
+#   python -m utils.splitting plan --stage analysis --catalogue catalogue.db "TT*.json"
+#
+# A job is a spec string, e.g. "3+4+5" (three whole files) or "7:0-250000" (entries [0, 250000)
+# of file 7). run_analysis.sh / run_skimming.sh run its units one after the other and name the
+# outputs <dataset>_<idx>.root, or <dataset>_<idx>-<start>.root for a range.
+
+STAGES        = ("skim", "analysis")
+DEFAULT_RATES = {"skim": 300.0, "analysis": 1500.0}   # events/s when nothing is measured
+JOB_OVERHEAD  = 120.0          # s per job: sandbox transfer, untar, proxy
+UNIT_OVERHEAD = 30.0           # s per unit: python start-up, corrections/BDT loading, file open
+TARGET_WALL   = 4 * 3600.0     # s; half of the `workday` flavour
+RATES_FILE    = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "throughput.json")
+
+#----------------------------------------------------------------------------------------------------------------------------------------------
+
+def dataset_type(json_name):
+    '''Cost-model key of a dataset: the stem of its process JSON (TTbar, QCD_Bin-PT, DATA_Muon0, ...).'''
+    return os.path.splitext(os.path.basename(json_name))[0]
+
+
+class CostModel:
+    '''
+    model = CostModel.load("analysis")             # throughput.json, DEFAULT_RATES otherwise
+    model.rate("TTbar")                             # events/s
+    model.cost("TTbar", 250000)                     # s for one unit of 250k events
+    '''
+
+    def __init__(self, stage, rates=None, job_overhead=JOB_OVERHEAD, unit_overhead=UNIT_OVERHEAD):
+        if stage not in STAGES:
+            raise ValueError(f"[SPLIT] Unknown stage '{stage}'")
+        self.stage         = stage
+        self.rates         = dict(rates or {})
+        self.job_overhead  = job_overhead
+        self.unit_overhead = unit_overhead
+
+    @classmethod
+    def load(cls, stage, path=RATES_FILE, **kwargs):
+        rates = {}
+        if path and os.path.exists(path):
+            with open(path) as f:
+                rates = json.load(f).get(stage, {})
+        return cls(stage, rates, **kwargs)
+
+    def rate(self, dtype):
+        return self.rates.get(dtype) or self.rates.get("default") or DEFAULT_RATES[self.stage]
+
+    def cost(self, dtype, events):
+        return self.unit_overhead + events / self.rate(dtype)
+
+    def max_events(self, dtype, target):
+        '''Events one job can process within `target` seconds (at least 1).'''
+        return max(1, int((target - self.job_overhead - self.unit_overhead) * self.rate(dtype)))
+
+#----------------------------------------------------------------------------------------------------------------------------------------------
+
+def file_events(counts, nevents_total=None):
+    '''
+    counts: {idx: events or None} of one dataset (Catalogue.counts, or {i: None} from a JSON).
+    Returns [(idx, events, known)], unknown counts estimated as nevents_total / nfiles.
+    '''
+    n = len(counts)
+    known = [c for c in counts.values() if c is not None]
+    if known:
+        fallback = sum(known) / len(known)
+    elif nevents_total:
+        fallback = float(nevents_total) / max(n, 1)
+    else:
+        fallback = 0.0
+    return [(i, c if c is not None else int(fallback), c is not None) for i, c in sorted(counts.items())]
+
+
+def make_units(files, max_events, split=True):
+    '''
+    (idx, start, stop, events) units: whole files (start = stop = None), and equal entry ranges of
+    at most `max_events` for files with a known count above it when `split` is set.
+    '''
+    units = []
+    for idx, n, known in files:
+        if split and known and n > max_events:
+            parts = math.ceil(n / max_events)
+            edges = [round(k * n / parts) for k in range(parts + 1)]
+            units += [(idx, a, b, b - a) for a, b in zip(edges[:-1], edges[1:])]
+        else:
+            units.append((idx, None, None, n))
+    return units
+
+
+def pack(units, cost, target, job_overhead=JOB_OVERHEAD):
+    '''
+    First-fit decreasing: jobs (lists of units) whose job_overhead + sum(cost(unit)) stays within
+    `target` where possible; a unit costlier than `target` gets a job of its own.
+    '''
+    jobs, loads = [], []
+    for u in sorted(units, key=cost, reverse=True):
+        c = cost(u)
+        for j, load in enumerate(loads):
+            if load + c <= target:
+                jobs[j].append(u)
+                loads[j] += c
+                break
+        else:
+            jobs.append([u])
+            loads.append(job_overhead + c)
+    jobs = [sorted(j, key=lambda u: (u[0], u[1] or 0)) for j in jobs]
+    order = sorted(range(len(jobs)), key=lambda j: (jobs[j][0][0], jobs[j][0][1] or 0))
+    return [jobs[j] for j in order], [loads[j] for j in order]
+
+
+def plan(dtype, counts, nevents_total, model, target=TARGET_WALL, split=True):
+    '''Units of one dataset, ready for pack(); see file_events / make_units.'''
+    return make_units(file_events(counts, nevents_total), model.max_events(dtype, target), split=split)
+
+#----------------------------------------------------------------------------------------------------------------------------------------------
+
+def unit_str(unit):
+    idx, start, stop = unit[:3]
+    return f"{idx}" if start is None else f"{idx}:{start}-{stop}"
+
+def job_spec(units):
+    '''"3+4+7:0-250000" for condor arguments / joblists.'''
+    return "+".join(unit_str(u) for u in units)
+
+def parse_spec(spec):
+    '''Inverse of job_spec: [(idx, start, stop)].'''
+    out = []
+    for tok in spec.split("+"):
+        idx, _, rng = tok.partition(":")
+        if rng:
+            a, _, b = rng.partition("-")
+            out.append((int(idx), int(a), int(b)))
+        else:
+            out.append((int(idx), None, None))
+    return out
+
+def unit_suffix(unit):
+    '''Output suffix of a unit: "<idx>" or "<idx>-<start>" (matches run_analysis.sh / run_skimming.sh).'''
+    idx, start = unit[0], unit[1]
+    return f"{idx}" if start is None else f"{idx}-{start}"
+
+#----------------------------------------------------------------------------------------------------------------------------------------------
+
+_FLAVOUR_SUFFIX = re.compile(r"_tt(LF|CC|BB)$")
+
+def measure(paths, type_of):
+    '''
+    {dataset type: events/s} from profile sidecars named <dataset>_<suffix>.profile.json.
+    The events of a job are the n_in of the "weights" stage, the one every processor marks once per
+    chunk (other stages may be marked once per category), its time the summed stage wall time. `type_of` maps a dataset key (or sample name) to its type.
+    '''
+    from utils.profiling import StageProfile
+
+    events, wall = {}, {}
+    for p in paths:
+        key = _FLAVOUR_SUFFIX.sub("", os.path.basename(p).split(".profile")[0].rsplit("_", 1)[0])
+        dtype = type_of.get(key)
+        if dtype is None:
+            print(f"[SPLIT] No dataset type for {p}, skipped")
+            continue
+        prof = StageProfile.from_json(p)
+        events[dtype] = events.get(dtype, 0) + prof.get("weights", {}).get("n_in", 0)
+        wall[dtype]   = wall.get(dtype, 0) + sum(r["wall"] for r in prof.values())
+    return {t: events[t] / wall[t] for t in sorted(events) if wall[t] > 0 and events[t] > 0}
+
+
+def save_rates(rates, stage, path=RATES_FILE):
+    '''Merge measured rates of `stage` into throughput.json.'''
+    data = {}
+    if os.path.exists(path):
+        with open(path) as f:
+            data = json.load(f)
+    data.setdefault(stage, {}).update({k: round(v, 1) for k, v in rates.items()})
+    with open(path, "w") as f:
+        json.dump(data, f, indent=4, sort_keys=True)
+    print(f"[SPLIT] {len(rates)} {stage} rates written to {path}")
+
+#----------------------------------------------------------------------------------------------------------------------------------------------
+
+def main():
+    from utils.catalogue import Catalogue, process_jsons
+
+    parser = argparse.ArgumentParser(description="Cost-model job splitting")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+
+    p = sub.add_parser("measure", help="events/s per dataset type from --profile sidecars")
+    p.add_argument("sidecars", nargs="+")
+    p.add_argument("--stage", choices=STAGES, default="analysis")
+    p.add_argument("--datasets", default="datasets")
+    p.add_argument("--catalogue", default=None)
+    p.add_argument("--out", default=RATES_FILE)
+
+    p = sub.add_parser("plan", help="print the jobs the submitters would create")
+    p.add_argument("pattern", nargs="?", default="*.json")
+    p.add_argument("--stage", choices=STAGES, default="analysis")
+    p.add_argument("--datasets", default="datasets")
+    p.add_argument("--catalogue", default=None)
+    p.add_argument("--target", type=float, default=TARGET_WALL, help="target wall time per job [s]")
+    args = parser.parse_args()
+
+    if args.cmd == "measure":
+        type_of = {}
+        for name, data, _ in process_jsons(args.datasets, stage=args.stage, catalogue=args.catalogue):
+            for key, info in data.items():
+                type_of[key] = dataset_type(name)
+                type_of[os.path.basename(info["metadata"].get("sample", key))] = dataset_type(name)
+        rates = measure(args.sidecars, type_of)
+        for t, r in rates.items():
+            print(f"{t:40} {r:12.1f} ev/s")
+        save_rates(rates, args.stage, args.out)
+        return
+
+    model = CostModel.load(args.stage)
+    cat = Catalogue(args.catalogue, readonly=True) if args.catalogue else None
+    print(f"{'dataset':60} {'files':>6} {'jobs':>6} {'max[h]':>8} {'mean[h]':>8}")
+    for name, data, _ in process_jsons(args.datasets, args.pattern, stage=args.stage, catalogue=args.catalogue):
+        dtype = dataset_type(name)
+        for key, info in data.items():
+            counts = cat.counts(key, args.stage) if cat else {i: None for i in range(len(info["files"]))}
+            units = plan(dtype, counts, info["metadata"].get("nevents"), model, args.target)
+            jobs, loads = pack(units, lambda u: model.cost(dtype, u[3]), args.target, model.job_overhead)
+            if jobs:
+                print(f"{key:60} {len(counts):6d} {len(jobs):6d} {max(loads) / 3600:8.2f} {sum(loads) / len(loads) / 3600:8.2f}")
+    if cat:
+        cat.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+import numpy as np
+import awkward as ak
+
+# Index-carrying views over event collections.
+# `jets[mask_a][mask_b]` copies every field of every jet twice; a View instead composes the
+# successive selections into one event-index array and gathers a field only when it is read,
+# once, for the final index (`v.pt` -> jets.pt[idx]). Helpers that only read attributes
+# (make_vector, trans_massW, ...) accept a View directly; code that needs a real ak.Array
+# (row loops, ak.combinations, behaviours) calls .materialize().
+
+
+def _as_index(sel, n):
+    '''Boolean mask or integer index (numpy or awkward) -> int64 index into n rows.'''
+    sel = ak.to_numpy(sel) if isinstance(sel, ak.Array) else np.asarray(sel)
+    if sel.dtype == bool:
+        if sel.shape[0] != n:
+            raise IndexError(f"[VIEW] boolean selection of length {sel.shape[0]} on {n} rows")
+        return np.flatnonzero(sel)
+    return sel.astype(np.int64, copy=False)
+
+
+class View:
+    '''
+    v = View(jets)                   # nothing copied
+    v = v[mask_step2a][pass_btag]    # row selections compose into one index array
+    v.pt                             # jets.pt[idx], gathered once and cached
+    v[:, 0].eta                      # per-event element k, gathered at use
+    v.num()                          # multiplicities from the offsets only
+    v.materialize()                  # jets[idx] as a regular ak.Array
+    '''
+
+    __slots__ = ("_coll", "_idx", "_item", "_cache")
+
+    def __init__(self, coll, idx=None, item=None):
+        self._coll  = coll
+        self._idx   = idx
+        self._item  = item
+        self._cache = {}
+
+    def __len__(self):
+        return len(self._coll) if self._idx is None else len(self._idx)
+
+    @property
+    def index(self):
+        '''Event indices into the original collection.'''
+        return np.arange(len(self._coll)) if self._idx is None else self._idx
+
+    @property
+    def base(self):
+        '''(collection, element) the view reads from; together with index it identifies the rows.'''
+        return self._coll, self._item
+
+    @property
+    def fields(self):
+        return ak.fields(self._coll)
+
+    def select(self, sel):
+        local = _as_index(sel, len(self))
+        idx = local if self._idx is None else self._idx[local]
+        return View(self._coll, idx, self._item)
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            return self._field(key)
+        if isinstance(key, tuple) and len(key) == 2 and key[0] == slice(None) and self._item is None:
+            return View(self._coll, self._idx, key[1])
+        return self.select(key)
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        try:
+            return self._field(name)
+        except Exception as e:
+            raise AttributeError(name) from e
+
+    def _field(self, name):
+        x = self._cache.get(name)
+        if x is None:
+            x = self._coll[name]
+            if self._idx is not None:
+                x = x[self._idx]
+            if self._item is not None:
+                x = x[:, self._item]
+            self._cache[name] = x
+        return x
+
+    def num(self):
+        '''Objects per selected event (counts come from the offsets; no field data is copied).'''
+        if self._item is not None:
+            raise TypeError("[VIEW] num() on a per-event element view")
+        n = ak.num(self._coll, axis=1)
+        return n if self._idx is None else n[self._idx]
+
+    def materialize(self):
+        x = self._coll if self._idx is None else self._coll[self._idx]
+        return x if self._item is None else x[:, self._item]
+
+
+def view(coll, sel=None):
+    '''View over `coll`, optionally already restricted to `sel` (mask or index).'''
+    v = View(coll)
+    return v if sel is None else v.select(sel)
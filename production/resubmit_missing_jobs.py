@@ -1,7 +1,10 @@
 #!/usr/bin/env python3
 
-import subprocess
 import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "analysis"))
+from utils.output_index import index_dirs, validate_files, to_url
 
 # === Configuration ===
 EOS_BASE = "/eos/user/a/ataxeidi/prod"
@@ -9,6 +12,8 @@ EOS_XRDFS = "root://eosuser.cern.ch"
 EVENTS_PER_JOB = 500
 TOTAL_JOBS = 500
 OUTPUT_DIR = os.getcwd()
+# Set VALIDATE=1 to also open existing outputs and drop truncated ones
+VALIDATE = os.environ.get("VALIDATE", "0") == "1"
 
 # List of processes
 PROCESSES = [
@@ -54,39 +59,41 @@ request_memory = 12000
 
 missing_jobs = []
 
+eos_paths = {proc: f"{EOS_BASE}/{proc}" for proc in PROCESSES}
+index = index_dirs(eos_paths.values(), server=EOS_XRDFS)
+
+existing_files = {}
 for proc in PROCESSES:
-    eos_path = f"{EOS_BASE}/{proc}"
+    files = index[eos_paths[proc]]
+    if files is None:
+        print(f" Could not access EOS folder: {eos_paths[proc]}")
+        continue
+    existing_files[proc] = {}
+    for basename in files:
+        if basename.endswith(".root") and basename.startswith(proc):
+            idx = basename.replace(f"{proc}_", "").replace(".root", "")
+            if idx.isdigit():
+                existing_files[proc][int(idx)] = basename
+
+if VALIDATE:
+    urls = {to_url(eos_paths[proc], name, EOS_XRDFS): (proc, idx)
+            for proc, found in existing_files.items() for idx, name in found.items()}
+    for url, nevt in validate_files(urls, tree="Events", branch=None).items():
+        if not nevt:
+            proc, idx = urls[url]
+            del existing_files[proc][idx]
+
+for proc, found in existing_files.items():
     print(f"\n Checking EOS for: {proc}")
-
-    try:
-        result = subprocess.run(
-            ["xrdfs", EOS_XRDFS, "ls", eos_path],
-            capture_output=True,
-            text=True,
-            check=True
-        )
-        files = result.stdout.strip().split("\n")
-        existing = set()
-
-        for f in files:
-            basename = os.path.basename(f)
-            if basename.endswith(".root") and basename.startswith(proc):
-                idx = basename.replace(f"{proc}_", "").replace(".root", "")
-                if idx.isdigit():
-                    existing.add(int(idx))
-
-        expected = set(range(TOTAL_JOBS))
-        missing = sorted(expected - existing)
-
-        if missing:
-            print(f"Missing: {len(missing)} jobs")
-            for idx in missing:
-                missing_jobs.append((proc, idx))
-        else:
-            print("All jobs exist")
-
-    except subprocess.CalledProcessError:
-        print(f" Could not access EOS folder: {eos_path}")
+    expected = set(range(TOTAL_JOBS))
+    missing = sorted(expected - set(found))
+
+    if missing:
+        print(f"Missing: {len(missing)} jobs")
+        for idx in missing:
+            missing_jobs.append((proc, idx))
+    else:
+        print("All jobs exist")
 
 # === Write resubmission JDL ===
 resub_jdl = "resubmit_missing_jobs.jdl"
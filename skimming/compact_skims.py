@@ -0,0 +1,254 @@
+#!/usr/bin/env python3
+# Compaction of the per-file skims into analysis-sized files.
+# run_skim.py writes one small LZMA file per NanoAOD file, so an analysis pass pays the XRootD
+# open/seek latency thousands of times and decompresses LZMA on every read. This stage
+# concatenates the skims of a dataset into files of about --target-mb (input bytes), written
+# with a fast codec (ZSTD, ZLIB if zstandard is missing) and large aligned clusters: every
+# uproot `extend` is one basket per branch over the same entry range, so the input is buffered
+# to --cluster-mb of uncompressed arrays per extend. Meta keeps one entry with the summed
+# nEvents / sumGenWeight (and the common corrVersion), "sources" the merged URLs, and the
+# catalogue's `merged` table then replaces the dataset's skims as analysis input.
+#
+#   python compact_skims.py --catalogue ../analysis/catalogue.db --pattern QCD --server root://eosuser.cern.ch \
+#                           --outdir /eos/user/a/ataxeidi/skim_compact
+#   python compact_skims.py --datasets ../analysis/datasets --pattern "WH*.json" --outdir compact --json-out compact_json
+
+import os
+import sys
+import json
+import argparse
+import tempfile
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import awkward as ak
+import uproot
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "analysis"))
+from utils.catalogue import Catalogue, process_jsons
+from utils.output_index import to_url
+from utils.provenance import input_fingerprints
+
+TARGET_MB  = 2000     # input (compressed) MB per merged file
+CLUSTER_MB = 100      # uncompressed MB of arrays per cluster (one basket per branch)
+STEP_SIZE  = "50 MB"  # read granularity of the input skims
+
+#----------------------------------------------------------------------------------------------------------------------------------------------
+
+def compression(name):
+    name = name.lower()
+    if name == "zstd":
+        try:
+            import zstandard  # noqa: F401
+            return uproot.ZSTD(5)
+        except ImportError:
+            print("[COMPACT] zstandard not available, using ZLIB")
+            return uproot.ZLIB(6)
+    return {"lz4": uproot.LZ4(4), "zlib": uproot.ZLIB(6), "lzma": uproot.LZMA(9)}[name]
+
+
+def group_files(files, target_bytes):
+    '''Consecutive (idx, url, size) files in groups of at most `target_bytes` (at least one file each).'''
+    groups, cur, cur_bytes = [], [], 0
+    for f in files:
+        size = f[2] or 0
+        if cur and cur_bytes + size > target_bytes:
+            groups.append(cur)
+            cur, cur_bytes = [], 0
+        cur.append(f)
+        cur_bytes += size
+    if cur:
+        groups.append(cur)
+    return groups
+
+
+def to_records(arrays):
+    '''
+    Flat skim branches (nJet, Jet_pt, ..., run) -> {"Jet": record array, ..., "run": array}, so that
+    uproot writes back the same nJet / Jet_* layout run_skim.py produced.
+    '''
+    fields = ak.fields(arrays)
+    colls = [f[1:] for f in fields if f.startswith("n") and any(g.startswith(f[1:] + "_") for g in fields)]
+    out, used = {}, set()
+    for c in colls:
+        members = [g for g in fields if g.startswith(c + "_")]
+        out[c] = ak.zip({g[len(c) + 1:]: arrays[g] for g in members})
+        used.update(members)
+        used.add("n" + c)
+    for f in fields:
+        if f not in used:
+            out[f] = arrays[f]
+    return out
+
+
+def _read_meta(f):
+    meta = f["Meta"].arrays(library="np") if "Meta" in f else {}
+    nev  = int(meta["nEvents"].sum()) if "nEvents" in meta else 0
+    sumw = float(meta["sumGenWeight"].sum()) if "sumGenWeight" in meta else 0.0
+    corr = int(meta["corrVersion"][0]) if "corrVersion" in meta else 0
+    return nev, sumw, corr
+
+#----------------------------------------------------------------------------------------------------------------------------------------------
+
+def compact_group(urls, out_path, codec, cluster_bytes=CLUSTER_MB * 2**20, step_size=STEP_SIZE):
+    '''
+    Concatenate the Events of `urls` into `out_path`. Returns {"entries", "nevents", "sumw", "corrVersion"}.
+    Branches missing in some input are dropped (with a warning); corrVersion is kept only if all inputs agree.
+    '''
+    # Pass 1: Meta and branch sets (metadata only)
+    nev, sumw, corrs, branch_sets, n_in = 0, 0.0, set(), [], 0
+    for url in urls:
+        with uproot.open(url, timeout=300) as f:
+            a, b, c = _read_meta(f)
+            nev, sumw = nev + a, sumw + b
+            corrs.add(c)
+            branch_sets.append(set(f["Events"].keys()))
+            n_in += f["Events"].num_entries
+    branches = set.intersection(*branch_sets)
+    dropped = set.union(*branch_sets) - branches
+    if dropped:
+        print(f"[COMPACT] {os.path.basename(out_path).removesuffix('.tmp')}: branches not in every input dropped: {sorted(dropped)}")
+    corr_version = corrs.pop() if len(corrs) == 1 else 0
+    branches = sorted(branches)
+
+    # Pass 2: copy with large clusters
+    written, pending, pending_bytes, tree = 0, [], 0, None
+    with uproot.recreate(out_path, compression=codec) as out:
+        def flush():
+            nonlocal tree, written, pending, pending_bytes
+            chunk = ak.concatenate(pending) if len(pending) > 1 else pending[0]
+            data = to_records(chunk)
+            if tree is None:
+                # explicit TTree (nJet / Jet_* branches), like the skims
+                tree = out.mktree("Events", {k: v.type if isinstance(v, ak.Array) else v.dtype for k, v in data.items()})
+            tree.extend(data)
+            written += len(chunk)
+            pending, pending_bytes = [], 0
+
+        for url in urls:
+            with uproot.open(url, timeout=300) as f:
+                for arrays in f["Events"].iterate(branches, step_size=step_size, library="ak"):
+                    pending.append(arrays)
+                    pending_bytes += arrays.nbytes
+                    if pending_bytes >= cluster_bytes:
+                        flush()
+        if pending:
+            flush()
+
+        out["Meta"] = {"nEvents": np.array([nev], dtype="i8"),
+                       "sumGenWeight": np.array([sumw], dtype="f8"),
+                       "corrVersion": np.array([corr_version], dtype="i8"),
+                       "nFiles": np.array([len(urls)], dtype="i8")}
+        out["sources"] = json.dumps(urls)
+
+    if written != n_in:
+        raise RuntimeError(f"[COMPACT] {out_path}: wrote {written} entries, inputs have {n_in}")
+    return {"entries": written, "nevents": nev, "sumw": sumw, "corrVersion": corr_version}
+
+
+def _place(local, outdir, server, name):
+    '''Move a finished local file to outdir (xrdcp when a server is given). Returns its URL.'''
+    if server:
+        dest = to_url(outdir, name, server)
+        subprocess.run(["xrdcp", "-f", local, dest], check=True)
+        os.remove(local)
+        return dest
+    os.makedirs(outdir, exist_ok=True)
+    dest = os.path.join(outdir, name)
+    os.replace(local, dest)
+    return dest
+
+
+def compact_dataset(key, files, outdir, server, codec, target_bytes, cluster_bytes, workers, tmpdir):
+    '''Compact one dataset; returns the merged rows for Catalogue.set_merged.'''
+    groups = group_files(files, target_bytes)
+    print(f"[COMPACT] {key}: {len(files)} skims -> {len(groups)} files")
+
+    def one(k_group):
+        k, group = k_group
+        name  = f"{key}_merged_{k}.root"
+        local = os.path.join(tmpdir, name) if server else os.path.join(outdir, key, name + ".tmp")
+        os.makedirs(os.path.dirname(local), exist_ok=True)
+        info  = compact_group([u for _, u, _ in group], local, codec, cluster_bytes)
+        size  = os.path.getsize(local)
+        url   = _place(local, f"{outdir}/{key}", server, name)
+        print(f"[COMPACT] {name}: {len(group)} files, {info['entries']} entries, {size / 2**20:.0f} MB")
+        return {"skim_url": url, "size": size, "nevents": info["nevents"], "sumw": info["sumw"],
+                "entries": info["entries"], "sources": [i for i, _, _ in group]}
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(one, enumerate(groups)))
+
+#----------------------------------------------------------------------------------------------------------------------------------------------
+
+def main():
+    parser = argparse.ArgumentParser(description="Concatenate per-file skims into analysis-sized files")
+    src = parser.add_mutually_exclusive_group(required=True)
+    src.add_argument("--catalogue", help="SQLite catalogue (skim URLs/sizes from its files table; merged table updated)")
+    src.add_argument("--datasets", help="directory of analysis process JSONs (file lists = skim URLs)")
+    parser.add_argument("--pattern", default=None, help="regex on dataset keys (catalogue) / glob on JSON names (--datasets)")
+    parser.add_argument("--outdir", required=True, help="output base directory (EOS path with --server)")
+    parser.add_argument("--server", default=None, help="xrootd server to copy the merged files to, e.g. root://eosuser.cern.ch")
+    parser.add_argument("--target-mb", type=float, default=TARGET_MB)
+    parser.add_argument("--cluster-mb", type=float, default=CLUSTER_MB)
+    parser.add_argument("--compression", default="zstd", choices=["zstd", "lz4", "zlib", "lzma"])
+    parser.add_argument("--workers", type=int, default=4, help="merged files written concurrently")
+    parser.add_argument("--json-out", default=None, help="with --datasets: write the process JSONs with the merged file lists here")
+    parser.add_argument("--dry-run", action="store_true", help="only print the grouping")
+    args = parser.parse_args()
+    if args.datasets and not args.json_out and not args.dry_run:
+        parser.error("--datasets needs --json-out to record the merged file lists")
+
+    codec = compression(args.compression)
+    target_bytes, cluster_bytes = args.target_mb * 2**20, args.cluster_mb * 2**20
+
+    # (json_name, key, metadata, [(idx, url, size)])
+    todo = []
+    if args.catalogue:
+        with Catalogue(args.catalogue, readonly=True) as cat:
+            for key in cat.datasets(pattern=args.pattern):
+                skims = cat.skims(key)
+                if skims:
+                    todo.append((None, key, None, [(i, u, s) for i, u, s, _ in skims]))
+    else:
+        for name, data, _ in process_jsons(args.datasets, args.pattern or "*.json"):
+            for key, info in data.items():
+                todo.append((name, key, info["metadata"], [(i, u, None) for i, u in enumerate(info["files"])]))
+
+    # Sizes unknown to the catalogue / JSONs: one concurrent stat pass
+    unknown = [u for _, _, _, files in todo for _, u, s in files if s is None]
+    if unknown:
+        fps = input_fingerprints(unknown)
+        todo = [(n, k, m, [(i, u, s if s is not None else fps[u]["size"]) for i, u, s in files]) for n, k, m, files in todo]
+
+    if args.dry_run:
+        for _, key, _, files in todo:
+            groups = group_files(files, target_bytes)
+            print(f"{key:60} {len(files):6d} skims -> {len(groups):4d} files")
+        return
+
+    merged = {}
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for _, key, _, files in todo:
+            merged[key] = compact_dataset(key, files, args.outdir, args.server, codec,
+                                          target_bytes, cluster_bytes, args.workers, tmpdir)
+
+    if args.catalogue:
+        with Catalogue(args.catalogue) as cat:
+            for key, rows in merged.items():
+                cat.set_merged(key, rows)
+        print(f"[COMPACT] Catalogue updated: {len(merged)} datasets now read from the merged files")
+    elif args.json_out:
+        os.makedirs(args.json_out, exist_ok=True)
+        out = {}
+        for name, key, meta, _ in todo:
+            out.setdefault(name, {})[key] = {"metadata": meta, "files": [r["skim_url"] for r in merged[key]]}
+        for name, data in out.items():
+            with open(os.path.join(args.json_out, name), "w") as f:
+                json.dump(data, f, indent=4)
+        print(f"[COMPACT] {len(out)} process JSONs written to {args.json_out}")
+
+
+if __name__ == "__main__":
+    main()
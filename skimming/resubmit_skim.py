@@ -1,75 +1,110 @@
 #!/usr/bin/env python3
 import subprocess
 import os
-import json
-import glob
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "analysis"))
+from utils.output_index import index_dirs, validate_files, to_url
+from utils.catalogue import Catalogue, process_jsons
+from utils.splitting import CostModel, TARGET_WALL, dataset_type, plan, pack, job_spec
 
 DATASET_DIR = "datasets"
-FILES_TO_TRANSFER = ["run_skim.py", "skim_processor.py", "x509up", "run_skimming.sh", "skim_config.py"]
+FILES_TO_TRANSFER = ["run_skim.py", "skim_processor.py", "x509up", "run_skimming.sh", "skim_config.py", "../analysis/utils"]
 base_eos_dir = "/eos/user/a/ataxeidi/skim"
+EOS_XRDFS = "root://eosuser.cern.ch"
+# Set VALIDATE=1 to read Meta/nEvents of existing skims and resubmit truncated ones
+VALIDATE = os.environ.get("VALIDATE", "0") == "1"
+# CATALOGUE=catalogue.db: datasets from the SQLite catalogue, jobs get it as --json and it records the resubmission
+CATALOGUE = os.environ.get("CATALOGUE")
+# Missing files are packed into jobs like in submit_all.py (SPLIT, TARGET_HOURS)
+SPLIT  = os.environ.get("SPLIT", "1") == "1"
+# SKIM_FORMAT=parquet: the jobs write Parquet skims (run_skim.py --format parquet)
+SKIM_FORMAT = os.environ.get("SKIM_FORMAT", "root")
+TARGET = float(os.environ.get("TARGET_HOURS", TARGET_WALL / 3600)) * 3600
+model  = CostModel.load("skim")
+
+datasets, dtypes = [], {}
+for json_name, data, json_path in process_jsons(DATASET_DIR, stage="skim", catalogue=CATALOGUE):
+    job_json = os.path.basename(json_path)
+    for dataset_key, dataset_info in data.items():
+        datasets.append((job_json, dataset_key, dataset_info))
+        dtypes[dataset_key] = dataset_type(json_name)
+counts = {}
+if CATALOGUE:
+    with Catalogue(CATALOGUE, readonly=True) as cat:
+        counts = {key: cat.counts(key, "skim") for _, key, _ in datasets}
 
-json_files = sorted(glob.glob(f"{DATASET_DIR}/*.json"))
+# List all dataset directories in one concurrent pass
+index = index_dirs([f"{base_eos_dir}/{key}" for _, key, _ in datasets], server=EOS_XRDFS)
 
-for json_path in json_files:
-    json_name = os.path.basename(json_path)
-    with open(json_path) as jf:
-        data = json.load(jf)
+existing_files = {}
+for json_name, dataset_key, dataset_info in datasets:
+    eos_dataset_path = f"{base_eos_dir}/{dataset_key}"
+    files = index[eos_dataset_path]
+    if files is None:
+        print(f"WARNING: EOS path not found: {eos_dataset_path}")
+        files = []
 
-    for dataset_key, dataset_info in data.items():
-        n_expected_jobs = len(dataset_info["files"])
-        eos_dataset_path = f"{base_eos_dir}/{dataset_key}"
+    found = {}
+    for f in files:
+        if f.endswith(f".{SKIM_FORMAT}") and dataset_key in f:
+            try:
+                found[int(f.split("_")[-1].replace(f".{SKIM_FORMAT}", ""))] = to_url(eos_dataset_path, f, EOS_XRDFS)
+            except ValueError:
+                continue
+    existing_files[dataset_key] = found
 
-        print(f"\nChecking missing jobs for: {dataset_key} (from {json_name})")
+if VALIDATE:
+    urls = {url: (key, idx) for key, found in existing_files.items() for idx, url in found.items()}
+    for url, nevt in validate_files(urls).items():
+        if nevt is None:
+            key, idx = urls[url]
+            del existing_files[key][idx]
 
-        try:
-            result = subprocess.run(
-                ["xrdfs", "root://eosuser.cern.ch", "ls", eos_dataset_path],
-                capture_output=True, text=True, check=True
-            )
-            files = result.stdout.strip().split("\n")
-        except subprocess.CalledProcessError:
-            print(f"WARNING: EOS path not found: {eos_dataset_path}")
-            files = []
+for json_name, dataset_key, dataset_info in datasets:
+    n_expected_jobs = len(dataset_info["files"])
+    print(f"\nChecking missing jobs for: {dataset_key} (from {json_name})")
+    existing = set(existing_files[dataset_key])
 
-        existing = set()
-        for f in files:
-            if f.endswith(".root") and dataset_key in f:
-                try:
-                    idx = int(f.split("_")[-1].replace(".root", ""))
-                    existing.add(idx)
-                except ValueError:
-                    continue
+    expected = set(range(n_expected_jobs))
+    missing = sorted(expected - existing)
+    print(f"Found {len(missing)} missing files.")
 
-        expected = set(range(n_expected_jobs))
-        missing = sorted(expected - existing)
-        print(f"Found {len(missing)} missing jobs.")
+    if not missing:
+        continue
 
-        if not missing:
-            continue
+    dtype = dtypes[dataset_key]
+    known = counts.get(dataset_key, {})
+    units = plan(dtype, {i: known.get(i) for i in missing}, dataset_info["metadata"].get("nevents"), model, TARGET, split=False)
+    jobs = pack(units, lambda u: model.cost(dtype, u[3]), TARGET, model.job_overhead)[0] if SPLIT else [[u] for u in units]
 
-        # Write JDL for missing jobs
-        jdl_file = f"resubmit_missing_{dataset_key}.jdl"
-        with open(jdl_file, "w") as f:
-            f.write("universe = vanilla\n")
-            f.write("executable = run_skimming.sh\n")
-            f.write(f"transfer_input_files = {', '.join(FILES_TO_TRANSFER)}, {json_name}\n")
-            f.write("should_transfer_files = YES\n")
-            f.write("when_to_transfer_output = ON_EXIT\n")
-            f.write('+SingularityImage = "/cvmfs/unpacked.cern.ch/registry.hub.docker.com/coffeateam/coffea-dask:latest"\n')
-            f.write("+SingularityBindCVMFS = True\n")
-            f.write("+JobFlavour = \"workday\"\n")
-            f.write("request_cpus = 1\n")
-            f.write("request_memory = 3000\n")
-            f.write('environment = "X509_USER_PROXY=x509up"\n')
-            f.write("X509 = x509up\n\n")
+    # Write JDL for missing jobs
+    jdl_file = f"resubmit_missing_{dataset_key}.jdl"
+    with open(jdl_file, "w") as f:
+        f.write("universe = vanilla\n")
+        f.write("executable = run_skimming.sh\n")
+        f.write(f"transfer_input_files = {', '.join(FILES_TO_TRANSFER)}, {json_name}\n")
+        f.write("should_transfer_files = YES\n")
+        f.write("when_to_transfer_output = ON_EXIT\n")
+        f.write('+SingularityImage = "/cvmfs/unpacked.cern.ch/registry.hub.docker.com/coffeateam/coffea-dask:latest"\n')
+        f.write("+SingularityBindCVMFS = True\n")
+        f.write("+JobFlavour = \"workday\"\n")
+        f.write("request_cpus = 1\n")
+        f.write("request_memory = 3000\n")
+        f.write(f'environment = "X509_USER_PROXY=x509up SKIM_FORMAT={SKIM_FORMAT}"\n')
+        f.write("X509 = x509up\n\n")
 
-            for idx in missing:
-                f.write(f"""arguments = {idx} {json_name} {dataset_key}
+        for job in jobs:
+            idx = job[0][0]
+            f.write(f"""arguments = {job_spec(job)} {json_name} {dataset_key}
 output = out/job_$(Cluster)_{idx}_{dataset_key}.out
 error  = err/job_$(Cluster)_{idx}_{dataset_key}.err
 log    = log/job_$(Cluster)_{idx}_{dataset_key}.log
 queue 1
 
 """)
-        print(f"Created: {jdl_file}")
-        subprocess.run(["condor_submit", jdl_file])
+    print(f"Created: {jdl_file}")
+    res = subprocess.run(["condor_submit", jdl_file])
+    if CATALOGUE and res.returncode == 0:
+        with Catalogue(CATALOGUE) as cat:
+            cat.set_status([(dataset_key, i) for i in missing], "skim", "submitted")
@@ -1,5 +1,4 @@
 import uproot
-import time
 import awkward as ak
 import warnings
 import numpy as np
@@ -9,6 +8,10 @@ import argparse
 from coffea.nanoevents import NanoEventsFactory, NanoAODSchema
 from skim_processor import NanoAODSkimmer
 from skim_config import branches_to_keep, trigger_groups, met_filter_flags
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "analysis"))
+from utils.catalogue import Catalogue, is_catalogue
+from utils.remote import RemoteReader
 # Suppress warnings about missing cross-reference indices
 from collections.abc import Mapping
 warnings.filterwarnings("ignore", message="Missing cross-reference index")
@@ -19,26 +22,33 @@ def resolve_for_uproot(array):
     return array
 # Input NanoAOD json
 parser = argparse.ArgumentParser()
-parser.add_argument("--json", type=str, required=True, help="Path to JSON file")
+parser.add_argument("--json", type=str, required=True, help="Path to JSON file (or SQLite catalogue .db)")
 parser.add_argument("--job-index", type=int, required=True, help="Index of file to process")
 parser.add_argument("--output", type=str, default="skimmed_output.root")
 parser.add_argument("--dataset", type=str, required=True, help="Key in the JSON to process")
+parser.add_argument("--corrections", action="store_true", help="Also write the corrected Electron/Jet/PuppiMET *_corr branches (analysis STEP 2-4)")
+parser.add_argument("--format", choices=["root", "parquet"], default="root", help="Skim file format (parquet: nested collections, zero-copy loading in run_analysis.py)")
+parser.add_argument("--row-group-size", type=int, default=None, help="Events per Parquet row group (default: utils/skim_io.py ROW_GROUP_SIZE)")
+parser.add_argument("--corrections-dir", type=str, default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "corrections"))
 args = parser.parse_args()
-with open(args.json) as f:
-    all_datasets = json.load(f)
-
-
-if args.dataset not in all_datasets:
-    raise ValueError(f"Dataset {args.dataset} not found in {args.json}")
 dataset_name = args.dataset
-dataset = all_datasets[dataset_name]
-meta = dataset["metadata"]
-files = dataset["files"]
-
-if args.job_index >= len(files):
-    raise IndexError(f"Index {args.job_index} out of range: {len(files)}")
-
-file_to_process = files[args.job_index]
+if is_catalogue(args.json):
+    with Catalogue(args.json, readonly=True) as cat:
+        file_to_process, meta = cat.job(dataset_name, args.job_index, stage="skim")
+else:
+    with open(args.json) as f:
+        all_datasets = json.load(f)
+
+    if args.dataset not in all_datasets:
+        raise ValueError(f"Dataset {args.dataset} not found in {args.json}")
+    dataset = all_datasets[dataset_name]
+    meta = dataset["metadata"]
+    files = dataset["files"]
+
+    if args.job_index >= len(files):
+        raise IndexError(f"Index {args.job_index} out of range: {len(files)}")
+
+    file_to_process = files[args.job_index]
 sample_name = meta["sample"]
 nevts = int(meta["nevents"])
 
@@ -59,36 +69,36 @@ if include_genttbarid:
         branches_to_keep["genTtbarId"] = []  # scalar branch
 # Output file
 output_name = args.output
-# Load events
-events = None
-for attempt in range(1, 6):
-    try:
-        print(f"[INFO] Attempt {attempt} to open NanoAOD file")
-        factory = NanoEventsFactory.from_root(
-            file_to_process,
-            schemaclass=NanoAODSchema,
-            uproot_options={"timeout": 200}
-        )
-        events = factory.events()
-        nevents_raw = int(len(events))
-        
-        print(f"[INFO] Successfully loaded {nevents_raw} events.")
-        break
-    except Exception as e:
-        print(f"[WARNING] Attempt {attempt} failed: {e}")
-        if attempt == 5:
-            print("[ERROR] Giving up after 4 attempts.")
-            exit()
-        time.sleep(10)
-
-if events is None:
-    print("[ERROR] Events could not be loaded. Exiting.")
-    exit()
+# Load events: the open is retried with backoff and fails over to other redirectors / a local
+# copy (analysis/utils/remote.py); the lazy basket reads happen in skim_file below, also retried
+def open_events(url):
+    return NanoEventsFactory.from_root(
+        url,
+        schemaclass=NanoAODSchema,
+        uproot_options={"timeout": 200}
+    ).events()
+
+reader = RemoteReader(file_to_process, open_fn=open_events, read_fn=lambda events, start, stop: skim_file(events))
+try:
+    events = reader.open()
+except OSError as e:
+    print(f"[ERROR] Events could not be loaded: {e}")
+    sys.exit(1)
+nevents_raw = int(len(events))
+print(f"[INFO] Successfully loaded {nevents_raw} events.")
 
 # Initialize processor
 
-processor_instance = NanoAODSkimmer(branches_to_keep=branches_to_keep,trigger_groups=trigger_groups,met_filter_flags=met_filter_flags, dataset_name= dataset_name)
-skimmed_output = processor_instance.process(events)
+corrections = None
+corr_version = 0   # 0: no corrected branches in this skim
+if args.corrections:
+    from utils.corrections import Corrections
+    corrections = Corrections.load(args.corrections_dir, is_mc=meta.get("isMC", "true").lower() == "true")
+    corr_version = corrections.version
+    print(f"[INFO] Writing corrected branches, corrVersion {corr_version:015x}")
+
+processor_instance = NanoAODSkimmer(branches_to_keep=branches_to_keep,trigger_groups=trigger_groups,met_filter_flags=met_filter_flags, dataset_name= dataset_name,
+                                    corrections_dir=args.corrections_dir, corrections=corrections)
 
 
 def deeply_materialize(data):
@@ -110,15 +120,37 @@ def deeply_materialize(data):
 
     else:
         return data
-materialized_output = deeply_materialize(skimmed_output)
+
+
+def skim_file(events):
+    '''(sum of generator weights, materialized skim) of the file; every lazy read happens in here.'''
+    # Sum of generator weights before the skim selection (0 for data), kept in Meta for the catalogue
+    sumw = float(ak.sum(events.genWeight)) if "genWeight" in events.fields else 0.0
+    return sumw, deeply_materialize(processor_instance.process(events))
+
+try:
+    sumw_raw, materialized_output = reader.read(0, nevents_raw)
+except OSError as e:
+    print(f"[ERROR] Skimming failed: {e}")
+    sys.exit(1)
+reader.report()
 for k, v in materialized_output.items():
     print(f"[DEBUG] {k}: {type(v)}")
 
-with uproot.recreate(output_name,compression=uproot.LZMA(9)) as rootfile:
-    rootfile["Events"] = materialized_output
-    rootfile["Meta"] = {"nEvents": np.array([nevents_raw], dtype="i8")}
-
-print("[INFO] ROOT file written successfully.")
+if args.format == "parquet":
+    from utils.skim_io import write_parquet, ROW_GROUP_SIZE
+    write_parquet(materialized_output, output_name,
+                  {"nEvents": nevents_raw, "sumGenWeight": sumw_raw, "corrVersion": corr_version},
+                  row_group_size=args.row_group_size or ROW_GROUP_SIZE)
+    print("[INFO] Parquet file written successfully.")
+else:
+    with uproot.recreate(output_name,compression=uproot.LZMA(9)) as rootfile:
+        rootfile["Events"] = materialized_output
+        rootfile["Meta"] = {"nEvents": np.array([nevents_raw], dtype="i8"),
+                            "sumGenWeight": np.array([sumw_raw], dtype="f8"),
+                            "corrVersion": np.array([corr_version], dtype="i8")}
+
+    print("[INFO] ROOT file written successfully.")
 # Write output
 
 print("[INFO] Skimming complete. Output saved successfully.")
@@ -3,20 +3,30 @@
 echo "Running on: $(hostname)"
 echo "Current directory: $(pwd)"
 
-JOBIDX=$1
+# JOBSPEC: file indices of this job, e.g. "3+4+5" (whole files only, see analysis/utils/splitting.py)
+JOBSPEC=$1
 DATASET_JSON=$2
 DATASET_KEY=$3
 
 export X509_USER_PROXY=$(realpath x509up)
+# SKIM_FORMAT=parquet (from the submitters' environment) writes <dataset>_<idx>.parquet
+FORMAT=${SKIM_FORMAT:-root}
 
-OUTFILE=${DATASET_KEY}_${JOBIDX}.root
+STATUS=0
+for JOBIDX in ${JOBSPEC//+/ }; do
+    OUTFILE=${DATASET_KEY}_${JOBIDX}.${FORMAT}
 
-python run_skim.py --job-index ${JOBIDX} --json ${DATASET_JSON} --dataset ${DATASET_KEY} --output ${OUTFILE}
+    if ! python run_skim.py --job-index ${JOBIDX} --json ${DATASET_JSON} --dataset ${DATASET_KEY} --output ${OUTFILE} --format ${FORMAT}; then
+        STATUS=1
+        continue
+    fi
 
-echo "Copying ${OUTFILE} to EOS..."
-xrdcp -f ${OUTFILE} root://eosuser.cern.ch//eos/user/a/ataxeidi/skim/${DATASET_KEY}/${OUTFILE}
+    echo "Copying ${OUTFILE} to EOS..."
+    xrdcp -f ${OUTFILE} root://eosuser.cern.ch//eos/user/a/ataxeidi/skim/${DATASET_KEY}/${OUTFILE} || STATUS=1
 
-rm -f ${OUTFILE}
-echo "Removed local copy: ${OUTFILE}"
+    rm -f ${OUTFILE}
+    echo "Removed local copy: ${OUTFILE}"
+done
 
 echo "Job finished"
+exit ${STATUS}
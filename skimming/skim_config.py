@@ -1,11 +1,12 @@
 branches_to_keep = {
             "Muon": ["pt","eta","phi","charge","tightId","looseId","mass","pfRelIso04_all"],
             "Electron": ["pt","eta","phi","charge","cutBased","mass","pfRelIso03_all",
-                         "seedGain","r9","superclusterEta","mvaIso_WP90"],   
+                         "seedGain","r9","superclusterEta","mvaIso_WP90","pt_corr"],   
             "Jet": ["pt","eta","phi","mass","rawFactor","area","pt_genMatched",
                     "btagUParTAK4probbb","btagUParTAK4B","passJetIdTight","passJetIdTightLepVeto",
-                    "UParTAK4RegPtRawRes","upart_pt_reg","hadronFlavour","partonFlavour"],                  
-            "PuppiMET": ["pt","phi"],
+                    "UParTAK4RegPtRawRes","upart_pt_reg","hadronFlavour","partonFlavour",
+                    "pt_corr","mass_corr"],                  
+            "PuppiMET": ["pt","phi","pt_corr","phi_corr"],   # *_corr only with run_skim.py --corrections
             "Pileup":["nTrueInt","nPU"],
             "PV": ["npvsGood","npvs"],
         }
@@ -13,7 +13,7 @@ def _unflatten_like(flat, counts):
 #----------------------------------------------------------------------------------------------------------------------------#
 
 class NanoAODSkimmer(processor.ProcessorABC):
-    def __init__(self, branches_to_keep, trigger_groups, met_filter_flags, dataset_name=None, corrections_dir=None):
+    def __init__(self, branches_to_keep, trigger_groups, met_filter_flags, dataset_name=None, corrections_dir=None, corrections=None):
         self.branches_to_keep = branches_to_keep
         self.trigger_groups   = trigger_groups
         self.met_filter_flags = met_filter_flags
@@ -22,6 +22,7 @@ class NanoAODSkimmer(processor.ProcessorABC):
         self._jet_veto        = None
         self._jet_veto_type   = "jetvetomap"
         self._loaded_veto     = False
+        self.corrections      = corrections   # utils.corrections.Corrections: also write the *_corr branches
             
 #----------------------------------------------------------------------------------------------------------------------------#
 
@@ -219,6 +220,7 @@ class NanoAODSkimmer(processor.ProcessorABC):
         #======================================================# 
         # ------------------ Object selection -----------------# 
         #======================================================#
+        colls = {}
         for obj in self.branches_to_keep:
             if not hasattr(events, obj):
                 continue
@@ -261,9 +263,47 @@ class NanoAODSkimmer(processor.ProcessorABC):
                     nan_arr = ak.values_astype(ak.ones_like(collection.pt), "float32") * np.nan
                     collection = ak.with_field(collection, nan_arr, "pt_genMatched")  
                         
+            colls[obj] = collection
+
+        if self.corrections is not None:
+            self.add_corrected(colls, out)
+
+        for obj, collection in colls.items():
             out[obj] = self.select_fields(collection, self.branches_to_keep[obj])
         
         return out
 
+#----------------------------------------------------------------------------------------------------------------------------#
+
+    # -- nominal EGM / JEC+JER / Type-1 MET of the analysis, computed once here -- #
+    # Run on the collections exactly as they are written (after the object cuts above), so the
+    # per-object smearing draws are the ones the analysis would make on the skim.
+    # Adds Electron.pt_corr, Jet.pt_corr, Jet.mass_corr, PuppiMET.pt_corr and PuppiMET.phi_corr.
+
+    def add_corrected(self, colls, out):
+        need = ["Electron", "Jet", "Muon", "PuppiMET"]
+        if any(obj not in colls for obj in need) or "fixedGridRhoFastjetAll" not in out:
+            print(f"[Skim:Corr] Need {need} and rho in the skim; corrected branches not written.")
+            return False
+
+        evt = ak.zip({
+            "run": out["run"], "luminosityBlock": out["luminosityBlock"], "event": out["event"],
+            "fixedGridRhoFastjetAll": out["fixedGridRhoFastjetAll"],
+            **{obj: colls[obj] for obj in need},
+        }, depth_limit=1)
+
+        corr = self.corrections
+        ele  = corr.egm(evt)
+        jets, pt_jec, pt_corr = corr.jec_jer(evt)
+        met  = corr.type1_met(evt, ele, pt_jec, pt_corr)
+
+        colls["Electron"] = ak.with_field(colls["Electron"], ele.pt,    "pt_corr")
+        colls["Jet"]      = ak.with_field(colls["Jet"],      jets.pt,   "pt_corr")
+        colls["Jet"]      = ak.with_field(colls["Jet"],      jets.mass, "mass_corr")
+        colls["PuppiMET"] = ak.with_field(colls["PuppiMET"], met.pt,    "pt_corr")
+        colls["PuppiMET"] = ak.with_field(colls["PuppiMET"], met.phi,   "phi_corr")
+        print(f"[Skim:Corr] corrected branches written (corrVersion {corr.version:015x})")
+        return True
+
     def postprocess(self, accumulator):
         return accumulator
@@ -1,62 +1,79 @@
 import os
-import glob
-import json
 import subprocess
+import sys
 
-DATASET_DIR = "datasets"
-FILES_TO_TRANSFER = ["run_skim.py", "skim_processor.py", "x509up", "run_skimming.sh", "skim_config.py"]
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "analysis"))
+from utils.catalogue import Catalogue, process_jsons
+from utils.splitting import CostModel, TARGET_WALL, dataset_type, plan, pack, job_spec
 
-import sys
+DATASET_DIR = "datasets"
+FILES_TO_TRANSFER = ["run_skim.py", "skim_processor.py", "x509up", "run_skimming.sh", "skim_config.py", "../analysis/utils"]
+# CATALOGUE=catalogue.db takes the NanoAOD file lists from the SQLite catalogue instead of datasets/*.json
+CATALOGUE = os.environ.get("CATALOGUE")
+# Files are packed into jobs of about TARGET_HOURS of estimated wall time (whole files only, so
+# every NanoAOD file keeps its one <dataset>_<idx>.root skim); SPLIT=0: one job per file
+SPLIT  = os.environ.get("SPLIT", "1") == "1"
+# SKIM_FORMAT=parquet: the jobs write Parquet skims (run_skim.py --format parquet)
+SKIM_FORMAT = os.environ.get("SKIM_FORMAT", "root")
+TARGET = float(os.environ.get("TARGET_HOURS", TARGET_WALL / 3600)) * 3600
+model  = CostModel.load("skim")
+cat    = Catalogue(CATALOGUE, readonly=True) if CATALOGUE else None
 
 # Accept a file or pattern as an argument, default to all
 pattern = sys.argv[1] if len(sys.argv) > 1 else "*.json"
-json_files = sorted(glob.glob(f"{DATASET_DIR}/{pattern}"))
 
 import re
 
 dataset_key_pattern = os.environ.get("FILTER_KEY")  # to coose running a single dataset of a process json
 
-for json_path in json_files:
-    with open(json_path) as f:
-        data = json.load(f)
-
-    dataset_basename = os.path.basename(json_path)  # e.g., QCD.json
+for dataset_basename, data, json_path in process_jsons(DATASET_DIR, pattern, stage="skim", catalogue=CATALOGUE):
+    job_json = os.path.basename(json_path)  # e.g., QCD.json, or catalogue.db
     print(f"[INFO] Filtering datasets with pattern: {dataset_key_pattern}") if dataset_key_pattern else None
     for dataset_key, dataset_info in data.items():
         if dataset_key_pattern and not re.search(dataset_key_pattern, dataset_key):
             continue
        
     # Copy the file for condor
-    if not os.path.exists(dataset_basename):
-        os.system(f"cp {json_path} {dataset_basename}")
+    if not os.path.exists(job_json):
+        os.system(f"cp {json_path} {job_json}")
 
     joblist_file = f"joblist_{dataset_basename}.txt"
+    dtype = dataset_type(dataset_basename)
+    jobs = []
+    for dataset_key, dataset_info in data.items():
+        if dataset_key_pattern and not re.search(dataset_key_pattern, dataset_key):
+            continue
+        counts = cat.counts(dataset_key, "skim") if cat else {i: None for i in range(len(dataset_info["files"]))}
+        units = plan(dtype, counts, dataset_info["metadata"].get("nevents"), model, TARGET, split=False)
+        packed = pack(units, lambda u: model.cost(dtype, u[3]), TARGET, model.job_overhead)[0] if SPLIT else [[u] for u in units]
+        print(f"[SPLIT] {dataset_key}: {len(units)} files -> {len(packed)} jobs")
+        jobs += [(dataset_key, j) for j in packed]
     with open(joblist_file, "w") as jf:
-        for dataset_key, dataset_info in data.items():
-            if dataset_key_pattern and not re.search(dataset_key_pattern, dataset_key):
-                continue
-            for i in range(len(dataset_info["files"])):
-                jf.write(f"{i} {dataset_basename} {dataset_key}\n")
+        for dataset_key, job in jobs:
+            jf.write(f"{job_spec(job)} {job_json} {dataset_key}\n")
 
     jdl_file = f"submit_{dataset_basename}.jdl"
     with open(jdl_file, "w") as f:
         f.write("universe = vanilla\n")
         f.write("executable = run_skimming.sh\n")
-        f.write("arguments = $(jobindex) $(dataset_json) $(dataset_key)\n")
+        f.write("arguments = $(jobspec) $(dataset_json) $(dataset_key)\n")
         f.write(f"transfer_input_files = {', '.join(FILES_TO_TRANSFER)}, $(dataset_json)\n")
         f.write("should_transfer_files = YES\n")
         f.write("when_to_transfer_output = ON_EXIT\n")
-        f.write("output = out/job_$(Cluster)_$(jobindex)_$(dataset_key).out\n")
-        f.write("error  = err/job_$(Cluster)_$(jobindex)_$(dataset_key).err\n")
-        f.write("log    = log/job_$(Cluster)_$(jobindex)_$(dataset_key).log\n")
+        f.write("output = out/job_$(Cluster)_$(Process)_$(dataset_key).out\n")
+        f.write("error  = err/job_$(Cluster)_$(Process)_$(dataset_key).err\n")
+        f.write("log    = log/job_$(Cluster)_$(Process)_$(dataset_key).log\n")
         f.write('+SingularityImage = "/cvmfs/unpacked.cern.ch/registry.hub.docker.com/coffeateam/coffea-dask:latest"\n')
         f.write("+SingularityBindCVMFS = True\n")
         f.write("+JobFlavour = \"workday\"\n")
         f.write("request_cpus = 1\n")
         f.write("request_memory = 3000\n")
-        f.write('environment = "X509_USER_PROXY=x509up"\n')
+        f.write(f'environment = "X509_USER_PROXY=x509up SKIM_FORMAT={SKIM_FORMAT}"\n')
         f.write("X509 = x509up\n")
-        f.write(f"queue jobindex, dataset_json, dataset_key from {joblist_file}\n")
+        f.write(f"queue jobspec, dataset_json, dataset_key from {joblist_file}\n")
 
     print(f"Submitting jobs for all datasets in {dataset_basename}")
-    subprocess.run(["condor_submit", jdl_file])
+    res = subprocess.run(["condor_submit", jdl_file])
+    if CATALOGUE and res.returncode == 0:
+        with Catalogue(CATALOGUE) as wcat:
+            wcat.set_status({(k, u[0]) for k, job in jobs for u in job}, "skim", "submitted")